@@ -0,0 +1,533 @@
+"""
+Yerel mock API'ye karşı benchmark ve test altyapısı (main_premium_pro'dan ayrı tutulur:
+cron'da çalışan bot modülü mock sunucu / ölçüm kodunu taşımaz).
+
+  python3 bench.py [koşu] [--update-baseline]
+
+- MockApiServer: OKX / CoinGecko / Telegram Bot API'nin yerel HTTP taklidi (testler: tests/conftest.py)
+- run_benchmark(): main()'i mock sunucuya karşı koşup BENCH_BASELINE_PATH ile karşılaştırır
+"""
+import os
+import sys
+import json
+import time
+import random
+import threading
+import contextlib
+import io
+import tempfile
+import tracemalloc
+import multiprocessing
+import requests
+from urllib.parse import urlsplit, parse_qsl
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import main_premium_pro as bot
+
+BENCH_FIXTURE_PATH = os.getenv("BENCH_FIXTURE_PATH", "")  # boş → deterministik sentetik cevaplar
+BENCH_RUNS = 3
+BENCH_LATENCY_MS = float(os.getenv("BENCH_LATENCY_MS", "20"))  # istek başına ortalama eklenen gecikme
+BENCH_ERROR_RATE = float(os.getenv("BENCH_ERROR_RATE", "0"))   # 0-1: 500 / 429 / OKX 50011 enjekte oranı
+BENCH_SYNTH_BARS = 1500
+BENCH_BASELINE_PATH = os.getenv("BENCH_BASELINE_PATH", "bench_baseline.json")
+BENCH_TOLERANCE = 0.15  # baseline'a göre bu oranın üstünde artış → regresyon
+# Mock sunucuya karşı OKX / CoinGecko IP limitleri uygulanmaz: token bucket beklemeleri
+# ölçülen kodun süresini değil limitin kendisini ölçerdi
+BENCH_RATE_LIMIT = (100_000, 1.0)
+
+
+class MockApiServer:
+    """
+    OKX / CoinGecko / Telegram Bot API'nin yerel HTTP taklidi (benchmark ve testler için).
+    - fixture_path: HTTP_RECORD_PATH ile kaydedilmiş JSONL. İstek önce birebir parametrelerle,
+      sonra aynı path + instId ile eşleştirilir.
+    - Eşleşme yoksa deterministik sentetik cevap: tickers, candles, history-candles, trades,
+      history-trades, books, coins/markets, sendMessage.
+    - latency_ms: istek başına eklenen gecikme (±%50), error_rate: 500 / 429 / OKX 50011 oranı.
+    Sentetik mumların son barı sunucu açılışından 10 dk önce başlar → 4H tazelik filtresi
+    her koşuda aynı davranır. Mumlar en yeniden geriye doğru, istenen derinliğe kadar üretilir.
+    GET /__mock/stats → path başına istek sayıları ve gönderilen Telegram mesajı sayısı.
+    telegram_script: sıradaki sendMessage isteklerine sırayla dönecek Bot API cevapları
+    (örn. 429 retry_after, 400 parse hatası); boşsa mesaj kabul edilir.
+    """
+
+    def __init__(self, fixture_path=None, host="127.0.0.1", port=0, latency_ms=0.0, error_rate=0.0,
+                 symbols=bot.TOP_LIMIT + 10, seed=0):
+        self.fixtures = {}
+        self.fallback = {}
+        if fixture_path:
+            with open(fixture_path, encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        rec = json.loads(line)
+                        params = rec.get("params") or {}
+                        self.fixtures[self._key(rec["path"], params)] = rec["body"]
+                        self.fallback.setdefault((rec["path"], str(params.get("instId", ""))), rec["body"])
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.symbols = ["BTC-USDT", "ETH-USDT"] + [f"SYN{i:03d}-USDT" for i in range(max(0, symbols - 2))]
+        self.anchor_ms = int(time.time() * 1000) - 10 * 60_000
+        self.counts = {}
+        self.messages = []
+        self.telegram_script = []  # testler: sıradaki sendMessage'lara dönecek Bot API cevapları (FIFO)
+        self._series = {}
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive → HttpTransport havuzu gerçekteki gibi çalışır
+
+            def do_GET(self):
+                mock._handle(self, None)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                mock._handle(self, self.rfile.read(length).decode("utf-8"))
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.server.handle_error = lambda request, client_address: None  # istemci zaman aşımı / kopan bağlantı
+        self.host, self.port = self.server.server_address[:2]
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    @staticmethod
+    def _key(path, params):
+        return path, json.dumps(sorted((k, str(v)) for k, v in params.items()))
+
+    def _handle(self, req, body):
+        parts = urlsplit(req.path)
+        path = parts.path
+        params = dict(parse_qsl(parts.query))
+        if body:
+            params.update(parse_qsl(body))
+        if path == "/__mock/stats":
+            with self._lock:
+                stats = {"counts": dict(self.counts), "messages": len(self.messages)}
+            data = json.dumps(stats).encode("utf-8")
+            req.send_response(200)
+            req.send_header("Content-Type", "application/json")
+            req.send_header("Content-Length", str(len(data)))
+            req.end_headers()
+            req.wfile.write(data)
+            return
+        okx = path.startswith("/api/v5/")
+        with self._lock:
+            self.counts[path] = self.counts.get(path, 0) + 1
+            fail = self._rng.random() < self.error_rate
+            kind = self._rng.choice(("500", "429", "50011") if okx else ("500", "429"))
+            delay = self.latency_ms * self._rng.uniform(0.5, 1.5) / 1000.0
+        if delay > 0:
+            time.sleep(delay)
+
+        headers = {}
+        if not fail:
+            status, payload = 200, self.respond(path, params)
+            if payload is None:
+                status, payload = 404, {"error": "not found"}
+            elif isinstance(payload, dict) and payload.get("ok") is False:
+                status = payload.get("error_code", 400)  # Bot API hata cevabı
+        elif kind == "500":
+            status, payload = 500, {"error": "injected"}
+        elif kind == "429":
+            status, payload = 429, {"error": "injected"}
+            headers["Retry-After"] = "0"
+            if path.endswith("/sendMessage"):
+                payload = {
+                    "ok": False,
+                    "error_code": 429,
+                    "description": "Too Many Requests: retry after 0",
+                    "parameters": {"retry_after": 0},
+                }
+        else:
+            status, payload = 200, {"code": "50011", "msg": "Too Many Requests", "data": []}
+
+        data = json.dumps(payload).encode("utf-8")
+        req.send_response(status)
+        req.send_header("Content-Type", "application/json")
+        req.send_header("Content-Length", str(len(data)))
+        for k, v in headers.items():
+            req.send_header(k, v)
+        req.end_headers()
+        req.wfile.write(data)
+
+    def respond(self, path, params):
+        body = self.fixtures.get(self._key(path, params))
+        if body is None:
+            body = self.fallback.get((path, str(params.get("instId", ""))))
+        if body is not None:
+            return body
+
+        if path.endswith("/sendMessage"):
+            with self._lock:
+                scripted = self.telegram_script.pop(0) if self.telegram_script else None
+            if scripted is not None:
+                return scripted
+            if bot.utf16_len(params.get("text", "")) > bot.TELEGRAM_MAX_CHARS:
+                return {"ok": False, "error_code": 400, "description": "Bad Request: message is too long"}
+            with self._lock:
+                self.messages.append(params)
+                n = len(self.messages)
+            return {"ok": True, "result": {"message_id": n}}
+        if path.endswith("/coins/markets"):
+            if int(params.get("page", 1)) > 1:
+                return []
+            return [
+                {
+                    "id": inst.split("-")[0].lower(),
+                    "symbol": inst.split("-")[0].lower(),
+                    "market_cap": 2e12 / (i + 1),
+                    "market_cap_rank": i + 1,
+                }
+                for i, inst in enumerate(self.symbols)
+            ]
+
+        def okx(data):
+            return {"code": "0", "msg": "", "data": data}
+
+        inst_id = params.get("instId", "")
+        if path == "/api/v5/market/tickers":
+            if params.get("instType") == "SWAP":
+                return okx([self._swap_ticker(inst) for inst in self.symbols])
+            return okx(
+                [
+                    self._ticker(inst, 1e9 / (i + 1))
+                    for i, inst in enumerate(self.symbols)
+                ]
+            )
+        if path == "/api/v5/public/funding-rate":
+            return okx(
+                [
+                    {
+                        "instId": inst + "-SWAP",
+                        "fundingRate": repr(random.Random(f"{inst}|funding").uniform(-0.0005, 0.0007)),
+                        "fundingTime": str(self.anchor_ms),
+                    }
+                    for inst in self.symbols
+                ]
+            )
+        if path == "/api/v5/public/open-interest":
+            return okx(
+                [
+                    {
+                        "instId": inst + "-SWAP",
+                        "instType": "SWAP",
+                        "oiUsd": repr(random.Random(f"{inst}|oi").uniform(1e5, 5e8)),
+                        "ts": str(self.anchor_ms),
+                    }
+                    for inst in self.symbols
+                ]
+            )
+        if path in ("/api/v5/market/candles", "/api/v5/market/history-candles"):
+            bar = params.get("bar", "1m")
+            step = bot.BAR_MS.get(bar, 60_000)
+            cap = bot.OKX_HISTORY_CANDLE_PAGE if "history" in path else bot.OKX_CANDLE_PAGE
+            limit = min(int(params.get("limit", 100)), cap)
+            # Satır k'nin ts'i anchor - k*step → after/before filtresi indeks aritmetiğiyle
+            start = 0
+            if "after" in params:
+                start = max(0, (self.anchor_ms - int(params["after"])) // step + 1)
+            end = start + limit
+            if "before" in params:
+                end = min(end, max(0, -((int(params["before"]) - self.anchor_ms) // step)))
+            return okx(self._candles(inst_id, bar, end)[start:end])
+        if path in ("/api/v5/market/trades", "/api/v5/market/history-trades"):
+            # tradeId'ler 1_000_000'dan geriye ardışık → `after` sayfalaması indeks aritmetiğiyle
+            start = 1_000_000 - int(params["after"]) + 1 if "after" in params else 0
+            if path.endswith("/trades") and start:
+                return okx([])
+            return okx(self._trades(inst_id, min(int(params.get("limit", 100)), 500), start))
+        if path == "/api/v5/market/books":
+            last = self._last_px(inst_id)
+            rng = random.Random(f"{inst_id}|books")
+            depth = int(params.get("sz", 1))
+            asks = [[repr(last * (1 + 0.0005 * (k + 1))), repr(rng.uniform(1, 50) * 1000 / last), "0", "1"] for k in range(depth)]
+            bids = [[repr(last * (1 - 0.0005 * (k + 1))), repr(rng.uniform(1, 50) * 1000 / last), "0", "1"] for k in range(depth)]
+            return okx([{"asks": asks, "bids": bids, "ts": str(self.anchor_ms)}])
+        return None
+
+    def _swap_ticker(self, inst_id):
+        last = self._last_px(inst_id) * (1 + random.Random(f"{inst_id}|basis").uniform(-0.002, 0.002))
+        return {"instId": inst_id + "-SWAP", "instType": "SWAP", "last": repr(last), "ts": str(self.anchor_ms)}
+
+    def _ticker(self, inst_id, vol_ccy):
+        rng = random.Random(f"{inst_id}|ticker")
+        last = self._last_px(inst_id)
+        low = last * (1 - rng.uniform(0.005, 0.08))
+        high = last * (1 + rng.uniform(0.005, 0.08))
+        half = last * rng.uniform(0.00005, 0.002)
+        return {
+            "instId": inst_id,
+            "last": repr(last),
+            "open24h": repr(rng.uniform(low, high)),
+            "high24h": repr(high),
+            "low24h": repr(low),
+            "bidPx": repr(last - half),
+            "askPx": repr(last + half),
+            "bidSz": repr(rng.uniform(10, 5000) / last),
+            "askSz": repr(rng.uniform(10, 5000) / last),
+            "volCcy24h": repr(vol_ccy),
+            "ts": str(self.anchor_ms),
+        }
+
+    @staticmethod
+    def _last_px(inst_id):
+        return random.Random(f"{inst_id}|px").uniform(0.5, 500.0)
+
+    def _candles(self, inst_id, bar, depth):
+        """
+        (instId, bar) için deterministik random-walk mumlar, OKX gibi en yeni başta.
+        Seri son fiyattan geriye doğru yürür; yalnızca istenen `depth` kadar üretilir (en fazla BENCH_SYNTH_BARS).
+        """
+        depth = min(depth, BENCH_SYNTH_BARS)
+        key = (inst_id, bar)
+        with self._lock:
+            state = self._series.get(key)
+            if state is None:
+                state = {"rows": [], "rng": random.Random(f"{inst_id}|{bar}"), "close": self._last_px(inst_id)}
+                self._series[key] = state
+            rows = state["rows"]
+            rng = state["rng"]
+            step = bot.BAR_MS.get(bar, 60_000)
+            while len(rows) < depth:
+                k = len(rows)
+                c = state["close"]
+                o = c / (1 + rng.gauss(0, 0.02))
+                h = max(o, c) * (1 + abs(rng.gauss(0, 0.005)))
+                l = min(o, c) * (1 - abs(rng.gauss(0, 0.005)))
+                vol = rng.uniform(1e3, 1e5)
+                confirm = "0" if k == 0 else "1"
+                t = self.anchor_ms - k * step
+                rows.append([str(t), repr(o), repr(h), repr(l), repr(c), repr(vol), repr(vol * c), repr(vol * c), confirm])
+                state["close"] = o
+            return rows[:depth]
+
+    def _trades(self, inst_id, limit, start=0):
+        last = self._last_px(inst_id)
+        rng = random.Random(f"{inst_id}|trades")
+        out = []
+        for k in range(start + limit):
+            usd = rng.lognormvariate(8.5, 1.5)
+            out.append(
+                {
+                    "instId": inst_id,
+                    "tradeId": str(1_000_000 - k),
+                    "px": repr(last),
+                    "sz": repr(usd / last),
+                    "side": "buy" if rng.random() < 0.5 else "sell",
+                    "ts": str(self.anchor_ms - k * 500),
+                }
+            )
+        return out[start:]
+
+
+def _mock_process_main(conn, kwargs):
+    server = MockApiServer(**kwargs)
+    conn.send(server.base_url)
+    server.server.serve_forever()
+
+
+def start_mock_process(**kwargs):
+    """
+    MockApiServer'ı ayrı bir süreçte başlatır: sunucunun CPU / bellek / GIL maliyeti
+    ölçülen bot sürecine karışmaz. Dönen: (process, base_url)
+    """
+    parent, child = multiprocessing.Pipe()
+    proc = multiprocessing.Process(target=_mock_process_main, args=(child, kwargs), daemon=True)
+    proc.start()
+    return proc, parent.recv()
+
+
+def mock_request_count(base_url):
+    stats = requests.get(base_url + "/__mock/stats", timeout=10).json()
+    return sum(stats["counts"].values())
+
+
+def _bench_run(base_url):
+    """main()'i mock sunucuya karşı bir kez koşar ve ölçümleri döner."""
+    bot.TRANSPORT = bot.HttpTransport()
+    bot.MCAP_CACHE = {}
+    served_before = mock_request_count(base_url)
+    tracemalloc.reset_peak()
+    t0 = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = bot.main() or {}
+    wall = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    http = bot.TRANSPORT.stats()
+    return {
+        "wall_s": wall,
+        "scan_wall_s": result.get("scan", {}).get("wall_s", 0.0),
+        "requests": sum(st["requests"] for st in http.values()),
+        "errors": sum(st["errors"] for st in http.values()),
+        "served": mock_request_count(base_url) - served_before,
+        "peak_mem_mb": peak / 1e6,
+        "analyzer_s": {
+            tf: bot.METRICS.summary(f"analyze.{tf}").get(f"analyze.{tf}", {}).get("total_s", 0.0)
+            for tf in ("1h", "4h")
+        },
+        "signals": result.get("pre_signals", 0) + result.get("signals_4h", 0),
+    }
+
+
+def _median(values):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    mid = len(values) // 2
+    return values[mid] if len(values) % 2 else (values[mid - 1] + values[mid]) / 2
+
+
+def bench_summary(runs):
+    """İlk koşu soğuk (boş mum deposu), kalanlar sıcak → ayrı ayrı raporlanır."""
+    cold = runs[0]
+    warm = runs[1:] or runs
+    return {
+        "cold_wall_s": cold["wall_s"],
+        "cold_requests": cold["requests"],
+        "warm_wall_s": _median([r["wall_s"] for r in warm]),
+        "warm_scan_wall_s": _median([r["scan_wall_s"] for r in warm]),
+        "warm_requests": _median([r["requests"] for r in warm]),
+        "analyzer_1h_s": _median([r["analyzer_s"].get("1h", 0.0) for r in warm]),
+        "analyzer_4h_s": _median([r["analyzer_s"].get("4h", 0.0) for r in warm]),
+        "peak_mem_mb": max(r["peak_mem_mb"] for r in runs),
+    }
+
+
+def bench_compare(summary, baseline, tolerance=BENCH_TOLERANCE):
+    """Baseline'a göre `tolerance` oranından fazla artan metrikler: [(metrik, baseline, şimdi)]."""
+    regressions = []
+    for key, value in summary.items():
+        base = baseline.get(key)
+        if base and value > base * (1 + tolerance):
+            regressions.append((key, base, value))
+    return regressions
+
+
+# Koşu süresince mock'a / geçici dizine çevrilen bot ayarları (sonunda geri yüklenir)
+_BENCH_OVERRIDES = (
+    "OKX_BASE", "COINGECKO", "TELEGRAM_API", "TELEGRAM_TOKEN", "CHAT_ID", "CANDLE_DB_PATH", "CANDLE_STORE",
+    "TRANSPORT", "RATE_LIMITS", "RUN_REPORT_PATH", "PROMETHEUS_TEXTFILE", "MCAP_CACHE_PATH",
+    "ANALYSIS_CACHE_PATH", "TELEGRAM_OUTBOX_PATH", "SIGNAL_DB_PATH",
+)
+
+
+def run_benchmark(runs=BENCH_RUNS, update_baseline=False, baseline_path=BENCH_BASELINE_PATH):
+    """
+    main()'i yerel MockApiServer'a karşı `runs` kez koşar (geçici mum deposuyla: ilk koşu
+    soğuk, sonrakiler sıcak). Duvar saati, istek sayısı, tracemalloc bellek tepe noktası ve
+    analizör süreleri baseline_path ile karşılaştırılır.
+    Baseline yoksa koşmadan FileNotFoundError; update_baseline=True → ölçüm baseline olarak yazılır.
+    Dönen: regresyon listesi (boş → geçti).
+    """
+    baseline = {}
+    if not update_baseline:
+        if not baseline_path or not os.path.exists(baseline_path):
+            raise FileNotFoundError(
+                f"Benchmark baseline'ı yok: {baseline_path or '(BENCH_BASELINE_PATH boş)'} — "
+                f"önce `python3 bench.py --update-baseline` ile oluşturun"
+            )
+        with open(baseline_path, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    saved = {name: getattr(bot, name) for name in _BENCH_OVERRIDES}
+    proc, base_url = start_mock_process(
+        fixture_path=BENCH_FIXTURE_PATH or None, latency_ms=BENCH_LATENCY_MS, error_rate=BENCH_ERROR_RATE
+    )
+    tmpdir = tempfile.TemporaryDirectory()
+    bot.RUN_REPORT_PATH = bot.PROMETHEUS_TEXTFILE = ""  # bench koşuları gerçek run raporunun üzerine yazmasın
+    bot.OKX_BASE = base_url
+    bot.COINGECKO = base_url + "/api/v3"
+    bot.TELEGRAM_API = base_url
+    bot.TELEGRAM_TOKEN = "bench"
+    bot.CHAT_ID = "bench"
+    bot.RATE_LIMITS = {key: BENCH_RATE_LIMIT for key in bot.RATE_LIMITS}
+    bot.CANDLE_DB_PATH = os.path.join(tmpdir.name, "bench.sqlite") if bot.CANDLE_DB_PATH else ""
+    bot.MCAP_CACHE_PATH = os.path.join(tmpdir.name, "mcap_cache.json") if bot.MCAP_CACHE_PATH else ""
+    bot.ANALYSIS_CACHE_PATH = os.path.join(tmpdir.name, "analysis_cache.json") if bot.ANALYSIS_CACHE_PATH else ""
+    bot.TELEGRAM_OUTBOX_PATH = os.path.join(tmpdir.name, "telegram_outbox.sqlite")
+    # Koşular arası tekrar bastırma sinyal sayısını değiştirmesin → her koşu boş depo
+    bot.SIGNAL_DB_PATH = ""
+    bot.CANDLE_STORE = None
+    print(
+        f"Benchmark: {base_url}, {runs} koşu, gecikme {BENCH_LATENCY_MS:.0f} ms, "
+        f"hata oranı %{BENCH_ERROR_RATE*100:.0f}, fixture: {BENCH_FIXTURE_PATH or 'sentetik'}"
+    )
+    tracemalloc.start()
+    try:
+        results = []
+        for i in range(runs):
+            r = _bench_run(base_url)
+            results.append(r)
+            print(
+                f"  koşu {i + 1}: {r['wall_s']:.2f} sn (tarama {r['scan_wall_s']:.2f} sn), "
+                f"{r['requests']} istek, {r['errors']} hata, tepe bellek {r['peak_mem_mb']:.1f} MB, "
+                f"1H {r['analyzer_s'].get('1h', 0.0):.2f} sn / 4H {r['analyzer_s'].get('4h', 0.0):.2f} sn, "
+                f"{r['signals']} sinyal"
+            )
+    finally:
+        tracemalloc.stop()
+        proc.terminate()
+        proc.join()
+        if bot.CANDLE_STORE is not None:
+            bot.CANDLE_STORE.close()
+        if bot.TELEGRAM_DELIVERY is not None:
+            bot.TELEGRAM_DELIVERY.stop()
+            bot.TELEGRAM_DELIVERY = None
+        for name, value in saved.items():
+            setattr(bot, name, value)
+        tmpdir.cleanup()
+
+    summary = bench_summary(results)
+    regressions = bench_compare(summary, baseline) if baseline else []
+    for key, value in summary.items():
+        base = baseline.get(key)
+        delta = f" (baseline {base:.2f}, {((value / base) - 1) * 100:+.0f}%)" if base else ""
+        print(f"  {key}: {value:.2f}{delta}")
+    for key, base, value in regressions:
+        print(f"⚠ Regresyon: {key} {base:.2f} → {value:.2f} (tolerans %{BENCH_TOLERANCE*100:.0f})")
+
+    if update_baseline:
+        with open(baseline_path, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2, sort_keys=True)
+        print(f"Baseline yazıldı: {baseline_path}")
+    return regressions
+
+
+def cli(argv):
+    """
+    Kullanım:
+      python3 bench.py [koşu] [--update-baseline]  → yerel mock API'ye karşı benchmark
+    Baseline (BENCH_BASELINE_PATH) yoksa çıkış kodu 2; regresyon varsa 1.
+    """
+    args = [a for a in argv if not a.startswith("--")]
+    try:
+        regressions = run_benchmark(
+            runs=int(args[0]) if args else BENCH_RUNS, update_baseline="--update-baseline" in argv
+        )
+    except FileNotFoundError as e:
+        print(f"❌ {e}")
+        sys.exit(2)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    cli(sys.argv[1:])
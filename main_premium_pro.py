@@ -1,15 +1,55 @@
 import os
+import sys
+import csv
+import itertools
+import ssl
+import json
 import time
+import queue
+import base64
+import select
+import socket
+import struct
+import zlib
+import bisect
+import math
+import hashlib
+import random
+import sqlite3
+import threading
+import socketserver
+import contextlib
+import multiprocessing
 import requests
+from array import array
+from collections import OrderedDict, deque
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from datetime import datetime, timezone
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
 
-# === BASE URL'LER ===
-OKX_BASE = "https://www.okx.com"
-COINGECKO = "https://api.coingecko.com/api/v3"
+try:
+    import numpy as np
+except ImportError:  # NumPy opsiyonel: yoksa toplu motor devre dışı
+    np = None
+
+# === BASE URL'LER === (benchmark / test için yerel mock sunucuya yönlendirilebilir)
+OKX_BASE = os.getenv("OKX_BASE", "https://www.okx.com")
+COINGECKO = os.getenv("COINGECKO", "https://api.coingecko.com/api/v3")
+TELEGRAM_API = os.getenv("TELEGRAM_API", "https://api.telegram.org")
 
 # === TELEGRAM ===
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
-CHAT_ID = os.getenv("CHAT_ID")
+CHAT_ID = os.getenv("CHAT_ID")  # virgülle birden fazla sohbet: "123,-100456"
+TELEGRAM_MAX_CHARS = 4096  # Bot API sendMessage metin sınırı (UTF-16 kod birimi, bkz. utf16_len)
+# Gönderilmemiş mesajlar (parçalar) burada kalır, sonraki run'da ilk iş teslim edilir. Boş → sadece bellek
+TELEGRAM_OUTBOX_PATH = os.getenv("TELEGRAM_OUTBOX_PATH", "telegram_outbox.sqlite")
+TELEGRAM_MAX_ATTEMPTS = 8  # 5xx / ağ hatasında parça başına deneme (429 retry_after sayılmaz)
+TELEGRAM_FLUSH_S = 120     # run sonunda outbox'ın boşalması için beklenen en fazla süre
+# Outbox'ta bundan uzun bekleyen parça gönderilmez (eski run'ın "kesin sinyal"i saatler sonra güncelmiş gibi gitmesin).
+# 4H tazelik penceresiyle (MAX_4H_AGE_MS) aynı
+TELEGRAM_MAX_AGE_S = 90 * 60
 
 # === GENEL PARAMETRELER ===
 TOP_LIMIT = 150          # En çok hacimli 150 spot USDT coini
@@ -22,19 +62,186 @@ ORDERBOOK_DEPTH = 20
 NET_DELTA_MIN_POS = 50_000    # Long için minimum net alış delta
 NET_DELTA_MIN_NEG = -50_000   # Short için minimum net satış delta
 ORDERBOOK_IMB_RATIO = 1.3     # Bid/Ask notional dengesizliği oranı
+FLOW_RATIO_MIN = 0.55         # Son 20 trade'de buy (sell) oranı bunun üstündeyse flow koşulu
+WHALE_SCALE = 1.0             # Segment whale eşiklerinin (S/M/X) çarpanı
 
 # Fiyat yapısı parametreleri (4H)
 STRUCT_LOOKBACK_4H = 20
+STRUCT_LOOKBACK_1H = 15
+CANDLE_LIMIT_1H_PRE = 80  # 1H pre-signal için yeterli bar
 ZONE_BUFFER = 0.002  # %0.2
 
 # Strateji modu: 4 koşuldan en az 3'ü sağlamalı
 MIN_CONDITIONS_STRICT = 3
 
+# Türev (USDT-SWAP) bağlamı: funding, open interest ve perp ticker'ları instType başına tek
+# toplu istekle çekilip spot evrenine base currency ile eşlenir. "1" → 4H analizinde ek koşullar
+DERIV_ENRICH = os.getenv("DERIV_ENRICH", "0") == "1"
+DERIV_FUNDING_NEUTRAL = 0.0001  # OKX taban funding (8 saatlik %0.01); üstü long, altı short kalabalığı
+DERIV_MIN_OI_USD = 1_000_000    # open interest bunun altındaki perp'ler bağlam sayılmaz
+DERIV_EXTRA_REQUIRED = 1        # türev koşulları eklenince MIN_CONDITIONS_STRICT'e eklenen şart sayısı
+
 # 4H mum kapanışı sonrası sinyal için izin verilen maksimum yaş (ms)
 MAX_4H_AGE_MS = 90 * 60 * 1000  # 90 dakika
 
+# Kalıcı mum deposu (SQLite). Boş bırakılırsa kapalı → her run tüm mumlar yeniden çekilir
+CANDLE_DB_PATH = os.getenv("CANDLE_DB_PATH", "okx_candles.sqlite")
+OKX_CANDLE_PAGE = 300          # /market/candles tek istekte en fazla 300 bar
+OKX_HISTORY_CANDLE_PAGE = 100  # /market/history-candles tek istekte en fazla 100 bar
+
+# Bar süreleri (ms)
+BAR_MS = {
+    "1m": 60_000,
+    "5m": 5 * 60_000,
+    "15m": 15 * 60_000,
+    "30m": 30 * 60_000,
+    "1H": 60 * 60_000,
+    "2H": 2 * 60 * 60_000,
+    "4H": 4 * 60 * 60_000,
+    "1D": 24 * 60 * 60_000,
+}
+
+# 1H'den yerel türetilebilen barlar: bar → (süre ms, UTC hizalama ofseti ms).
+# OKX 6H ve üstü barları varsayılan olarak Hong Kong (UTC+8) saatine hizalar → "1D" 16:00 UTC'de açılır.
+RESAMPLE_BARS = {
+    "2H": (2 * 60 * 60_000, 0),
+    "4H": (4 * 60 * 60_000, 0),
+    "6H": (6 * 60 * 60_000, 4 * 60 * 60_000),
+    "12H": (12 * 60 * 60_000, 4 * 60 * 60_000),
+    "1D": (24 * 60 * 60_000, 16 * 60 * 60_000),
+    "6Hutc": (6 * 60 * 60_000, 0),
+    "12Hutc": (12 * 60 * 60_000, 0),
+    "1Dutc": (24 * 60 * 60_000, 0),
+}
+# Virgüllü liste, örn. "4H" ya da "4H,1D": bu barlar OKX'ten çekilmez, 1H serisinden türetilir
+RESAMPLE_FROM_1H = {b for b in os.getenv("RESAMPLE_FROM_1H", "").split(",") if b in RESAMPLE_BARS}
+
+# Kalıcı sinyal deposu (SQLite): run'lar arası tekrar bastırma + açık sinyallerin TP/stop takibi. Boş → kapalı
+SIGNAL_DB_PATH = os.getenv("SIGNAL_DB_PATH", "signals.sqlite")
+SIGNAL_RETENTION_DAYS = int(os.getenv("SIGNAL_RETENTION_DAYS", "90"))  # kapanmış sinyaller bu kadar gün tutulur
+
+# Run'lar arası analiz cache'i: yapı / EMA / MACD akış durumları (instId, bar, parametreler)
+# anahtarıyla diske yazılır, her run yalnız yeni kapanan barları işler. Boş → kapalı
+ANALYSIS_CACHE_PATH = os.getenv("ANALYSIS_CACHE_PATH", "analysis_cache.json")
+ANALYSIS_CACHE_MAX = 5000   # LRU: en fazla kayıt
+ANALYSIS_CACHE_VERSION = 3  # hesap mantığı değişirse artır → eski kayıtlar kullanılmaz
+
+# Ticker ön-filtresi: >0 → tüm USDT evreni toplu ticker cevabından skorlanır, sadece ilk K derin analize girer.
+# 0 → eski davranış (24h hacme göre ilk TOP_LIMIT)
+PREFILTER_TOP_K = int(os.getenv("PREFILTER_TOP_K", "0"))
+PREFILTER_MIN_VOL_USDT = 100_000  # 24h quote hacmi bunun altındaki pariteler elenir
+PREFILTER_MAX_SPREAD = 0.01       # %1'den geniş spread → elenir
+PREFILTER_WEIGHTS = {"range": 1.0, "extreme": 1.0, "spread": 0.5, "skew": 0.5, "volume": 0.5}
+
+# Zaman pencereli order-flow. Boş → son TRADES_LIMIT trade snapshot'ı (varsayılan)
+ORDERFLOW_WINDOWS = {"5m": 5 * 60_000, "1h": 60 * 60_000, "4h": 4 * 60 * 60_000}
+# Pencere modunda buy_ratio / sell_ratio pencere içindeki TÜM trade'lerin adet oranıdır
+# (snapshot modundaki gibi son 20 trade değil) → FLOW_RATIO_MIN daha yavaş tepki verir.
+ORDERFLOW_WINDOW = os.getenv("ORDERFLOW_WINDOW", "")
+ORDERFLOW_RING_CAPACITY = 50_000  # sembol + pencere başına en fazla trade (sabit bellek)
+HISTORY_TRADES_PAGE = 100
+# Sembol başına backfill sayfa sınırı (20 sayfa = 2000 trade; likit paritelerde pencerenin birkaç dakikası).
+# Sınıra takılan backfill özetinde "truncated" işaretlenir; dolu kısım depoya yazılıp sonraki run'da
+# kaldığı yerden (cursor) devam edilir.
+HISTORY_TRADES_MAX_PAGES = int(os.getenv("HISTORY_TRADES_MAX_PAGES", "20"))
+# "0" → penceresi eksik (truncated) order-flow özeti analizöre verilmez (sembol no_trades sayılır)
+ORDERFLOW_ALLOW_PARTIAL = os.getenv("ORDERFLOW_ALLOW_PARTIAL", "1") == "1"
+
+# Eşzamanlı tarama (thread havuzu). 1 → eski sıralı tarama
+SCAN_WORKERS = int(os.getenv("SCAN_WORKERS", "8"))
+# Run başından itibaren süre bütçesi (sn). Dolunca kalan semboller atlanır, rapor kısmi sonuçla gider.
+# Saatlik cron'un bir sonraki tetiklemesine taşmasın diye varsayılan 45 dk; 0 → sınırsız
+SCAN_DEADLINE_S = float(os.getenv("SCAN_DEADLINE_S", str(45 * 60)))
+SCAN_PRECOMPUTE_SHARE = 0.75  # toplu yapı ön-hesabının kullanabileceği kalan bütçe oranı
+# Parçalı tarama: sembol listesi SCAN_SHARDS parçaya bölünür, SCAN_PROCESSES süreç yerel kuyruktan
+# parça çekip tarar (GIL'siz analiz). 0/1 → tek süreç (eski davranış); SCAN_PROCESSES 0 → CPU sayısı
+SCAN_SHARDS = int(os.getenv("SCAN_SHARDS", "0"))
+SCAN_PROCESSES = int(os.getenv("SCAN_PROCESSES", "0"))
+SHARD_POLL_S = 1.0  # koordinatörün sonuç kuyruğunu bekleme / ölü worker kontrol aralığı
+
+# Akışlı sinyal teslimi: tarama sürerken güçlü 4H sinyalleri anında, diğerleri toplu gönderilir.
+# Run sonu özet mesajı her durumda gider. "0" → yalnız özet (eski davranış)
+STREAM_ALERTS = os.getenv("STREAM_ALERTS", "1") == "1"
+STREAM_MIN_CONFIDENCE = 80         # bu güven ve üstündeki 4H sinyaller beklemeden tek tek gider
+STREAM_PRESIGNAL_DEBOUNCE_S = 30.0  # ilk bekleyen pre-signal'dan bu kadar sonra toplu gönderim
+STREAM_PRESIGNAL_BATCH = 5          # ya da bu kadar birikince
+# Akışlı modda toplu ön-hesap tüm evren için değil bu kadar sembollük dilimlerle yapılır:
+# ilk dilimin sinyalleri tüm mumlar inmeden çıkar (ilk uyarı süresi). 0 → tek seferlik ön-hesap
+STREAM_SCAN_CHUNK = int(os.getenv("STREAM_SCAN_CHUNK", "32"))
+
+# Toplu NumPy indikatör motoru (NumPy kurulu değilse skaler fonksiyonlar kullanılır)
+USE_BATCH_ENGINE = os.getenv("USE_BATCH_ENGINE", "1") == "1"
+
+# HTTP transport: kalıcı bağlantı havuzu + exponential backoff (jitter'lı)
+HTTP_POOL_SIZE = 32
+BACKOFF_BASE_S = 0.5
+BACKOFF_MAX_S = 8.0
+
+# Uç başına hız limitleri: (istek, saniye) — OKX API v5 public market limitleri (IP başına)
+RATE_LIMITS = {
+    "/api/v5/market/tickers": (20, 2.0),
+    "/api/v5/market/candles": (40, 2.0),
+    "/api/v5/market/history-candles": (20, 2.0),
+    "/api/v5/market/trades": (100, 2.0),
+    "/api/v5/market/history-trades": (20, 2.0),
+    "/api/v5/market/books": (40, 2.0),
+    "/api/v5/public/funding-rate": (20, 2.0),
+    "/api/v5/public/open-interest": (20, 2.0),
+    "api.coingecko.com": (10, 60.0),  # CoinGecko public (anahtarsız) limit
+}
+DEFAULT_RATE_LIMIT = (20, 2.0)
+# OKX rate-limit hata kodları (50011: Too Many Requests, 50061: alt hesap limiti) — yalnız bunlar tekrar denenir
+OKX_RATE_LIMIT_CODES = {"50011", "50061"}
+
+# Canlı mod (WebSocket). Candle kanalları OKX'te "business" ucunda yayınlanır
+OKX_WS_PUBLIC = os.getenv("OKX_WS_PUBLIC", "wss://ws.okx.com:8443/ws/v5/public")
+OKX_WS_BUSINESS = os.getenv("OKX_WS_BUSINESS", "wss://ws.okx.com:8443/ws/v5/business")
+WS_PING_INTERVAL_S = 25      # OKX 30 sn mesajsız bağlantıyı kapatır
+WS_SUBSCRIBE_CHUNK = 100     # tek subscribe mesajındaki kanal sayısı
+LIVE_BOOK_CHANNEL = "books"  # 400 seviye snapshot + delta (checksum'lı); "books5" → 5 seviye
+LIVE_EVAL_DEBOUNCE_S = 2.0   # aynı anda kapanan mumları tek değerlendirmede topla
+LIVE_RECORD_PATH = os.getenv("LIVE_RECORD_PATH", "")  # doluysa gelen tüm WS mesajları JSONL kaydedilir
+LIVE_RESYNC_WAIT_S = 30.0    # yeniden bağlanan akışın REST senkronu bitene kadar değerlendirme en fazla bu kadar bekler
+
+# Backtest
+BACKTEST_WORKERS = int(os.getenv("BACKTEST_WORKERS", str(os.cpu_count() or 2)))
+BACKTEST_BARS_4H = 6 * 365 * 2     # ~2 yıl 4H geçmiş
+BACKTEST_MAX_HOLD_BARS = 30        # sinyal sonrası TP/stop için izlenen en fazla bar
+BACKTEST_BARS_1H = 24 * 30         # 1H ön-sinyal backtest'i ~30 gün; trade deposu da bu pencereyi tutar
+BACKTEST_PRESIGNAL_HORIZON = 4     # ön-sinyal isabeti: bu kadar 1H bar sonraki kapanış sinyal yönünde mi
+TRADE_RETENTION_MS = BACKTEST_BARS_1H * BAR_MS["1H"]  # depodaki trade'ler sembolün son trade'inden bu kadar geriye tutulur
+BACKTEST_FLOW_PROXY = os.getenv("BACKTEST_FLOW_PROXY", "candle")  # trade kaydı olmayan barlar: "candle" | "none"
+BACKTEST_REPORT_PATH = os.getenv("BACKTEST_REPORT_PATH", "backtest_report.json")
+
+# Parametre taraması (sweep): grid ya da grid değerlerinden rastgele örnekleme
+SWEEP_GRID = {
+    "NET_DELTA_MIN_POS": [25_000, 50_000, 100_000, 250_000],
+    "NET_DELTA_MIN_NEG": [-25_000, -50_000, -100_000, -250_000],
+    "MIN_CONDITIONS_STRICT": [2, 3, 4],
+    "FLOW_RATIO_MIN": [0.5, 0.55, 0.6, 0.65],
+    "WHALE_SCALE": [0.5, 1.0, 1.5, 2.0],
+    "STRUCT_LOOKBACK_4H": [10, 20, 30],
+    "ZONE_BUFFER": [0.001, 0.002, 0.004],
+}
+SWEEP_MODE = os.getenv("SWEEP_MODE", "grid")  # "grid" | "random"
+SWEEP_SAMPLES = 2000                          # random modda denenecek kombinasyon
+SWEEP_MIN_SIGNALS = 20                        # sıralamada öne alınmak için en az sinyal
+SWEEP_CHUNK = 64                              # işçi başına tek seferde kombinasyon
+SWEEP_RESULTS_PATH = os.getenv("SWEEP_RESULTS_PATH", "sweep_results.csv")
+
+# HTTP kaydı: benchmark'ın (bench.py) mock sunucusu bu fixture'ı oynatabilir
+HTTP_RECORD_PATH = os.getenv("HTTP_RECORD_PATH", "")  # doluysa başarılı GET cevapları JSONL fixture'a kaydedilir
+
+# Run raporu: span süreleri + uç başına HTTP metrikleri (JSON) ve opsiyonel Prometheus textfile
+RUN_REPORT_PATH = os.getenv("RUN_REPORT_PATH", "run_report.json")
+PROMETHEUS_TEXTFILE = os.getenv("PROMETHEUS_TEXTFILE", "")  # örn. /var/lib/node_exporter/premium_pro.prom
+METRICS_PREFIX = "premium_pro"
+
 # MCAP cache (CoinGecko)
 MCAP_CACHE = {}  # "BTC" -> market_cap (USD)
+MCAP_CACHE_PATH = os.getenv("MCAP_CACHE_PATH", "mcap_cache.json")  # boş → disk cache kapalı
+MCAP_TTL_S = float(os.getenv("MCAP_TTL_S", str(6 * 3600)))  # bu yaştan eskiyse arka planda yenilenir
+MCAP_REFRESH_JOIN_S = 60  # run sonunda arka plan yenilemesinin diske yazmasını en fazla bu kadar bekle
 
 
 # ========== YARDIMCI FONKSİYONLAR ==========
@@ -43,20 +250,307 @@ def ts():
     return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S UTC")
 
 
+class TokenBucket:
+    """
+    Thread-safe token bucket: `capacity` istek / `period` saniye.
+    acquire() token yoksa bir sonraki token'a kadar bekler.
+    """
+
+    def __init__(self, capacity, period):
+        self.capacity = float(capacity)
+        self.rate = capacity / period
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def drain(self):
+        """Sunucu rate-limit döndüğünde kovayı boşalt → sonraki istekler yavaşlasın."""
+        with self._lock:
+            self.tokens = 0.0
+            self.updated = time.monotonic()
+
+
+def _percentile(sorted_values, q):
+    """Sıralı listede nearest-rank yüzdelik (q: 0-100)."""
+    if not sorted_values:
+        return 0.0
+    idx = max(0, min(len(sorted_values) - 1, int(round(q / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[idx]
+
+
+class RunMetrics:
+    """
+    Run başına süre örnekleri (thread-safe): span'ler ("fetch.candles", "analyze.4h" ...)
+    ve HTTP gecikmeleri ("http:/api/v5/market/candles") aynı yerde tutulur.
+    summary() → isim başına count / toplam / p50 / p95 / p99 / max.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples = {}
+
+    def reset(self):
+        with self._lock:
+            self._samples = {}
+
+    def observe(self, name, seconds):
+        with self._lock:
+            samples = self._samples.get(name)
+            if samples is None:
+                samples = array("d")
+                self._samples[name] = samples
+            samples.append(seconds)
+
+    def export(self):
+        """Ham örnekler {isim: [sn, ...]} (worker süreçlerinden koordinatöre taşınır)."""
+        with self._lock:
+            return {k: list(v) for k, v in self._samples.items()}
+
+    def merge(self, samples):
+        with self._lock:
+            for name, values in samples.items():
+                self._samples.setdefault(name, array("d")).extend(values)
+
+    @contextlib.contextmanager
+    def span(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - t0)
+
+    def summary(self, prefix=None):
+        with self._lock:
+            items = [(k, sorted(v)) for k, v in self._samples.items() if prefix is None or k.startswith(prefix)]
+        out = {}
+        for name, values in sorted(items):
+            out[name] = {
+                "count": len(values),
+                "total_s": sum(values),
+                "p50_s": _percentile(values, 50),
+                "p95_s": _percentile(values, 95),
+                "p99_s": _percentile(values, 99),
+                "max_s": values[-1] if values else 0.0,
+            }
+        return out
+
+
+METRICS = RunMetrics()
+
+
+def span(name):
+    """with span("fetch.trades"): ... → süre METRICS'e yazılır."""
+    return METRICS.span(name)
+
+
+class HttpTransport:
+    """
+    Paylaşılan HTTP katmanı:
+    - Tek requests.Session + bağlantı havuzu (keep-alive, TCP/TLS el sıkışması bir kez)
+    - Uç başına token bucket hız sınırı (RATE_LIMITS)
+    - Jitter'lı exponential backoff (429 / 5xx / ağ hatası / OKX rate-limit kodu)
+    - Uç başına istek, hata, retry ve gecikme sayaçları
+    """
+
+    def __init__(self, pool_size=HTTP_POOL_SIZE):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._stats = {}
+        self._record_lock = threading.Lock()
+
+    def endpoint_key(self, url):
+        parts = urlsplit(url)
+        if parts.path in RATE_LIMITS:
+            return parts.path
+        if parts.netloc in RATE_LIMITS:
+            return parts.netloc
+        return parts.path or parts.netloc
+
+    def _bucket(self, key):
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(*RATE_LIMITS.get(key, DEFAULT_RATE_LIMIT))
+                self._buckets[key] = bucket
+            return bucket
+
+    def _stat(self, key):
+        st = self._stats.get(key)
+        if st is None:
+            st = {
+                "requests": 0,
+                "errors": 0,
+                "retries": 0,
+                "rate_limited": 0,
+                "bytes": 0,
+                "latency_total_s": 0.0,
+                "latency_max_s": 0.0,
+            }
+            self._stats[key] = st
+        return st
+
+    def record(self, key, latency=None, error=False, retry=False, rate_limited=False, nbytes=0):
+        if latency is not None:
+            METRICS.observe("http:" + key, latency)
+        with self._lock:
+            st = self._stat(key)
+            if latency is not None:
+                st["requests"] += 1
+                st["latency_total_s"] += latency
+                st["latency_max_s"] = max(st["latency_max_s"], latency)
+            st["bytes"] += nbytes
+            if error:
+                st["errors"] += 1
+            if retry:
+                st["retries"] += 1
+            if rate_limited:
+                st["rate_limited"] += 1
+
+    def backoff(self, attempt, retry_after=None):
+        if retry_after is not None:
+            delay = retry_after
+        else:
+            # Full jitter: [0, min(max, base * 2^attempt)]
+            delay = random.uniform(0, min(BACKOFF_MAX_S, BACKOFF_BASE_S * (2 ** attempt)))
+        time.sleep(delay)
+
+    def get_json(self, url, params=None, retries=3, timeout=10, accept=None):
+        """
+        GET + JSON. accept(j) → (ok, rate_limited) ile cevabın geçerliliğine karar verilir
+        (OKX code alanı gibi). Yalnız ağ hataları, 429 / 5xx ve rate-limit kodları tekrar denenir;
+        diğer 4xx ve OKX hata kodları (örn. geçersiz instId) ilk cevapta bırakılır.
+        Backoff denemeler arasında uygulanır (son denemeden sonra beklenmez).
+        Dönen: JSON ya da başarısızsa None.
+        """
+        key = self.endpoint_key(url)
+        bucket = self._bucket(key)
+        last_err = None
+        retry_after = None
+        for attempt in range(retries):
+            if attempt:
+                self.record(key, retry=True)
+                self.backoff(attempt - 1, retry_after)
+                retry_after = None
+            bucket.acquire()
+            t0 = time.perf_counter()
+            try:
+                r = self.session.get(url, params=params, timeout=timeout)
+            except Exception as e:
+                self.record(key, latency=time.perf_counter() - t0, error=True)
+                last_err = e
+                continue
+            self.record(key, latency=time.perf_counter() - t0, nbytes=len(r.content))
+
+            if r.status_code == 429:
+                self.record(key, error=True, rate_limited=True)
+                bucket.drain()
+                last_err = "HTTP 429"
+                retry_after = _retry_after(r)
+                continue
+            if r.status_code >= 500:
+                self.record(key, error=True)
+                last_err = f"HTTP {r.status_code}"
+                continue
+            if r.status_code != 200:
+                # 4xx: tekrar denemenin anlamı yok
+                self.record(key, error=True)
+                last_err = f"HTTP {r.status_code}"
+                break
+
+            try:
+                j = r.json()
+            except Exception as e:
+                # Yarım kalmış gövde: ağ hatası gibi tekrar denenir
+                self.record(key, error=True)
+                last_err = e
+                continue
+
+            if accept is None:
+                self.record_fixture(url, params, j)
+                return j
+            ok, rate_limited = accept(j)
+            if ok:
+                self.record_fixture(url, params, j)
+                return j
+            self.record(key, error=True, rate_limited=rate_limited)
+            last_err = f"code={j.get('code') if isinstance(j, dict) else '?'}"
+            if not rate_limited:
+                # İstek hatası (geçersiz parametre / instId...): aynı istek aynı cevabı alır
+                break
+            bucket.drain()
+
+        print(f"  HTTP başarısız: {key} {params or ''} ({last_err})")
+        return None
+
+    def stats(self):
+        with self._lock:
+            return {k: dict(v) for k, v in self._stats.items()}
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats = {}
+
+    def merge_stats(self, stats):
+        """Başka bir transport'un (worker süreci) uç sayaçlarını bunlara ekler."""
+        with self._lock:
+            for key, other in stats.items():
+                st = self._stat(key)
+                for field, value in other.items():
+                    st[field] = max(st[field], value) if field == "latency_max_s" else st[field] + value
+
+    def record_fixture(self, url, params, body):
+        """HTTP_RECORD_PATH doluysa cevabı bench.MockApiServer'ın okuyacağı JSONL formatında ekler."""
+        if not HTTP_RECORD_PATH:
+            return
+        line = json.dumps({"path": urlsplit(url).path, "params": params or {}, "body": body})
+        with self._record_lock:
+            with open(HTTP_RECORD_PATH, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+def _retry_after(r):
+    try:
+        return min(BACKOFF_MAX_S, float(r.headers.get("Retry-After")))
+    except Exception:
+        return None
+
+
+TRANSPORT = HttpTransport()
+
+
+def _okx_accept(j):
+    if not isinstance(j, dict):
+        return False, False
+    code = str(j.get("code"))
+    if code == "0":
+        return True, False
+    return False, code in OKX_RATE_LIMIT_CODES
+
+
 def okx_jget(path, params=None, retries=3, timeout=10):
     """
     OKX için JSON getter (code == 0 ve data alanını döndürür).
     """
     url = path if path.startswith("http") else OKX_BASE + path
-    for _ in range(retries):
-        try:
-            r = requests.get(url, params=params, timeout=timeout)
-            if r.status_code == 200:
-                j = r.json()
-                if isinstance(j, dict) and j.get("code") == "0" and j.get("data"):
-                    return j["data"]
-        except Exception:
-            time.sleep(0.5)
+    j = TRANSPORT.get_json(url, params=params, retries=retries, timeout=timeout, accept=_okx_accept)
+    if j and j.get("data"):
+        return j["data"]
     return None
 
 
@@ -64,42 +558,477 @@ def http_get_json(url, params=None, retries=3, timeout=10):
     """
     Genel amaçlı JSON GET (CoinGecko vs. için).
     """
-    for _ in range(retries):
-        try:
-            r = requests.get(url, params=params, timeout=timeout)
-            if r.status_code == 200:
-                return r.json()
-        except Exception:
-            time.sleep(0.5)
-    return None
+    return TRANSPORT.get_json(url, params=params, retries=retries, timeout=timeout)
 
 
-def telegram(msg: str):
+def telegram(msg: str, ref=None):
+    """
+    Mesajı Telegram teslim kuyruğuna (outbox) yazar ve hemen döner; gönderim arka plandaki
+    TelegramDelivery worker'larıyla yapılır (bkz. telegram_flush).
+    ref: mesajdaki 4H sinyallerin anahtarları (signal_ref); teslim sonucu sinyal deposuna yazılır.
+    """
     if not TELEGRAM_TOKEN or not CHAT_ID:
         print("⚠ TELEGRAM_TOKEN veya CHAT_ID yok, mesaj sadece console'a yazıldı:")
         print(msg)
         print("---------------------")
         return
+    get_telegram_delivery().send(msg, ref=ref)
 
-    url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendMessage"
-    payload = {"chat_id": CHAT_ID, "text": msg, "parse_mode": "Markdown"}
-    try:
-        r = requests.post(url, data=payload, timeout=10)
-        if r.status_code != 200:
-            print("Telegram hata:", r.text)
-    except Exception as e:
-        print("Telegram exception:", e)
+
+def telegram_flush(timeout=TELEGRAM_FLUSH_S):
+    """Outbox boşalana ya da timeout dolana kadar bekler. Dönen: teslim edilemeyen parça sayısı."""
+    if TELEGRAM_DELIVERY is None:
+        return 0
+    return TELEGRAM_DELIVERY.flush(timeout)
+
+
+def utf16_len(text):
+    """Telegram'ın metin uzunluğu birimi: UTF-16 kod birimi (emoji gibi BMP dışı karakterler 2 sayılır)."""
+    return len(text.encode("utf-16-le")) // 2
+
+
+def _utf16_cut(line, limit):
+    """line'ın en fazla `limit` UTF-16 birimlik başı ve kalanı; karakter (vekil çifti) ortasından bölmez."""
+    units = 0
+    for i, ch in enumerate(line):
+        units += 2 if ord(ch) > 0xFFFF else 1
+        if units > limit:
+            return (line[:i], line[i:]) if i else (line[:1], line[1:])
+    return line, ""
+
+
+def split_message(text, limit=TELEGRAM_MAX_CHARS):
+    """
+    Metni en fazla `limit` UTF-16 birimlik (Telegram'ın saydığı uzunluk) parçalara satır sınırlarından böler.
+    Tek başına limiti aşan satır (pratikte olmaz) karakter bazında kesilir; boş parça üretilmez.
+    """
+    chunks = []
+    cur = []
+    size = 0
+    for line in text.split("\n"):
+        while utf16_len(line) > limit:
+            if cur:
+                chunks.append("\n".join(cur))
+                cur, size = [], 0
+            head, line = _utf16_cut(line, limit)
+            chunks.append(head)
+        n = utf16_len(line)
+        extra = n + (1 if cur else 0)
+        if cur and size + extra > limit:
+            chunks.append("\n".join(cur))
+            cur, size = [line], n
+        else:
+            cur.append(line)
+            size += extra
+    if cur:
+        chunks.append("\n".join(cur))
+    return [c for c in chunks if c.strip()]
+
+
+class TelegramOutbox:
+    """
+    SQLite tabanlı Telegram outbox'ı: her satır tek sohbete gidecek tek parça.
+    Teslim edilen satır silinir; sohbet içinde sıra id ile korunur.
+    """
+
+    def __init__(self, path):
+        self.path = path or ":memory:"
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chat_id TEXT NOT NULL,
+                text TEXT NOT NULL,
+                parse_mode TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_at REAL NOT NULL DEFAULT 0,
+                created REAL NOT NULL,
+                ref TEXT
+            )
+            """
+        )
+        if "ref" not in {r[1] for r in self._conn.execute("PRAGMA table_info(outbox)")}:
+            self._conn.execute("ALTER TABLE outbox ADD COLUMN ref TEXT")  # eski outbox dosyası
+        self._conn.execute("CREATE INDEX IF NOT EXISTS outbox_chat ON outbox (chat_id, id)")
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def enqueue(self, chat_ids, chunks, parse_mode="Markdown", ref=None):
+        now = time.time()
+        rows = [(chat_id, chunk, parse_mode, now, ref) for chat_id in chat_ids for chunk in chunks]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO outbox (chat_id, text, parse_mode, created, ref) VALUES (?, ?, ?, ?, ?)", rows
+            )
+            self._conn.commit()
+        return len(rows)
+
+    def head(self, chat_id):
+        """Sohbetin sıradaki parçası: (id, text, parse_mode, attempts, next_at, created, ref) ya da None."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT id, text, parse_mode, attempts, next_at, created, ref FROM outbox "
+                "WHERE chat_id = ? ORDER BY id LIMIT 1",
+                (chat_id,),
+            ).fetchone()
+
+    def chats(self):
+        with self._lock:
+            return [r[0] for r in self._conn.execute("SELECT DISTINCT chat_id FROM outbox")]
+
+    def done(self, row_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM outbox WHERE id = ?", (row_id,))
+            self._conn.commit()
+
+    def retry(self, row_id, attempts, next_at, parse_mode):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE outbox SET attempts = ?, next_at = ?, parse_mode = ? WHERE id = ?",
+                (attempts, next_at, parse_mode, row_id),
+            )
+            self._conn.commit()
+
+    def pending(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+
+class TelegramDelivery:
+    """
+    Telegram teslim alt sistemi (taramanın kritik yolunun dışında):
+    - send(): mesaj TELEGRAM_MAX_CHARS'lık (UTF-16) parçalara satır sınırından bölünür, her sohbet için outbox'a yazılır
+    - sohbet başına bir worker thread → sohbetler eşzamanlı, sohbet içinde parçalar sıralı gider
+    - 429 → cevabın parameters.retry_after'ı kadar beklenir (deneme sayılmaz)
+    - 5xx / ağ hatası → üstel backoff, TELEGRAM_MAX_ATTEMPTS sonra bırakılır
+    - 400 Markdown parse hatası → aynı parça düz metin olarak yeniden denenir; diğer 4xx → bırakılır
+    Outbox'ta kalanlar (süreç bitti, retry_after uzun...) sonraki başlatmada önce teslim edilir;
+    TELEGRAM_MAX_AGE_S'den eski parçalar gönderilmeden atılır (expired).
+    ref'li parçaların sonucu (gönderildi / bırakıldı / eskidi) on_result(ref, ok) ile bildirilir
+    (varsayılan: record_signal_delivery → sinyal deposu).
+    """
+
+    def __init__(self, token, chat_ids, api=None, outbox_path=None):
+        self.url = f"{api or TELEGRAM_API}/bot{token}/sendMessage"
+        self.chat_ids = list(dict.fromkeys(chat_ids))
+        # None → çalışma anındaki TELEGRAM_OUTBOX_PATH ("" → yalnız bellek)
+        self.outbox = TelegramOutbox(TELEGRAM_OUTBOX_PATH if outbox_path is None else outbox_path)
+        self._cond = threading.Condition()
+        self._threads = {}
+        self._stop = False
+        self.sent = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.dropped = 0
+        self.expired = 0
+        self.on_result = record_signal_delivery
+        self.config = None  # get_telegram_delivery'nin ayar anahtarı
+
+    def start(self):
+        for chat_id in list(dict.fromkeys(self.chat_ids + self.outbox.chats())):
+            self._ensure_worker(chat_id)
+        return self
+
+    def _ensure_worker(self, chat_id):
+        if chat_id in self._threads:
+            return
+        t = threading.Thread(target=self._worker, args=(chat_id,), name=f"telegram-{chat_id}", daemon=True)
+        self._threads[chat_id] = t
+        t.start()
+
+    def send(self, text, parse_mode="Markdown", ref=None):
+        chunks = split_message(text)
+        self.outbox.enqueue(self.chat_ids, chunks, parse_mode, ref)
+        with self._cond:
+            self._cond.notify_all()
+        return len(chunks)
+
+    def _worker(self, chat_id):
+        session = requests.Session()
+        while True:
+            with self._cond:
+                if self._stop:
+                    return
+            row = self.outbox.head(chat_id)
+            if row is not None and time.time() - row[5] > TELEGRAM_MAX_AGE_S:
+                print(f"Telegram ({chat_id}): {(time.time() - row[5]) / 60:.0f} dk bekleyen parça eskidi, gönderilmedi")
+                self.outbox.done(row[0])
+                self.expired += 1
+                self._result(row, False)
+                with self._cond:
+                    self._cond.notify_all()
+                continue
+            wait = 1.0 if row is None else row[4] - time.time()
+            if wait > 0:
+                with self._cond:
+                    if not self._stop:
+                        self._cond.wait(timeout=min(wait, 1.0))
+                continue
+            self._deliver(session, chat_id, row)
+
+    def _result(self, row, ok):
+        if row[6] and self.on_result is not None:
+            try:
+                self.on_result(row[6], ok)
+            except Exception as e:
+                print("Telegram teslim sonucu kaydedilemedi:", e)
+
+    def _deliver(self, session, chat_id, row):
+        row_id, text, parse_mode, attempts = row[:4]
+        payload = {"chat_id": chat_id, "text": text}
+        if parse_mode:
+            payload["parse_mode"] = parse_mode
+        # Token URL'de olduğu için metriklerde sabit anahtar kullanılır
+        key = "telegram/sendMessage"
+        status = None
+        body = {}
+        retry_after = None
+        t0 = time.perf_counter()
+        try:
+            with span("telegram"):
+                r = session.post(self.url, data=payload, timeout=10)
+            status = r.status_code
+            try:
+                body = r.json()
+            except ValueError:
+                body = {}
+            retry_after = (body.get("parameters") or {}).get("retry_after") or r.headers.get("Retry-After")
+            TRANSPORT.record(
+                key,
+                latency=time.perf_counter() - t0,
+                error=status != 200,
+                rate_limited=status == 429,
+                nbytes=len(r.content),
+            )
+        except Exception as e:
+            TRANSPORT.record(key, latency=time.perf_counter() - t0, error=True)
+            body = {"description": str(e)}
+
+        description = str(body.get("description", ""))
+        if status == 200:
+            self.outbox.done(row_id)
+            self.sent += 1
+            self._result(row, True)
+        elif status == 429:
+            self.rate_limited += 1
+            self.outbox.retry(row_id, attempts, time.time() + float(retry_after or 1), parse_mode)
+        elif status == 400 and parse_mode and "parse" in description.lower():
+            print(f"Telegram Markdown hatası ({description}) → düz metin olarak yeniden deneniyor")
+            self.outbox.retry(row_id, attempts, 0, None)
+        elif status is not None and 400 <= status < 500:
+            print(f"Telegram hata ({chat_id}): {status} {description}")
+            self.outbox.done(row_id)
+            self.dropped += 1
+            self._result(row, False)
+        elif attempts + 1 >= TELEGRAM_MAX_ATTEMPTS:
+            print(f"Telegram ({chat_id}): {attempts + 1} denemede gönderilemedi, parça bırakıldı: {description}")
+            self.outbox.done(row_id)
+            self.dropped += 1
+            self._result(row, False)
+        else:
+            self.retries += 1
+            TRANSPORT.record(key, retry=True)
+            delay = min(BACKOFF_MAX_S, BACKOFF_BASE_S * (2 ** attempts)) + random.random()
+            self.outbox.retry(row_id, attempts + 1, time.time() + delay, parse_mode)
+        with self._cond:
+            self._cond.notify_all()
+
+    def flush(self, timeout=TELEGRAM_FLUSH_S):
+        """Outbox boşalana ya da timeout dolana kadar bekler. Dönen: kalan parça sayısı."""
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = self.outbox.pending()
+            left = deadline - time.monotonic()
+            if remaining == 0 or left <= 0:
+                return remaining
+            with self._cond:
+                self._cond.wait(timeout=min(left, 0.5))
+
+    def stop(self):
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+        for t in self._threads.values():
+            t.join(timeout=15)
+        self.outbox.close()
+
+    def stats(self):
+        return {
+            "sent": self.sent,
+            "retries": self.retries,
+            "rate_limited": self.rate_limited,
+            "dropped": self.dropped,
+            "expired": self.expired,
+            "pending": self.outbox.pending(),
+        }
+
+
+TELEGRAM_DELIVERY = None
+_TELEGRAM_DELIVERY_LOCK = threading.Lock()
+
+
+def get_telegram_delivery():
+    """Geçerli TELEGRAM_* ayarları için paylaşılan (başlatılmış) TelegramDelivery örneği."""
+    global TELEGRAM_DELIVERY
+    chat_ids = [c.strip() for c in (CHAT_ID or "").split(",") if c.strip()]
+    config = (TELEGRAM_API, TELEGRAM_TOKEN, tuple(chat_ids), TELEGRAM_OUTBOX_PATH)
+    with _TELEGRAM_DELIVERY_LOCK:
+        current = TELEGRAM_DELIVERY
+        if current is not None and current.config != config:
+            current.stop()
+            current = None
+        if current is None:
+            current = TelegramDelivery(TELEGRAM_TOKEN, chat_ids, api=TELEGRAM_API, outbox_path=TELEGRAM_OUTBOX_PATH)
+            current.config = config
+            current.start()
+            TELEGRAM_DELIVERY = current
+    return current
+
+
+# ========== RUN SNAPSHOT (İSTEK BİRLEŞTİRME) ==========
+
+class MarketSnapshot:
+    """
+    Tek çalıştırma (run) boyunca paylaşılan piyasa verisi önbelleği.
+    Her (endpoint, instId, parametreler) anahtarı yalnızca bir kez çekilir ve parse
+    edilmiş sonuç tüm analizörler arasında paylaşılır. Aynı anahtar için eşzamanlı
+    gelen istekler ilk isteğin bitmesini bekler (coalescing).
+    Başarısız yükleme (None) saklanmaz: bekleyenler None alır, sonraki istek yeniden dener.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = {}
+        self._inflight = {}
+        self._limits = {}  # base_key -> çekilmiş limit değerleri
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+
+    def get(self, key, loader):
+        with self._lock:
+            if key in self._data:
+                self.hits += 1
+                return self._data[key]
+            slot = self._inflight.get(key)
+            owner = slot is None
+            if owner:
+                slot = [threading.Event(), None]  # [bitti, değer] — değer cache'e yazılmasa da bekleyene gider
+                self._inflight[key] = slot
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not owner:
+            slot[0].wait()
+            return slot[1]
+
+        value = None
+        try:
+            value = loader()
+        finally:
+            with self._lock:
+                if value is not None:
+                    self._data[key] = value
+                slot[1] = value
+                del self._inflight[key]
+            slot[0].set()
+        return value
+
+    def lookup(self, key):
+        """Yükleme yapmadan bakar. Dönen: (bulundu_mu, değer)"""
+        with self._lock:
+            if key in self._data:
+                return True, self._data[key]
+        return False, None
+
+    def discard(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def put_candles(self, inst_id, bar, series, limit):
+        """Dışarıdan gelen (canlı / backtest) mum serisini get_candles için yükler."""
+        base_key = ("candles", inst_id, bar)
+        with self._lock:
+            self._data[base_key + (limit,)] = series
+            self._limits.setdefault(base_key, set()).add(limit)
+
+    def lookup_covering(self, base_key, limit, count=True):
+        """get_covering'in yüklemesiz hali: (bulundu_mu, son `limit` eleman). count=False → hit sayılmaz."""
+        with self._lock:
+            for lim in sorted(self._limits.get(base_key, ())):
+                key = base_key + (lim,)
+                if lim >= limit and key in self._data:
+                    if count:
+                        self.hits += 1
+                    value = self._data[key]
+                    return True, (value[-limit:] if value else value)
+        return False, None
+
+    def get_covering(self, base_key, limit, loader):
+        """
+        Limitli listeler (mumlar) için: aynı base_key daha büyük bir limitle zaten
+        çekildiyse yeni istek atmadan onun son `limit` elemanı döner.
+        """
+        found, value = self.lookup_covering(base_key, limit)
+        if found:
+            return value
+        value = self.get(base_key + (limit,), loader)
+        if value is not None:
+            with self._lock:
+                self._limits.setdefault(base_key, set()).add(limit)
+        return value
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses + self.coalesced
+            return {
+                "requests": total,
+                "fetched": self.misses,
+                "hits": self.hits,
+                "coalesced": self.coalesced,
+                "hit_rate": ((self.hits + self.coalesced) / total) if total else 0.0,
+            }
+
+
+# Aktif run snapshot'ı (main() her çalıştırmada yenisini kurar). None → önbelleksiz.
+SNAPSHOT = None
+
+
+def snapshot_get(key, loader):
+    snap = SNAPSHOT
+    if snap is None:
+        return loader()
+    return snap.get(key, loader)
 
 
 # ========== MCAP & SEGMENT ==========
 
-def build_mcap_cache(max_pages: int = 3):
+def _mcap_rank_key(entry):
     """
-    CoinGecko üzerinden top marketcap coinleri çekip sembol -> mcap map'i oluşturur.
-    BTC, ETH, SOL, XRP vs. kesin bulunur.
+    Aynı sembolü taşıyan coinler (farklı zincir / isim çakışması) için deterministik seçim:
+    en yüksek mcap → en iyi market_cap_rank → alfabetik CoinGecko id.
     """
-    global MCAP_CACHE
-    MCAP_CACHE = {}
+    rank = entry.get("rank")
+    return (-entry["mcap"], rank if rank else float("inf"), entry.get("id") or "")
+
+
+def fetch_mcap_entries(max_pages: int = 3):
+    """
+    CoinGecko /coins/markets sayfalarını çeker.
+    Dönen: ({"BTC": {"id", "mcap", "rank"}}, complete) — complete=False → bir sayfa alınamadı.
+    """
+    entries = {}
+    complete = True
     for page in range(1, max_pages + 1):
         data = http_get_json(
             f"{COINGECKO}/coins/markets",
@@ -111,17 +1040,114 @@ def build_mcap_cache(max_pages: int = 3):
                 "sparkline": "false",
             },
         )
-        if not data:
+        if data is None:
+            complete = False
             break
         for row in data:
             sym = (row.get("symbol") or "").upper()
             mcap = row.get("market_cap") or 0
             if sym and mcap:
-                # Aynı sembol birden fazla zincirde olabilir → en yüksek mcap'i al
-                if sym not in MCAP_CACHE or mcap > MCAP_CACHE[sym]:
-                    MCAP_CACHE[sym] = mcap
+                entry = {"id": row.get("id") or "", "mcap": mcap, "rank": row.get("market_cap_rank")}
+                old = entries.get(sym)
+                if old is None or _mcap_rank_key(entry) < _mcap_rank_key(old):
+                    entries[sym] = entry
         if len(data) < 250:
             break
+    return entries, complete
+
+
+def load_mcap_file(path=None):
+    """Disk cache'i okur. Dönen: (entries, fetched_at epoch sn); dosya yok / bozuk → ({}, 0)."""
+    path = MCAP_CACHE_PATH if path is None else path
+    if not path or not os.path.exists(path):
+        return {}, 0.0
+    try:
+        with open(path, encoding="utf-8") as f:
+            doc = json.load(f)
+        return doc.get("entries") or {}, float(doc.get("fetched_at") or 0)
+    except Exception as e:
+        print("MCAP cache okunamadı:", e)
+        return {}, 0.0
+
+
+def save_mcap_file(entries, fetched_at, path=None):
+    path = MCAP_CACHE_PATH if path is None else path
+    if not path:
+        return
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"fetched_at": fetched_at, "entries": entries}, f, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def refresh_mcap_cache(max_pages: int = 3, previous=None):
+    """
+    CoinGecko'dan yeniler ve diske yazar. Bir sayfa alınamazsa (rate limit vs.) yeni gelenler
+    eski kayıtların üzerine birleştirilir; eski tarih korunur → sonraki run tekrar dener.
+    Dönen: sembol -> mcap haritası (hiç veri yoksa boş).
+    """
+    with span("mcap.refresh"):
+        fresh, complete = fetch_mcap_entries(max_pages)
+    if complete and fresh:
+        entries, fetched_at = fresh, time.time()
+    else:
+        old_entries, fetched_at = previous if previous is not None else load_mcap_file()
+        entries = dict(old_entries)
+        entries.update(fresh)
+    if fresh:
+        save_mcap_file(entries, fetched_at)
+    return {sym: e["mcap"] for sym, e in entries.items()}
+
+
+def build_mcap_cache(max_pages: int = 3):
+    """
+    CoinGecko üzerinden top marketcap coinleri çekip sembol -> mcap map'i oluşturur (senkron).
+    BTC, ETH, SOL, XRP vs. kesin bulunur.
+    """
+    global MCAP_CACHE
+    MCAP_CACHE = refresh_mcap_cache(max_pages)
+
+
+def ensure_mcap_cache(background=True, apply_refresh=False):
+    """
+    Stale-while-revalidate MCAP cache:
+    - Disk cache TTL içindeyse → sadece yüklenir, CoinGecko'ya gidilmez.
+    - Eskiyse → eski tier'lar hemen kullanılır, yenileme arka planda (OKX taramasıyla eşzamanlı)
+      çalışır ve diske yazılır. apply_refresh=True (canlı mod) → sonuç bellekteki cache'e de
+      uygulanır; tek seferlik run'da tier'lar run boyunca sabit kalır.
+    - Hiç cache yoksa → senkron çekilir (Unknown segmentine düşmemek için).
+    Dönen: arka plan thread'i ya da None.
+    """
+    global MCAP_CACHE
+    entries, fetched_at = load_mcap_file()
+    if not entries:
+        build_mcap_cache()
+        return None
+
+    MCAP_CACHE = {sym: e["mcap"] for sym, e in entries.items()}
+    age = time.time() - fetched_at
+    if age < MCAP_TTL_S:
+        print(f"MCAP cache: {len(MCAP_CACHE)} coin, {age / 3600:.1f} saatlik (TTL içinde)")
+        return None
+
+    print(f"MCAP cache: {len(MCAP_CACHE)} coin, {age / 3600:.1f} saatlik → yenileniyor")
+    if not background:
+        MCAP_CACHE = refresh_mcap_cache(previous=(entries, fetched_at))
+        return None
+
+    def worker():
+        global MCAP_CACHE
+        try:
+            refreshed = refresh_mcap_cache(previous=(entries, fetched_at))
+        except Exception as e:
+            print("MCAP yenileme hatası:", e)
+            return
+        if apply_refresh and refreshed:
+            MCAP_CACHE = refreshed
+
+    thread = threading.Thread(target=worker, name="mcap-refresh", daemon=True)
+    thread.start()
+    return thread
 
 
 def get_mcap_segment(base_symbol: str):
@@ -141,6 +1167,8 @@ def get_mcap_segment(base_symbol: str):
     x_whale = 300_000
 
     if mcap <= 0:
+        if WHALE_SCALE != 1.0:
+            return segment, label, s_whale * WHALE_SCALE, m_whale * WHALE_SCALE, x_whale * WHALE_SCALE
         return segment, label, s_whale, m_whale, x_whale
 
     if mcap >= 10_000_000_000:  # 10B+
@@ -168,25 +1196,105 @@ def get_mcap_segment(base_symbol: str):
         m_whale = 120_000
         x_whale = 200_000
 
+    if WHALE_SCALE != 1.0:
+        s_whale *= WHALE_SCALE
+        m_whale *= WHALE_SCALE
+        x_whale *= WHALE_SCALE
+
     return segment, label, s_whale, m_whale, x_whale
 
 
 # ========== OKX PİYASA FONKSİYONLARI ==========
 
+def get_spot_usdt_tickers():
+    """OKX SPOT tickers (tek toplu istek, run snapshot'ında paylaşılır) → USDT paritelerinin ham satırları."""
+    data = snapshot_get(
+        ("tickers", "SPOT"),
+        lambda: okx_jget("/api/v5/market/tickers", {"instType": "SPOT"}),
+    )
+    return [d for d in data or [] if d.get("instId", "").endswith("-USDT")]
+
+
+def fetch_swap_context():
+    """
+    USDT-SWAP türev bağlamı, instType başına tek istek (3 HTTP, sembol sayısından bağımsız):
+    - /public/funding-rate?instId=ANY  → tüm perp'lerin güncel funding'i
+    - /public/open-interest?instType=SWAP → open interest (USD)
+    - /market/tickers?instType=SWAP → perp son fiyatı (spot ile basis için)
+    Dönen: {base: {"inst_id", "funding", "oi_usd", "perp_last", "basis"}}; spot fiyatı
+    snapshot'taki SPOT ticker cevabından (ek istek yok) alınır. Boş / bozuk alanlar None (NaN değil).
+    """
+    funding = okx_jget("/api/v5/public/funding-rate", {"instId": "ANY"}) or []
+    oi = okx_jget("/api/v5/public/open-interest", {"instType": "SWAP"}) or []
+    tickers = snapshot_get(
+        ("tickers", "SWAP"),
+        lambda: okx_jget("/api/v5/market/tickers", {"instType": "SWAP"}),
+    ) or []
+    spot_last = {d["instId"].split("-")[0]: _ticker_value(d, "last") for d in get_spot_usdt_tickers()}
+
+    ctx = {}
+
+    def entry(inst_id):
+        if not inst_id.endswith("-USDT-SWAP"):
+            return None
+        base = inst_id.split("-")[0]
+        if base not in ctx:
+            ctx[base] = {"inst_id": inst_id, "funding": None, "oi_usd": None, "perp_last": None, "basis": None}
+        return ctx[base]
+
+    for d in funding:
+        e = entry(d.get("instId", ""))
+        if e is not None:
+            e["funding"] = _ticker_value(d, "fundingRate")
+    for d in oi:
+        e = entry(d.get("instId", ""))
+        if e is not None:
+            e["oi_usd"] = _ticker_value(d, "oiUsd")
+    for d in tickers:
+        e = entry(d.get("instId", ""))
+        if e is not None:
+            e["perp_last"] = _ticker_value(d, "last")
+    for base, e in ctx.items():
+        spot = spot_last.get(base)
+        if spot and e["perp_last"]:
+            e["basis"] = (e["perp_last"] - spot) / spot
+    return ctx
+
+
+def get_swap_context():
+    """Run snapshot'ında paylaşılan türev bağlamı (bkz. fetch_swap_context)."""
+    return snapshot_get(("derivatives", "USDT-SWAP"), fetch_swap_context) or {}
+
+
+def get_derivatives(inst_id):
+    """Spot instId (BTC-USDT) → aynı base'in USDT-SWAP bağlamı ya da None."""
+    return get_swap_context().get(inst_id.split("-")[0])
+
+
+def derivative_conditions(side, deriv):
+    """
+    4H için ek türev koşulları; perp yoksa, OI / funding bilinmiyorsa ya da OI DERIV_MIN_OI_USD
+    altındaysa boş liste (türev bağlamı yok).
+    - funding: LONG için tabanın altında (long kalabalığı yok), SHORT için üstünde
+    - basis: LONG için perp spot'un üstünde, SHORT için altında
+    """
+    if not deriv or deriv["oi_usd"] is None or deriv["funding"] is None or deriv["oi_usd"] < DERIV_MIN_OI_USD:
+        return []
+    funding = deriv["funding"]
+    basis = deriv["basis"]
+    if side == "LONG":
+        return [funding < DERIV_FUNDING_NEUTRAL, basis is not None and basis > 0]
+    return [funding > DERIV_FUNDING_NEUTRAL, basis is not None and basis < 0]
+
+
 def get_spot_usdt_top_symbols(limit=TOP_LIMIT):
     """
     OKX SPOT tickers → USDT pariteleri içinden en yüksek 24h notional hacme göre ilk N'i alır.
     instId formatı: BTC-USDT, HBAR-USDT vs.
     """
-    data = okx_jget("/api/v5/market/tickers", {"instType": "SPOT"})
-    if not data:
-        return []
-
     rows = []
-    for d in data:
+    for d in get_spot_usdt_tickers():
         inst_id = d.get("instId", "")
-        if not inst_id.endswith("-USDT"):
-            continue
         volCcy24h = d.get("volCcy24h")  # quote currency volume
         try:
             vol_quote = float(volCcy24h)
@@ -199,17 +1307,189 @@ def get_spot_usdt_top_symbols(limit=TOP_LIMIT):
     return symbols
 
 
+def _ticker_float(d, field):
+    try:
+        return float(d.get(field))
+    except Exception:
+        return float("nan")
+
+
+def _ticker_value(d, field):
+    """_ticker_float gibi, ama boş / bozuk / sonsuz değer için None (NaN karşılaştırmalardan sessizce geçer)."""
+    x = _ticker_float(d, field)
+    return x if math.isfinite(x) else None
+
+
+def _zscore(values):
+    n = len(values)
+    if not n:
+        return []
+    mean = sum(values) / n
+    std = (sum((v - mean) ** 2 for v in values) / n) ** 0.5
+    return [(v - mean) / std if std > 0 else 0.0 for v in values]
+
+
+def score_tickers(tickers, weights=None):
+    """
+    Toplu ticker cevabından her sembol için ucuz ön-skor (ek istek yok):
+    - range:   24h aralık genişlemesi (high - low) / open
+    - extreme: fiyatın 24h high/low'a yakınlığı |2·pos - 1| (pos = (last - low) / (high - low))
+    - spread:  (ask - bid) / mid → cezalandırılır
+    - skew:    en iyi bid / ask notional dengesizliği |bid·bidSz - ask·askSz| / toplam
+    - volume:  log10(volCcy24h)
+    Özellikler evren içinde z-score'lanıp PREFILTER_WEIGHTS ile toplanır (NumPy varsa vektörel).
+    Likiditesi PREFILTER_MIN_VOL_USDT altı ya da spread'i PREFILTER_MAX_SPREAD üstü olanlar elenir.
+    Dönen: skora göre azalan [{"instId", "score", "range", "extreme", "spread", "skew", "volume"}]
+    """
+    weights = weights or PREFILTER_WEIGHTS
+    fields = ("last", "open24h", "high24h", "low24h", "bidPx", "askPx", "bidSz", "askSz", "volCcy24h")
+    inst_ids = [d.get("instId", "") for d in tickers]
+    if not inst_ids:
+        return []
+    raw = [[_ticker_float(d, f) for f in fields] for d in tickers]
+    names = ("range", "extreme", "spread", "skew", "volume")
+
+    if np is not None:
+        m = np.array(raw, dtype=float)
+        last, o, h, l, bid, ask, bsz, asz, vol = m.T
+        with np.errstate(divide="ignore", invalid="ignore"):
+            rng = (h - l) / o
+            pos = (last - l) / (h - l)
+            extreme = np.abs(2 * pos - 1)
+            spread = (ask - bid) / ((ask + bid) / 2)
+            bid_n = bid * bsz
+            ask_n = ask * asz
+            skew = np.abs(bid_n - ask_n) / (bid_n + ask_n)
+            liq = np.log10(vol)
+        feats = np.vstack([rng, extreme, spread, skew, liq])
+        valid = (
+            np.isfinite(feats).all(axis=0)
+            & (h > l)
+            & (o > 0)
+            & (vol >= PREFILTER_MIN_VOL_USDT)
+            & (spread >= 0)
+            & (spread <= PREFILTER_MAX_SPREAD)
+        )
+        idx = np.flatnonzero(valid)
+        if not len(idx):
+            return []
+        sub = feats[:, idx]
+        std = sub.std(axis=1, keepdims=True)
+        # Sabit özellik (std = 0) → z = 0
+        z = (sub - sub.mean(axis=1, keepdims=True)) / np.where(std > 0, std, 1.0)
+        sign = np.array([1.0, 1.0, -1.0, 1.0, 1.0])
+        w = np.array([weights.get(name, 0.0) for name in names])
+        scores = (sign * w) @ z
+        order = np.argsort(-scores, kind="stable")
+        return [
+            {"instId": inst_ids[idx[k]], "score": float(scores[k]), **{n: float(sub[j, k]) for j, n in enumerate(names)}}
+            for k in order
+        ]
+
+    # NumPy yok → aynı hesap saf Python
+    rows = []
+    for inst_id, (last, o, h, l, bid, ask, bsz, asz, vol) in zip(inst_ids, raw):
+        try:
+            spread = (ask - bid) / ((ask + bid) / 2)
+            bid_n = bid * bsz
+            ask_n = ask * asz
+            feats = (
+                (h - l) / o,
+                abs(2 * (last - l) / (h - l) - 1),
+                spread,
+                abs(bid_n - ask_n) / (bid_n + ask_n),
+                math.log10(vol),
+            )
+        except (ZeroDivisionError, ValueError):
+            continue
+        if not all(math.isfinite(f) for f in feats) or not h > l or not o > 0:
+            continue
+        if vol < PREFILTER_MIN_VOL_USDT or not 0 <= spread <= PREFILTER_MAX_SPREAD:
+            continue
+        rows.append((inst_id, feats))
+    if not rows:
+        return []
+    zs = [_zscore([r[1][j] for r in rows]) for j in range(len(names))]
+    signs = (1.0, 1.0, -1.0, 1.0, 1.0)
+    out = []
+    for k, (inst_id, feats) in enumerate(rows):
+        score = sum(signs[j] * weights.get(names[j], 0.0) * zs[j][k] for j in range(len(names)))
+        out.append({"instId": inst_id, "score": score, **dict(zip(names, feats))})
+    out.sort(key=lambda r: -r["score"])
+    return out
+
+
+def prefilter_symbols(top_k=PREFILTER_TOP_K):
+    """Tüm USDT evrenini tek ticker isteğiyle skorlar, derin analiz için ilk `top_k` sembolü döner."""
+    with span("prefilter"):
+        scored = score_tickers(get_spot_usdt_tickers())
+    return [r["instId"] for r in scored[:top_k]]
+
+
 def get_candles(inst_id, bar="4H", limit=200):
-    data = okx_jget("/api/v5/market/candles", {"instId": inst_id, "bar": bar, "limit": limit})
+    """
+    Son `limit` mumu kronolojik CandleSeries olarak döner (volume sütunları dahil).
+    bar RESAMPLE_FROM_1H içindeyse OKX'ten çekilmez, 1H serisinden türetilir.
+    """
+    base_key = ("candles", inst_id, bar)
+    snap = SNAPSHOT
+    if bar in RESAMPLE_FROM_1H:
+        loader = lambda: resample_from_1h(inst_id, bar, limit)
+    elif bar == "1H" and RESAMPLE_FROM_1H:
+        # Tüm 1H istekleri türetme için gereken derinlikte tek istekte birleşsin
+        if snap is not None:
+            found, value = snap.lookup_covering(base_key, limit)
+            if found:
+                return value
+        fetch_limit = max(limit, resample_1h_limit())
+        if snap is None:
+            return _fetch_candles(inst_id, bar, fetch_limit)[-limit:]
+        return snap.get_covering(base_key, fetch_limit, lambda: _fetch_candles(inst_id, bar, fetch_limit))[-limit:]
+    else:
+        loader = lambda: _fetch_candles(inst_id, bar, limit)
+    if snap is None:
+        return loader()
+    return snap.get_covering(base_key, limit, loader)
+
+
+def _fetch_candles(inst_id, bar, limit):
+    with span("fetch.candles"):
+        store = get_candle_store()
+        if store is not None:
+            return store.get_candles(inst_id, bar, limit)
+
+        # /market/candles en fazla OKX_CANDLE_PAGE bar döner; fazlası (örn. RESAMPLE_FROM_1H'in
+        # 1H derinliği) depo yokken history-candles ile geriye doğru sayfalanır
+        data = okx_jget(
+            "/api/v5/market/candles", {"instId": inst_id, "bar": bar, "limit": min(max(limit, 1), OKX_CANDLE_PAGE)}
+        )
+        rows = parse_candle_rows(data)
+        while rows and len(rows) < limit:
+            page = parse_candle_rows(
+                okx_jget(
+                    "/api/v5/market/history-candles",
+                    {"instId": inst_id, "bar": bar, "after": rows[0][0], "limit": OKX_HISTORY_CANDLE_PAGE},
+                )
+            )
+            page = [r for r in page if r[0] < rows[0][0]]
+            if not page:
+                break
+            rows = page + rows
+        return CandleSeries.from_rows(rows[-limit:])
+
+
+def parse_candle_rows(data):
+    """
+    OKX candle satırlarını kronolojik (ts, o, h, l, c, vol, volCcy, confirm) tuple'larına çevirir.
+    Bozuk satırlar atlanır.
+    """
     if not data:
         return []
 
     # OKX en yeni mum en üstte verir → kronolojik sıraya çevirelim
-    data = list(reversed(data))
-
-    candles = []
-    for row in data:
-        # [ts, o, h, l, c, vol, volCcy, ...]
+    rows = []
+    for row in reversed(data):
+        # [ts, o, h, l, c, vol, volCcy, volCcyQuote, confirm]
         try:
             ts_ms = int(row[0])
             o = float(row[1])
@@ -218,29 +1498,286 @@ def get_candles(inst_id, bar="4H", limit=200):
             c = float(row[4])
         except Exception:
             continue
-        candles.append(
-            {
-                "ts": ts_ms,
-                "open": o,
-                "high": h,
-                "low": l,
-                "close": c,
-            }
+        try:
+            vol = float(row[5])
+            vol_ccy = float(row[6])
+        except Exception:
+            vol = 0.0
+            vol_ccy = 0.0
+        confirm = 0 if len(row) > 8 and row[8] == "0" else 1
+        rows.append((ts_ms, o, h, l, c, vol, vol_ccy, confirm))
+    return rows
+
+
+class CandleSeries:
+    """
+    Sütunsal (array-backed) mum serisi.
+    ts → array('q'), open/high/low/close/volume/vol_ccy → array('d'), confirm → array('b').
+    - Sütunlar memoryview olarak okunur: series.close, series.high ... (kopyasız)
+    - Dilimleme kopyasızdır: series[-80:] aynı dizileri başka aralıkla gösterir
+    - Geriye dönük uyumluluk: series[i] → {"ts", "open", "high", "low", "close", "volume", ...} dict
+    """
+
+    FIELDS = ("ts", "open", "high", "low", "close", "volume", "vol_ccy", "confirm")
+    _TYPECODES = ("q", "d", "d", "d", "d", "d", "d", "b")
+
+    __slots__ = ("_cols", "_start", "_stop")
+
+    def __init__(self, cols=None, start=0, stop=None):
+        if cols is None:
+            cols = tuple(array(tc) for tc in self._TYPECODES)
+        self._cols = cols
+        self._start = start
+        self._stop = len(cols[0]) if stop is None else stop
+
+    @classmethod
+    def from_rows(cls, rows):
+        """(ts, o, h, l, c, vol, volCcy, confirm) tuple'larından seri oluşturur."""
+        if not rows:
+            return cls()
+        columns = list(zip(*rows))
+        while len(columns) < len(cls.FIELDS):
+            columns.append((1,) * len(rows) if len(columns) == 7 else (0.0,) * len(rows))
+        cols = tuple(array(tc, col) for tc, col in zip(cls._TYPECODES, columns))
+        return cls(cols)
+
+    @classmethod
+    def from_dicts(cls, candles):
+        """Eski list-of-dict mum formatından dönüşüm."""
+        return cls.from_rows(
+            [
+                (
+                    c["ts"],
+                    c["open"],
+                    c["high"],
+                    c["low"],
+                    c["close"],
+                    c.get("volume", 0.0),
+                    c.get("vol_ccy", 0.0),
+                    c.get("confirm", 1),
+                )
+                for c in candles
+            ]
         )
-    return candles
+
+    def _col(self, i):
+        return memoryview(self._cols[i])[self._start:self._stop]
+
+    @property
+    def ts(self):
+        return self._col(0)
+
+    @property
+    def open(self):
+        return self._col(1)
+
+    @property
+    def high(self):
+        return self._col(2)
+
+    @property
+    def low(self):
+        return self._col(3)
+
+    @property
+    def close(self):
+        return self._col(4)
+
+    @property
+    def volume(self):
+        return self._col(5)
+
+    @property
+    def vol_ccy(self):
+        return self._col(6)
+
+    @property
+    def confirm(self):
+        return self._col(7)
+
+    def __len__(self):
+        return self._stop - self._start
+
+    def __getitem__(self, key):
+        n = len(self)
+        if isinstance(key, slice):
+            start, stop, step = key.indices(n)
+            if step != 1:
+                raise ValueError("CandleSeries sadece adımsız dilimlemeyi destekler")
+            stop = max(start, stop)
+            return CandleSeries(self._cols, self._start + start, self._start + stop)
+        if key < 0:
+            key += n
+        if not 0 <= key < n:
+            raise IndexError("CandleSeries index out of range")
+        i = self._start + key
+        return {name: col[i] for name, col in zip(self.FIELDS, self._cols)}
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def rows(self):
+        """(ts, o, h, l, c, vol, volCcy, confirm) tuple listesi (depolama / serileştirme için)."""
+        return list(zip(*(col[self._start:self._stop] for col in self._cols)))
+
+    def __eq__(self, other):
+        if isinstance(other, CandleSeries):
+            return all(
+                a[self._start:self._stop] == b[other._start:other._stop]
+                for a, b in zip(self._cols, other._cols)
+            )
+        return NotImplemented
+
+    def __repr__(self):
+        return f"CandleSeries(n={len(self)})"
+
+    # Process havuzlarına gönderilebilsin (memoryview/dilim yerine sadece görünen aralık)
+    def __getstate__(self):
+        return tuple(col[self._start:self._stop] for col in self._cols)
+
+    def __setstate__(self, state):
+        self._cols = state
+        self._start = 0
+        self._stop = len(state[0])
+
+
+def as_series(candles):
+    """CandleSeries ya da eski list-of-dict formatını CandleSeries'e çevirir."""
+    if isinstance(candles, CandleSeries):
+        return candles
+    return CandleSeries.from_dicts(candles)
+
+
+def resample_candles(series, bar):
+    """
+    Kronolojik 1H serisinden `bar` (RESAMPLE_BARS) OHLCV serisi üretir.
+    - Kova başlangıcı: (ts - ofset) // süre * süre + ofset (OKX hizalaması)
+    - o = ilk açılış, h = max, l = min, c = son kapanış, hacimler toplam
+    - Seri bir kovanın ortasından başlıyorsa o ilk (eksik) kova atılır
+    - Son kova: tüm 1H dilimleri gelmemişse ya da son 1H onaysızsa forming (confirm=0)
+    - Aradaki boşluklar (OKX'in işlem olmayan saatlerde bar vermemesi): kova eldeki 1H'lerden
+      kurulur ve sonrasında veri olduğu için kapanmış sayılır; tamamen boş kova üretilmez
+    """
+    step, offset = RESAMPLE_BARS[bar]
+    hour = BAR_MS["1H"]
+    cols = tuple(array(tc) for tc in CandleSeries._TYPECODES)
+    n = len(series)
+    ts_col = series.ts
+    o_col, h_col, l_col, c_col = series.open, series.high, series.low, series.close
+    v_col, q_col, conf_col = series.volume, series.vol_ccy, series.confirm
+
+    i = 0
+    first = True
+    while i < n:
+        bucket = (ts_col[i] - offset) // step * step + offset
+        end = bucket + step
+        j = i
+        o = o_col[i]
+        h = h_col[i]
+        l = l_col[i]
+        vol = 0.0
+        vol_ccy = 0.0
+        while j < n and ts_col[j] < end:
+            h = max(h, h_col[j])
+            l = min(l, l_col[j])
+            vol += v_col[j]
+            vol_ccy += q_col[j]
+            j += 1
+        if first and ts_col[i] != bucket:
+            # Pencere kovanın ortasından başladı → açılış / hacim eksik
+            first = False
+            i = j
+            continue
+        first = False
+        last = j - 1
+        if j < n:
+            confirm = 1
+        else:
+            confirm = 1 if (ts_col[last] == end - hour and conf_col[last]) else 0
+        for col, value in zip(cols, (bucket, o, h, l, c_col[last], vol, vol_ccy, confirm)):
+            col.append(value)
+        i = j
+    return CandleSeries(cols)
+
+
+def resample_1h_limit(limit=CANDLE_LIMIT_4H):
+    """RESAMPLE_FROM_1H'deki barlardan `limit` adet türetmek için gereken 1H sayısı."""
+    need = 0
+    for bar in RESAMPLE_FROM_1H:
+        ratio = RESAMPLE_BARS[bar][0] // BAR_MS["1H"]
+        need = max(need, (limit + 1) * ratio)
+    return need
+
+
+def resample_from_1h(inst_id, bar, limit):
+    """Son `limit` `bar` mumunu (forming dahil) 1H serisinden türetir."""
+    ratio = RESAMPLE_BARS[bar][0] // BAR_MS["1H"]
+    with span("resample." + bar):
+        src = get_candles(inst_id, bar="1H", limit=max((limit + 1) * ratio, resample_1h_limit()))
+        return resample_candles(src, bar)[-limit:]
+
+
+def verify_resample(inst_id, bar="4H", limit=60):
+    """
+    Türetilen barları OKX'in kendi `bar` çıktısıyla karşılaştırır (onaylı barlar).
+    Dönen: {"compared", "mismatches": [(ts, alan, okx, yerel)], "missing": [ts]}
+    """
+    okx = _fetch_candles(inst_id, bar, limit)
+    ratio = RESAMPLE_BARS[bar][0] // BAR_MS["1H"]
+    local = resample_candles(_fetch_candles(inst_id, "1H", (limit + 1) * ratio), bar)
+    by_ts = {local.ts[k]: k for k in range(len(local))}
+    mismatches = []
+    missing = []
+    compared = 0
+    for k in range(len(okx)):
+        if not okx.confirm[k]:
+            continue
+        t = okx.ts[k]
+        m = by_ts.get(t)
+        if m is None:
+            missing.append(t)
+            continue
+        compared += 1
+        for field in ("open", "high", "low", "close", "volume", "vol_ccy"):
+            a = getattr(okx, field)[k]
+            b = getattr(local, field)[m]
+            if abs(a - b) > 1e-9 * max(1.0, abs(a)):
+                mismatches.append((t, field, a, b))
+    return {"compared": compared, "mismatches": mismatches, "missing": missing}
 
 
 def get_trades(inst_id, limit=TRADES_LIMIT):
-    data = okx_jget("/api/v5/market/trades", {"instId": inst_id, "limit": limit})
+    data = snapshot_get(("trades", inst_id, limit), lambda: _fetch_trades(inst_id, limit))
     return data or []
 
 
+def _fetch_trades(inst_id, limit):
+    with span("fetch.trades"):
+        data = okx_jget("/api/v5/market/trades", {"instId": inst_id, "limit": limit})
+    store = get_candle_store()
+    if store is not None and data:
+        # Backtest için trade geçmişi biriktir
+        store.store_trades(inst_id, data)
+    return data
+
+
 def get_orderbook(inst_id, depth=ORDERBOOK_DEPTH):
-    data = okx_jget("/api/v5/market/books", {"instId": inst_id, "sz": depth})
+    return snapshot_get(("books", inst_id, depth), lambda: _fetch_orderbook(inst_id, depth))
+
+
+def _fetch_orderbook(inst_id, depth):
+    with span("fetch.books"):
+        data = okx_jget("/api/v5/market/books", {"instId": inst_id, "sz": depth})
     if not data:
         return None
+    return reduce_orderbook(data[0])
+
 
-    book = data[0]
+def reduce_orderbook(book):
+    """
+    OKX book objesi ({"bids": [[px, sz, ...]], "asks": [...]}) → notional toplamları + en iyi fiyatlar.
+    """
     bids = book.get("bids", [])
     asks = book.get("asks", [])
 
@@ -269,34 +1806,577 @@ def get_orderbook(inst_id, depth=ORDERBOOK_DEPTH):
     }
 
 
-# ========== TEKNİK HESAPLAR ==========
-
-def ema(values, period):
-    if len(values) < period:
-        return None
-    k = 2 / (period + 1)
-    ema_val = sum(values[:period]) / period
-    for v in values[period:]:
-        ema_val = v * k + ema_val * (1 - k)
-    return ema_val
+# ========== YEREL EMİR DEFTERİ ==========
 
+class LocalOrderBook:
+    """
+    Snapshot + artımlı (delta) güncellemelerle tutulan yerel emir defteri.
+    - Fiyat seviyeleri sıralı listelerde tutulur (bisect)
+    - OKX CRC32 checksum'ı ve seqId/prevSeqId zinciri doğrulanır
+    - Kümülatif notional önek toplamları değişiklikten sonra bir kez kurulur:
+      N seviye derinliği O(1), mid'den ±% mesafe O(log n)
+    """
 
-def analyze_trades_orderflow(trades, s_whale, m_whale, x_whale):
+    CHECKSUM_LEVELS = 25
+
+    def __init__(self):
+        self.bids = {}  # px(float) -> (px_str, sz_str)
+        self.asks = {}
+        self._bid_keys = []  # -px artan (en iyi bid başta)
+        self._ask_keys = []  # px artan (en iyi ask başta)
+        self._bid_cum = []
+        self._ask_cum = []
+        self._dirty = True
+        self.seq_id = None
+        self.ts = None
+        self.valid = False
+
+    def _set(self, side, px_str, sz_str):
+        levels, keys = (self.bids, self._bid_keys) if side == "bid" else (self.asks, self._ask_keys)
+        px = float(px_str)
+        key = -px if side == "bid" else px
+        if float(sz_str) == 0:
+            if px in levels:
+                del levels[px]
+                i = bisect.bisect_left(keys, key)
+                if i < len(keys) and keys[i] == key:
+                    del keys[i]
+            return
+        if px not in levels:
+            bisect.insort(keys, key)
+        levels[px] = (px_str, sz_str)
+
+    def _apply_levels(self, data):
+        for lvl in data.get("bids", []):
+            self._set("bid", lvl[0], lvl[1])
+        for lvl in data.get("asks", []):
+            self._set("ask", lvl[0], lvl[1])
+        self._dirty = True
+        self.ts = data.get("ts", self.ts)
+        seq = data.get("seqId")
+        if seq is not None:
+            self.seq_id = seq
+
+    def apply_snapshot(self, data):
+        self.bids.clear()
+        self.asks.clear()
+        self._bid_keys.clear()
+        self._ask_keys.clear()
+        self._apply_levels(data)
+        self.valid = self.verify(data.get("checksum"))
+        return self.valid
+
+    def apply_update(self, data):
+        """Delta uygular. Sıra kopukluğu ya da checksum hatasında False (yeniden snapshot gerekir)."""
+        if not self.valid:
+            return False
+        prev = data.get("prevSeqId")
+        if prev is not None and self.seq_id is not None and prev != self.seq_id:
+            self.valid = False
+            return False
+        self._apply_levels(data)
+        self.valid = self.verify(data.get("checksum"))
+        return self.valid
+
+    def top(self, side, n):
+        """En iyi n seviye: [(px_str, sz_str), ...]"""
+        if side == "bid":
+            return [self.bids[-k] for k in self._bid_keys[:n]]
+        return [self.asks[k] for k in self._ask_keys[:n]]
+
+    def checksum(self):
+        parts = []
+        bids = self.top("bid", self.CHECKSUM_LEVELS)
+        asks = self.top("ask", self.CHECKSUM_LEVELS)
+        for i in range(self.CHECKSUM_LEVELS):
+            if i < len(bids):
+                parts.append(f"{bids[i][0]}:{bids[i][1]}")
+            if i < len(asks):
+                parts.append(f"{asks[i][0]}:{asks[i][1]}")
+        crc = zlib.crc32(":".join(parts).encode())
+        return crc - (1 << 32) if crc >= (1 << 31) else crc
+
+    def verify(self, expected):
+        if expected is None:
+            return True
+        return self.checksum() == int(expected)
+
+    def _rebuild(self):
+        if not self._dirty:
+            return
+        for keys, levels, cum, sign in (
+            (self._bid_keys, self.bids, self._bid_cum, -1),
+            (self._ask_keys, self.asks, self._ask_cum, 1),
+        ):
+            cum.clear()
+            total = 0.0
+            for k in keys:
+                px_str, sz_str = levels[sign * k]
+                total += float(px_str) * float(sz_str)
+                cum.append(total)
+        self._dirty = False
+
+    def depth_notional(self, levels):
+        """En iyi `levels` seviyenin (bid_notional, ask_notional) toplamı."""
+        self._rebuild()
+        b = self._bid_cum[min(levels, len(self._bid_cum)) - 1] if self._bid_cum and levels > 0 else 0.0
+        a = self._ask_cum[min(levels, len(self._ask_cum)) - 1] if self._ask_cum and levels > 0 else 0.0
+        return b, a
+
+    def pct_notional(self, pct):
+        """Mid fiyatın ±pct (örn 0.01 = %1) aralığındaki (bid_notional, ask_notional)."""
+        self._rebuild()
+        if not self._bid_keys or not self._ask_keys:
+            return 0.0, 0.0
+        mid = (-self._bid_keys[0] + self._ask_keys[0]) / 2
+        nb = bisect.bisect_right(self._bid_keys, -mid * (1 - pct))
+        na = bisect.bisect_right(self._ask_keys, mid * (1 + pct))
+        b = self._bid_cum[nb - 1] if nb else 0.0
+        a = self._ask_cum[na - 1] if na else 0.0
+        return b, a
+
+    def imbalance(self, levels=None, pct=None):
+        """bid/ask notional oranı (levels ya da pct ile); ask tarafı boşsa None."""
+        b, a = self.pct_notional(pct) if pct is not None else self.depth_notional(levels or ORDERBOOK_DEPTH)
+        return (b / a) if a > 0 else None
+
+    def summary(self, depth=ORDERBOOK_DEPTH):
+        """get_orderbook / reduce_orderbook ile aynı formatta özet (ilk `depth` seviye)."""
+        b, a = self.depth_notional(depth)
+        return {
+            "bid_notional": b,
+            "ask_notional": a,
+            "best_bid": -self._bid_keys[0] if self._bid_keys else None,
+            "best_ask": self._ask_keys[0] if self._ask_keys else None,
+        }
+
+
+# ========== KALICI MUM DEPOSU ==========
+
+class CandleStore:
     """
-    Spot için:
-    - Net notional delta (buy_notional - sell_notional)
-    - En büyük buy whale (S/M/X)
-    - En büyük sell whale (S/M/X)
-    - Son 20 trade momentum (buy oranı)
+    (instId, bar) anahtarlı SQLite mum deposu.
+    Sonraki run'larda sadece son onaylı (confirm=1) mumdan yeni barlar OKX'in `before`
+    sayfalamasıyla çekilir; analizörler lokal veriden beslenir.
+    Henüz kapanmamış (oluşan) bar confirm=0 ile tutulur ve her senkronda üzerine yazılır.
     """
-    buy_notional = 0.0
-    sell_notional = 0.0
-    biggest_buy_whale = None
-    biggest_sell_whale = None
 
-    # Son 20 trade momentum (en yeni en üstte geliyor, ama sıra önemli değil)
-    last_trades = trades[:20]
-    buy_count = 0
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS candles (
+                inst_id TEXT NOT NULL,
+                bar TEXT NOT NULL,
+                ts INTEGER NOT NULL,
+                open REAL NOT NULL,
+                high REAL NOT NULL,
+                low REAL NOT NULL,
+                close REAL NOT NULL,
+                vol REAL NOT NULL,
+                vol_ccy REAL NOT NULL,
+                confirm INTEGER NOT NULL,
+                PRIMARY KEY (inst_id, bar, ts)
+            ) WITHOUT ROWID
+            """
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS trades (
+                inst_id TEXT NOT NULL,
+                trade_id INTEGER NOT NULL,
+                ts INTEGER NOT NULL,
+                px TEXT NOT NULL,
+                sz TEXT NOT NULL,
+                side TEXT NOT NULL,
+                PRIMARY KEY (inst_id, trade_id)
+            ) WITHOUT ROWID
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS trades_ts ON trades (inst_id, ts)")
+        # Rolling order-flow backfill imleci: since_ts'ten last_trade_id'ye kadar trade'ler kesintisiz depoda
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS trade_cursor (
+                inst_id TEXT PRIMARY KEY,
+                since_ts INTEGER NOT NULL,
+                last_trade_id INTEGER NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+        self.requests = 0
+        self.bars_downloaded = 0
+        self.bars_served = 0
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def last_confirmed_ts(self, inst_id, bar):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MAX(ts) FROM candles WHERE inst_id = ? AND bar = ? AND confirm = 1",
+                (inst_id, bar),
+            ).fetchone()
+        return row[0] if row else None
+
+    def count(self, inst_id, bar):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM candles WHERE inst_id = ? AND bar = ?", (inst_id, bar)
+            ).fetchone()
+        return row[0]
+
+    def upsert(self, inst_id, bar, rows):
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO candles VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(inst_id, bar) + tuple(r) for r in rows],
+            )
+            # Onaylı son barın ötesinde kalmış eski "oluşan" barlar artık geçersiz
+            last_ts = rows[-1][0]
+            self._conn.execute(
+                "DELETE FROM candles WHERE inst_id = ? AND bar = ? AND confirm = 0 AND ts < ?",
+                (inst_id, bar, last_ts),
+            )
+            self._conn.commit()
+
+    def store_trades(self, inst_id, trades):
+        rows = []
+        for t in trades:
+            try:
+                rows.append((inst_id, int(t["tradeId"]), int(t["ts"]), t["px"], t["sz"], t["side"]))
+            except Exception:
+                continue
+        if not rows:
+            return
+        # Backtest penceresinden eski trade'ler budanır (depo actions/cache ile taşınıyor, sınırsız büyümesin)
+        cutoff = max(r[2] for r in rows) - TRADE_RETENTION_MS
+        with self._lock:
+            self._conn.executemany("INSERT OR IGNORE INTO trades VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self._conn.execute("DELETE FROM trades WHERE inst_id = ? AND ts < ?", (inst_id, cutoff))
+            self._conn.commit()
+
+    def trade_cursor(self, inst_id):
+        """(since_ts, last_trade_id) ya da None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT since_ts, last_trade_id FROM trade_cursor WHERE inst_id = ?", (inst_id,)
+            ).fetchone()
+        return tuple(row) if row else None
+
+    def set_trade_cursor(self, inst_id, since_ts, last_trade_id):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO trade_cursor VALUES (?, ?, ?)", (inst_id, int(since_ts), int(last_trade_id))
+            )
+            self._conn.commit()
+
+    def trade_notional_mean(self, inst_id):
+        """Depodaki trade'lerin ortalama quote büyüklüğü (px × sz); kayıt yoksa None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT AVG(CAST(px AS REAL) * CAST(sz AS REAL)) FROM trades WHERE inst_id = ?", (inst_id,)
+            ).fetchone()
+        return row[0] if row and row[0] else None
+
+    def load_trades(self, inst_id, since_ms=None, until_ms=None):
+        """[since, until) aralığındaki trade'leri OKX formatında, en yeni başta döner."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT trade_id, ts, px, sz, side FROM trades WHERE inst_id = ? AND ts >= ? AND ts < ? "
+                "ORDER BY ts DESC, trade_id DESC",
+                (inst_id, since_ms or 0, until_ms if until_ms is not None else 1 << 62),
+            ).fetchall()
+        return [
+            {"instId": inst_id, "tradeId": str(tid), "ts": str(t), "px": px, "sz": sz, "side": side}
+            for tid, t, px, sz, side in rows
+        ]
+
+    def load_all(self, inst_id, bar):
+        """Depodaki tüm barlar (kronolojik CandleSeries)."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT ts, open, high, low, close, vol, vol_ccy, confirm FROM candles "
+                "WHERE inst_id = ? AND bar = ? ORDER BY ts",
+                (inst_id, bar),
+            ).fetchall()
+        return CandleSeries.from_rows(rows)
+
+    def load(self, inst_id, bar, limit):
+        """Son `limit` barı kronolojik sırayla (ts, o, h, l, c, vol, volCcy, confirm) olarak döner."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT ts, open, high, low, close, vol, vol_ccy, confirm FROM candles "
+                "WHERE inst_id = ? AND bar = ? ORDER BY ts DESC LIMIT ?",
+                (inst_id, bar, limit),
+            ).fetchall()
+        rows.reverse()
+        return rows
+
+    def _download(self, path, params):
+        data = okx_jget(path, params)
+        rows = parse_candle_rows(data)
+        with self._lock:
+            self.requests += 1
+            self.bars_downloaded += len(rows)
+        return rows
+
+    def sync(self, inst_id, bar, limit):
+        """
+        Depoyu OKX ile günceller:
+        - Depoda yeterli geçmiş yoksa ya da boşluk tek sayfayı aşıyorsa son `limit` bar tamamen çekilir.
+        - Aksi halde sadece son onaylı bardan daha yeni barlar (`before`) çekilir.
+        """
+        bar_ms = BAR_MS.get(bar)
+        last_ts = self.last_confirmed_ts(inst_id, bar)
+        now_ms = int(datetime.now(timezone.utc).timestamp() * 1000)
+
+        incremental = (
+            bar_ms is not None
+            and last_ts is not None
+            and self.count(inst_id, bar) >= limit
+            and (now_ms - last_ts) // bar_ms < OKX_CANDLE_PAGE
+        )
+        if incremental:
+            rows = self._download(
+                "/api/v5/market/candles",
+                {"instId": inst_id, "bar": bar, "before": last_ts, "limit": OKX_CANDLE_PAGE},
+            )
+        else:
+            rows = self._download(
+                "/api/v5/market/candles",
+                {"instId": inst_id, "bar": bar, "limit": min(max(limit, 1), OKX_CANDLE_PAGE)},
+            )
+            if limit > OKX_CANDLE_PAGE and rows:
+                self.upsert(inst_id, bar, rows)
+                self.backfill(inst_id, bar, limit)
+                return
+        self.upsert(inst_id, bar, rows)
+
+    def backfill(self, inst_id, bar, bars):
+        """
+        Depodaki en eski bardan geriye doğru /market/history-candles (`after`) ile
+        toplam `bars` adet bara ulaşana kadar derin geçmiş çeker.
+        """
+        while self.count(inst_id, bar) < bars:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT MIN(ts) FROM candles WHERE inst_id = ? AND bar = ?", (inst_id, bar)
+                ).fetchone()
+            oldest = row[0] if row else None
+            params = {"instId": inst_id, "bar": bar, "limit": OKX_HISTORY_CANDLE_PAGE}
+            if oldest is not None:
+                params["after"] = oldest
+            rows = self._download("/api/v5/market/history-candles", params)
+            if not rows:
+                break
+            self.upsert(inst_id, bar, rows)
+
+    def get_candles(self, inst_id, bar, limit):
+        self.sync(inst_id, bar, limit)
+        rows = self.load(inst_id, bar, limit)
+        with self._lock:
+            self.bars_served += len(rows)
+        return CandleSeries.from_rows(rows)
+
+    def stats(self):
+        with self._lock:
+            saved = 1 - (self.bars_downloaded / self.bars_served) if self.bars_served else 0.0
+            return {
+                "requests": self.requests,
+                "bars_downloaded": self.bars_downloaded,
+                "bars_served": self.bars_served,
+                "saved_ratio": saved,
+            }
+
+
+CANDLE_STORE = None
+_CANDLE_STORE_LOCK = threading.Lock()
+
+
+def get_candle_store():
+    """CANDLE_DB_PATH tanımlıysa paylaşılan CandleStore örneğini (lazy) döner."""
+    global CANDLE_STORE
+    if not CANDLE_DB_PATH:
+        return None
+    if CANDLE_STORE is None:
+        with _CANDLE_STORE_LOCK:
+            if CANDLE_STORE is None:
+                CANDLE_STORE = CandleStore(CANDLE_DB_PATH)
+    return CANDLE_STORE
+
+
+# ========== TEKNİK HESAPLAR ==========
+
+def ema(values, period):
+    if len(values) < period:
+        return None
+    k = 2 / (period + 1)
+    ema_val = sum(values[:period]) / period
+    for v in values[period:]:
+        ema_val = v * k + ema_val * (1 - k)
+    return ema_val
+
+
+# ---- Akış (streaming) indikatör durumları ----
+#
+# Her biri bar başına O(1) güncellenir ve to_dict()/from_dict() ile JSON'a yazılabilir.
+# Yapı durumu analiz cache'inde run'lar arası ilerler (yalnız yeni kapanan barlar işlenir);
+# EMA/MACD durumları ema() ile aynı sonucu vermesi için pencere başına kurulur (_window_state).
+
+class EmaState:
+    """
+    ema() ile aynı formül: ilk `period` değerin ortalamasıyla tohumlanır, sonrası v*k + ema*(1-k).
+    Aynı değer dizisiyle beslenince ema() ile birebir aynı sonucu verir.
+    """
+
+    __slots__ = ("period", "k", "value", "count", "seed", "ts")
+
+    def __init__(self, period):
+        self.period = period
+        self.k = 2 / (period + 1)
+        self.value = None  # tohumlanana kadar None
+        self.count = 0
+        self.seed = 0.0
+        self.ts = None  # son işlenen barın ts'i
+
+    def update(self, x, ts=None):
+        self.count += 1
+        if self.value is None:
+            self.seed += x
+            if self.count == self.period:
+                self.value = self.seed / self.period
+        else:
+            self.value = x * self.k + self.value * (1 - self.k)
+        if ts is not None:
+            self.ts = ts
+        return self.value
+
+    def peek(self, x):
+        """x sıradaki (forming) bar olsaydı EMA; durum değişmez."""
+        if self.value is None:
+            return (self.seed + x) / self.period if self.count + 1 == self.period else None
+        return x * self.k + self.value * (1 - self.k)
+
+    def to_dict(self):
+        return {"period": self.period, "value": self.value, "count": self.count, "seed": self.seed, "ts": self.ts}
+
+    @classmethod
+    def from_dict(cls, d):
+        st = cls(d["period"])
+        st.value, st.count, st.seed, st.ts = d["value"], d["count"], d["seed"], d["ts"]
+        return st
+
+
+class MacdState:
+    """MACD = EMA(fast) - EMA(slow); sinyal hattı kapanmış barların MACD'sinin EMA(signal)'ı."""
+
+    __slots__ = ("fast", "slow", "signal", "ts")
+
+    def __init__(self, fast=12, slow=26, signal=9):
+        self.fast = EmaState(fast)
+        self.slow = EmaState(slow)
+        self.signal = EmaState(signal)
+        self.ts = None
+
+    def update(self, x, ts=None):
+        f = self.fast.update(x, ts)
+        s = self.slow.update(x, ts)
+        if ts is not None:
+            self.ts = ts
+        if f is None or s is None:
+            return None
+        self.signal.update(f - s, ts)
+        return f - s
+
+    def peek(self, x):
+        """(fast, slow, macd) — x sıradaki bar olsaydı."""
+        f = self.fast.peek(x)
+        s = self.slow.peek(x)
+        return f, s, (f - s if f is not None and s is not None else None)
+
+    def to_dict(self):
+        return {"fast": self.fast.to_dict(), "slow": self.slow.to_dict(), "signal": self.signal.to_dict(), "ts": self.ts}
+
+    @classmethod
+    def from_dict(cls, d):
+        st = cls.__new__(cls)
+        st.fast = EmaState.from_dict(d["fast"])
+        st.slow = EmaState.from_dict(d["slow"])
+        st.signal = EmaState.from_dict(d["signal"])
+        st.ts = d["ts"]
+        return st
+
+
+class RollingExtremes:
+    """
+    Son `window` değerin max/min'i — monotonik deque'lerle push başına amortize O(1).
+    max(values[-window:]) / min(values[-window:]) ile aynı değerleri verir.
+    """
+
+    __slots__ = ("window", "count", "_max", "_min")
+
+    def __init__(self, window):
+        self.window = window
+        self.count = 0
+        self._max = deque()  # (index, değer), değerler azalan
+        self._min = deque()  # (index, değer), değerler artan
+
+    def push(self, x):
+        i = self.count
+        self.count += 1
+        while self._max and self._max[-1][1] <= x:
+            self._max.pop()
+        self._max.append((i, x))
+        while self._min and self._min[-1][1] >= x:
+            self._min.pop()
+        self._min.append((i, x))
+        expired = i - self.window
+        if self._max[0][0] <= expired:
+            self._max.popleft()
+        if self._min[0][0] <= expired:
+            self._min.popleft()
+
+    def max(self):
+        return self._max[0][1] if self._max else None
+
+    def min(self):
+        return self._min[0][1] if self._min else None
+
+    def to_dict(self):
+        return {"window": self.window, "count": self.count, "max": list(self._max), "min": list(self._min)}
+
+    @classmethod
+    def from_dict(cls, d):
+        st = cls(d["window"])
+        st.count = d["count"]
+        st._max = deque(tuple(e) for e in d["max"])
+        st._min = deque(tuple(e) for e in d["min"])
+        return st
+
+
+def analyze_trades_orderflow(trades, s_whale, m_whale, x_whale):
+    """
+    Spot için:
+    - Net notional delta (buy_notional - sell_notional)
+    - En büyük buy whale (S/M/X)
+    - En büyük sell whale (S/M/X)
+    - Son 20 trade momentum (buy oranı)
+    """
+    buy_notional = 0.0
+    sell_notional = 0.0
+    biggest_buy_whale = None
+    biggest_sell_whale = None
+
+    # Son 20 trade momentum (en yeni en üstte geliyor, ama sıra önemli değil)
+    last_trades = trades[:20]
+    buy_count = 0
     sell_count = 0
 
     for t in trades:
@@ -381,6 +2461,287 @@ def analyze_trades_orderflow(trades, s_whale, m_whale, x_whale):
     }
 
 
+# ---- Zaman pencereli order-flow (rolling) ----
+
+def _whale_tier(notional, s_whale, m_whale, x_whale):
+    if notional >= x_whale:
+        return "X"
+    if notional >= m_whale:
+        return "M"
+    if notional >= s_whale:
+        return "S"
+    return None
+
+
+class TradeWindow:
+    """
+    Tek sembol + tek zaman penceresi için sabit bellekli trade halkası.
+    Ekleme / süre dolumu trade başına amortize O(1):
+    - buy/sell notional ve adet toplamları kayan toplam olarak tutulur
+    - en büyük buy/sell trade monoton deque ile tutulur (pencereden çıkınca düşer)
+    """
+
+    def __init__(self, window_ms, capacity):
+        self.window_ms = window_ms
+        self.capacity = capacity
+        self.ring = deque()  # (seq, ts, notional, is_buy)
+        self.seq = 0
+        self.buy_notional = 0.0
+        self.sell_notional = 0.0
+        self.buy_count = 0
+        self.sell_count = 0
+        self.max_buy = deque()   # (seq, notional, trade) — notional azalan
+        self.max_sell = deque()
+
+    def _evict_left(self):
+        seq, _, notional, is_buy = self.ring.popleft()
+        if is_buy:
+            self.buy_notional -= notional
+            self.buy_count -= 1
+            if self.max_buy and self.max_buy[0][0] == seq:
+                self.max_buy.popleft()
+        else:
+            self.sell_notional -= notional
+            self.sell_count -= 1
+            if self.max_sell and self.max_sell[0][0] == seq:
+                self.max_sell.popleft()
+
+    def add(self, ts_ms, px, sz, is_buy):
+        if len(self.ring) >= self.capacity:
+            self._evict_left()
+        notional = px * abs(sz)
+        self.seq += 1
+        self.ring.append((self.seq, ts_ms, notional, is_buy))
+        trade = {"px": px, "sz": sz, "usd": notional, "side": "buy" if is_buy else "sell", "ts": str(ts_ms)}
+        if is_buy:
+            self.buy_notional += notional
+            self.buy_count += 1
+            mono = self.max_buy
+        else:
+            self.sell_notional += notional
+            self.sell_count += 1
+            mono = self.max_sell
+        while mono and mono[-1][1] <= notional:
+            mono.pop()
+        mono.append((self.seq, notional, trade))
+
+    def expire(self, now_ms):
+        cutoff = now_ms - self.window_ms
+        while self.ring and self.ring[0][1] <= cutoff:
+            self._evict_left()
+
+    def summary(self, s_whale, m_whale, x_whale):
+        """
+        analyze_trades_orderflow ile aynı şekilde dict (pencere içindeki tüm trade'ler üzerinden).
+        Not: buy_ratio / sell_ratio da tüm pencereyi kapsar (snapshot'taki "son 20 trade" değil).
+        """
+        def whale(mono):
+            if not mono:
+                return None
+            _, notional, trade = mono[0]
+            tier = _whale_tier(notional, s_whale, m_whale, x_whale)
+            if tier is None:
+                return None
+            return dict(trade, tier=tier)
+
+        buy_whale = whale(self.max_buy)
+        sell_whale = whale(self.max_sell)
+        total = self.buy_count + self.sell_count
+        buy_ratio = self.buy_count / total if total else 0.5
+        sell_ratio = self.sell_count / total if total else 0.5
+        # Kayan toplamlarda birikmiş float hatası: pencere boşalınca sıfırla
+        if not self.ring:
+            self.buy_notional = self.sell_notional = 0.0
+        return {
+            "buy_notional": self.buy_notional,
+            "sell_notional": self.sell_notional,
+            "net_delta": self.buy_notional - self.sell_notional,
+            "buy_whale": buy_whale,
+            "sell_whale": sell_whale,
+            "has_buy_whale": buy_whale is not None,
+            "has_sell_whale": sell_whale is not None,
+            "buy_ratio": buy_ratio,
+            "sell_ratio": sell_ratio,
+            "trades": total,
+        }
+
+
+class RollingOrderFlow:
+    """
+    Sembol başına zaman pencereli (ORDERFLOW_WINDOWS) trade agregatörü.
+    - add_trades(): OKX trade dict'leri (REST ya da WS), tradeId ile tekrar sayılmaz
+    - backfill(): /market/history-trades ile geriye doğru sayfalı doldurma (depodaki imleçten devam)
+    - query(): pencere için analyze_trades_orderflow formatında özet; pencerenin başı eksikse
+      "truncated": True (backfill sayfa sınırına takıldı)
+    """
+
+    def __init__(self, windows=None, capacity=None):
+        self.windows = dict(windows or ORDERFLOW_WINDOWS)
+        self.capacity = capacity or ORDERFLOW_RING_CAPACITY
+        self._lock = threading.Lock()
+        self._symbols = {}   # inst_id -> {window_name: TradeWindow}
+        self._last_id = {}   # inst_id -> son eklenen tradeId
+        self._since = {}     # inst_id -> trade'lerin kesintisiz olduğu en eski ts
+        self._backfilled = set()
+
+    def _windows_for(self, inst_id):
+        wins = self._symbols.get(inst_id)
+        if wins is None:
+            wins = {name: TradeWindow(ms, self.capacity) for name, ms in self.windows.items()}
+            self._symbols[inst_id] = wins
+        return wins
+
+    def add_trades(self, inst_id, trades):
+        parsed = []
+        for t in trades:
+            try:
+                parsed.append(
+                    (int(t.get("tradeId") or 0), int(t.get("ts")), float(t.get("px")), float(t.get("sz")),
+                     (t.get("side") or "").lower())
+                )
+            except Exception:
+                continue
+        parsed.sort()
+        added = 0
+        with self._lock:
+            wins = self._windows_for(inst_id)
+            last_id = self._last_id.get(inst_id, 0)
+            for trade_id, ts_ms, px, sz, side in parsed:
+                if trade_id and trade_id <= last_id:
+                    continue
+                if side not in ("buy", "sell"):
+                    continue
+                self._since.setdefault(inst_id, ts_ms)
+                for w in wins.values():
+                    w.add(ts_ms, px, sz, side == "buy")
+                last_id = max(last_id, trade_id)
+                added += 1
+            self._last_id[inst_id] = last_id
+        return added
+
+    def backfill(self, inst_id, window_ms=None, now_ms=None, max_pages=HISTORY_TRADES_MAX_PAGES):
+        """
+        En uzun pencereyi dolduracak kadar geçmiş trade'i `after` (tradeId) sayfalamasıyla çeker.
+        Mum deposu açıksa önceki run'ların kesintisiz kısmı (trade_cursor) depodan okunur; REST yalnız
+        imleçten yeni trade'ler için sayfalanır, çekilenler depoya yazılıp imleç ilerletilir
+        (saatlik cron'da her run aynı 20 sayfayı baştan çekmesin).
+        Dönüş: {"added", "pages", "since_ts", "truncated"} — truncated: sayfa sınırı pencerenin başına
+        (ya da imlece) ulaşmadan doldu; özet pencerenin yalnız son kısmını kapsar.
+        """
+        if now_ms is None:
+            now_ms = int(datetime.now(timezone.utc).timestamp() * 1000)
+        window_ms = window_ms or max(self.windows.values())
+        cutoff = now_ms - window_ms
+        store = get_candle_store()
+        cursor = store.trade_cursor(inst_id) if store is not None else None
+        stop_id = cursor[1] if cursor else 0
+        collected = []
+        after = None
+        pages = 0
+        reached = None  # "window": pencere başına, "cursor": depodaki imlece ulaşıldı
+        for _ in range(max_pages):
+            params = {"instId": inst_id, "type": "1", "limit": HISTORY_TRADES_PAGE}
+            if after is not None:
+                params["after"] = after
+            page = okx_jget("/api/v5/market/history-trades", params)
+            pages += 1
+            if not page:
+                break
+            collected.extend(page)
+            oldest = page[-1]
+            after = oldest.get("tradeId")
+            try:
+                if int(oldest.get("ts")) <= cutoff:
+                    reached = "window"
+                    break
+                if int(after) <= stop_id:
+                    reached = "cursor"
+                    break
+            except Exception:
+                break
+
+        trades = [t for t in collected if int(t.get("ts") or 0) > cutoff]
+        since_ts = None
+        if collected:
+            newest_id = max(int(t.get("tradeId") or 0) for t in collected)
+            since_ts = min(int(t.get("ts") or 0) for t in collected)
+            if store is not None:
+                store.store_trades(inst_id, collected)
+                if reached == "cursor":
+                    # İmlece bağlandı: depodaki kesintisiz geçmiş pencereye eklenir
+                    since_ts = cursor[0]
+                    trades = [
+                        t for t in store.load_trades(inst_id, since_ms=max(cutoff + 1, since_ts))
+                        if int(t["tradeId"]) <= newest_id
+                    ]
+                store.set_trade_cursor(inst_id, since_ts, newest_id)
+            if reached == "window":
+                since_ts = min(since_ts, cutoff)
+        added = self.add_trades(inst_id, trades)
+        with self._lock:
+            self._backfilled.add(inst_id)
+            if since_ts is not None:
+                self._since[inst_id] = since_ts
+            else:
+                self._since.setdefault(inst_id, now_ms)
+            since_ts = self._since[inst_id]
+        return {"added": added, "pages": pages, "since_ts": since_ts, "truncated": since_ts > cutoff}
+
+    def is_backfilled(self, inst_id):
+        with self._lock:
+            return inst_id in self._backfilled
+
+    def reset(self, inst_id):
+        """Sembolün pencerelerini boşaltır (akış koptu → içlerinde boşluk var); sonra backfill edilmeli."""
+        with self._lock:
+            self._symbols.pop(inst_id, None)
+            self._last_id.pop(inst_id, None)
+            self._since.pop(inst_id, None)
+            self._backfilled.discard(inst_id)
+
+    def query(self, inst_id, window, s_whale, m_whale, x_whale, now_ms=None):
+        if now_ms is None:
+            now_ms = int(datetime.now(timezone.utc).timestamp() * 1000)
+        with self._lock:
+            w = self._windows_for(inst_id)[window]
+            w.expire(now_ms)
+            of = w.summary(s_whale, m_whale, x_whale)
+            of["truncated"] = self._since.get(inst_id, now_ms) > now_ms - w.window_ms
+            return of
+
+
+ORDERFLOW = RollingOrderFlow()
+
+
+def get_orderflow(inst_id, s_whale, m_whale, x_whale):
+    """
+    Analizörlerin order-flow kaynağı.
+    - ORDERFLOW_WINDOW boş → son TRADES_LIMIT trade snapshot'ı (analyze_trades_orderflow)
+    - ORDERFLOW_WINDOW = "5m" / "1h" / "4h" → rolling agregatörden o pencere
+      (ilk kullanımda history-trades ile doldurulur, sonra son trade'lerle artımlı güncellenir);
+      pencerenin başı eksikse özet "truncated": True taşır, ORDERFLOW_ALLOW_PARTIAL=0 ise None döner
+    Veri yoksa None.
+    """
+    snap = SNAPSHOT
+    if snap is not None:
+        # Backtest gibi dış kaynaklar hazır order-flow özeti yükleyebilir
+        found, of = snap.lookup(("orderflow", inst_id))
+        if found:
+            return of
+
+    trades = get_trades(inst_id)
+    if not ORDERFLOW_WINDOW:
+        return analyze_trades_orderflow(trades, s_whale, m_whale, x_whale) if trades else None
+
+    if not ORDERFLOW.is_backfilled(inst_id):
+        ORDERFLOW.backfill(inst_id)
+    ORDERFLOW.add_trades(inst_id, trades)
+    of = ORDERFLOW.query(inst_id, ORDERFLOW_WINDOW, s_whale, m_whale, x_whale)
+    if of["truncated"] and not ORDERFLOW_ALLOW_PARTIAL:
+        return None
+    return of if of["trades"] else None
+
+
 # ---- Market Structure Break (MSB) ----
 
 def detect_bullish_msb(candles, lookback):
@@ -392,9 +2753,9 @@ def detect_bullish_msb(candles, lookback):
     if len(candles) < lookback + 2:
         return False, None
 
-    closes = [c["close"] for c in candles[-(lookback + 1):-1]]
-    level = max(closes)
-    last_close = candles[-1]["close"]
+    closes = as_series(candles).close
+    level = max(closes[-(lookback + 1):-1])
+    last_close = closes[-1]
 
     if last_close > level * 1.001:
         return True, level
@@ -410,9 +2771,9 @@ def detect_bearish_msb(candles, lookback):
     if len(candles) < lookback + 2:
         return False, None
 
-    closes = [c["close"] for c in candles[-(lookback + 1):-1]]
-    level = min(closes)
-    last_close = candles[-1]["close"]
+    closes = as_series(candles).close
+    level = min(closes[-(lookback + 1):-1])
+    last_close = closes[-1]
 
     if last_close < level * 0.999:
         return True, level
@@ -433,27 +2794,27 @@ def find_recent_fvg(candles, lookback):
     if n < 3:
         return None
 
+    series = as_series(candles)
+    highs = series.high
+    lows = series.low
     start = max(2, n - lookback)
     last_fvg = None
 
     for i in range(start, n):
-        c1 = candles[i - 2]
-        c3 = candles[i]
-
-        # Bullish FVG (gap aşağıda)
-        if c1["high"] < c3["low"]:
-            zone_low = c1["high"]
-            zone_high = c3["low"]
+        # Bullish FVG (gap aşağıda): high(i-2) < low(i)
+        if highs[i - 2] < lows[i]:
+            zone_low = highs[i - 2]
+            zone_high = lows[i]
             last_fvg = {
                 "type": "bullish",
                 "low": zone_low,
                 "high": zone_high,
             }
 
-        # Bearish FVG (gap yukarıda)
-        if c1["low"] > c3["high"]:
-            zone_low = c3["high"]
-            zone_high = c1["low"]
+        # Bearish FVG (gap yukarıda): low(i-2) > high(i)
+        if lows[i - 2] > highs[i]:
+            zone_low = highs[i]
+            zone_high = lows[i - 2]
             last_fvg = {
                 "type": "bearish",
                 "low": zone_low,
@@ -472,11 +2833,11 @@ def check_fvg_rejection(candles, fvg):
     if not fvg or len(candles) < 1:
         return False
 
-    last = candles[-1]
-    low = last["low"]
-    high = last["high"]
-    close = last["close"]
-    op = last["open"]
+    series = as_series(candles)
+    low = series.low[-1]
+    high = series.high[-1]
+    close = series.close[-1]
+    op = series.open[-1]
 
     z_low = fvg["low"]
     z_high = fvg["high"]
@@ -507,6 +2868,478 @@ def check_fvg_rejection(candles, fvg):
     return False
 
 
+def compute_structure(candles, lookback):
+    """
+    MSB + FVG yapısını tek seferde hesaplar.
+    Dönen dict batch_structure'ın sembol başına çıktısıyla birebir aynıdır.
+    """
+    bull_msb, bull_level = detect_bullish_msb(candles, lookback)
+    bear_msb, bear_level = detect_bearish_msb(candles, lookback)
+    fvg = find_recent_fvg(candles, lookback)
+    return {
+        "bull_msb": bull_msb,
+        "bull_level": bull_level,
+        "bear_msb": bear_msb,
+        "bear_level": bear_level,
+        "fvg": fvg,
+        "fvg_reject": check_fvg_rejection(candles, fvg) if fvg else False,
+    }
+
+
+# ---- Run'lar arası analiz cache'i ----
+#
+# Yapı, kapanmış barlarla ilerleyen akış durumu olarak (StreamingStructure) (tür, instId, bar,
+# parametreler) anahtarıyla diske yazılır; her run yalnız durumun son ts'inden sonra kapanan
+# barları işler. EMA/MACD ise pencerenin kendisiyle tohumlanır (ema() gibi; backtest / sweep ile
+# aynı trend kararı) → durumları (pencere ilk ts, son kapanmış ts) anahtarıyla tutulur, aynı
+# pencere tekrar görülünce (canlı mod, aynı bar içindeki run'lar) yeniden hesaplanmaz.
+# Son (forming) bar her seferinde durumun üzerine uygulanır; sonuçlar cache'siz hesapla birebir aynıdır.
+
+class AnalysisCache:
+    """
+    LRU + boyut sınırlı, JSON'a kalıcı analiz cache'i (thread-safe).
+    Değerler akış durumu nesneleridir (EmaState, MacdState, StreamingStructure); dosyaya to_dict() ile yazılır.
+    """
+
+    def __init__(self, path, max_entries=ANALYSIS_CACHE_MAX):
+        self.path = path
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._dirty = False
+        if path and os.path.exists(path):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    doc = json.load(f)
+                if doc.get("version") == ANALYSIS_CACHE_VERSION:
+                    # Dosya LRU sırasıyla (eskiden yeniye) yazılır
+                    for key, value in doc.get("entries", []):
+                        self._data[key] = _STREAM_TYPES[value["type"]].from_dict(value["state"])
+            except Exception as e:
+                print("Analiz cache okunamadı:", e)
+
+    @staticmethod
+    def make_key(*parts):
+        return hashlib.sha1(json.dumps(parts, separators=(",", ":")).encode()).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            self._dirty = True
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def save(self):
+        with self._lock:
+            if not self.path or not self._dirty:
+                return
+            doc = {
+                "version": ANALYSIS_CACHE_VERSION,
+                "entries": [[k, {"type": type(v).__name__, "state": v.to_dict()}] for k, v in self._data.items()],
+            }
+            self._dirty = False
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(doc, f, separators=(",", ":"))
+        os.replace(tmp, self.path)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits / total) if total else 0.0,
+            }
+
+
+ANALYSIS_CACHE = None
+
+
+def get_analysis_cache():
+    """ANALYSIS_CACHE_PATH tanımlıysa paylaşılan AnalysisCache örneğini (lazy) döner."""
+    global ANALYSIS_CACHE
+    if not ANALYSIS_CACHE_PATH:
+        return None
+    if ANALYSIS_CACHE is None or ANALYSIS_CACHE.path != ANALYSIS_CACHE_PATH:
+        ANALYSIS_CACHE = AnalysisCache(ANALYSIS_CACHE_PATH)
+    return ANALYSIS_CACHE
+
+
+class StreamingStructure:
+    """
+    compute_structure'ın kapanmış barlara bağlı kısmı, bar başına O(1):
+    - MSB seviyeleri: son `lookback` kapanışın max/min'i (RollingExtremes)
+    - FVG: son görülen gap ve oluştuğu bar indeksi (pencereden çıkınca geçersiz)
+    """
+
+    __slots__ = ("lookback", "extremes", "count", "ts", "prev", "fvg", "fvg_idx")
+
+    def __init__(self, lookback):
+        self.lookback = lookback
+        self.extremes = RollingExtremes(lookback)
+        self.count = 0
+        self.ts = None
+        self.prev = []  # son iki barın (high, low)'u
+        self.fvg = None
+        self.fvg_idx = -1
+
+    def push(self, high, low, close, ts=None):
+        i = self.count
+        self.extremes.push(close)
+        if i >= 2:
+            # find_recent_fvg ile aynı sıra: aynı barda bearish, bullish'i ezer
+            h2, l2 = self.prev[0]
+            if h2 < low:
+                self.fvg, self.fvg_idx = {"type": "bullish", "low": h2, "high": low}, i
+            if l2 > high:
+                self.fvg, self.fvg_idx = {"type": "bearish", "low": high, "high": l2}, i
+        self.prev.append((high, low))
+        if len(self.prev) > 2:
+            del self.prev[0]
+        self.count += 1
+        if ts is not None:
+            self.ts = ts
+
+    def covers(self, n):
+        """n uzunluklu (son bar forming) seri için yeterli kapanmış bar işlendi mi?"""
+        return self.count >= min(n - 1, self.lookback + 1)
+
+    def closed_state(self, n):
+        """structure_from_state'in beklediği {"hi", "lo", "fvg"} — n: seri uzunluğu (forming dahil)."""
+        state = {"hi": None, "lo": None, "fvg": None}
+        if n >= self.lookback + 2:
+            state["hi"] = self.extremes.max()
+            state["lo"] = self.extremes.min()
+        # Seri indeksi s ↔ akış indeksi s + count - (n - 1); FVG aralığı s ∈ [max(2, n - lookback), n - 1)
+        if self.fvg is not None and self.fvg_idx >= max(2, n - self.lookback) + self.count - (n - 1):
+            state["fvg"] = self.fvg
+        return state
+
+    def to_dict(self):
+        return {
+            "lookback": self.lookback,
+            "extremes": self.extremes.to_dict(),
+            "count": self.count,
+            "ts": self.ts,
+            "prev": self.prev,
+            "fvg": self.fvg,
+            "fvg_idx": self.fvg_idx,
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        st = cls(d["lookback"])
+        st.extremes = RollingExtremes.from_dict(d["extremes"])
+        st.count, st.ts, st.fvg, st.fvg_idx = d["count"], d["ts"], d["fvg"], d["fvg_idx"]
+        st.prev = [tuple(p) for p in d["prev"]]
+        return st
+
+
+def advance_stream(cache, key, series, new, push, valid=None, create=True):
+    """
+    Kalıcı akış durumunu serinin kapanmış barlarıyla (son bar hariç) ilerletir.
+    Cache'teki durumun son ts'i seride yoksa (arada kaçan bar / pencere dışı) ya da valid(durum)
+    False ise seriden yeniden tohumlanır. cache None → her seferinde seriden kurulur.
+    create=False → kullanılabilir durum yoksa tohumlamadan None döner (toplu motor kendisi hesaplar).
+    """
+    closed = len(series) - 1
+    ts_col = series.ts
+    state = None
+    start = 0
+    doc = cache.get(key) if cache is not None else None
+    if doc is not None:
+        state = doc
+        pos = bisect.bisect_left(ts_col, state.ts, 0, closed) if state.ts is not None else closed
+        if pos < closed and ts_col[pos] == state.ts:
+            start = pos + 1
+        else:
+            state = None
+    if state is not None and valid is not None and not valid(state):
+        state = None
+    if state is None:
+        if not create:
+            return None
+        state = new()
+        start = 0
+    for i in range(start, closed):
+        push(state, i)
+    if cache is not None and (doc is not state or start < closed):
+        cache.put(key, state)
+    return state
+
+
+_STREAM_TYPES = {cls.__name__: cls for cls in (EmaState, MacdState, StreamingStructure)}
+
+
+def _stream_key(kind, inst_id, bar, series, *params):
+    """Son kapanmış bar onaylıysa akış durumu anahtarı, değilse None (cache'lenmez)."""
+    if len(series) < 2 or not series.confirm[-2]:
+        return None
+    return AnalysisCache.make_key(kind, inst_id, bar, *params)
+
+
+def structure_from_state(candles, lookback, state):
+    """Kapanmış bar durumunu son barla birleştirir → compute_structure ile birebir aynı dict."""
+    series = as_series(candles)
+    n = len(series)
+    last_close = series.close[-1] if n else None
+    hi, lo = state["hi"], state["lo"]
+    bull_msb = hi is not None and last_close > hi * 1.001
+    bear_msb = lo is not None and last_close < lo * 0.999
+    fvg = state["fvg"]
+    if n >= 3 and n - 1 >= max(2, n - lookback):
+        highs = series.high
+        lows = series.low
+        i = n - 1
+        if highs[i - 2] < lows[i]:
+            fvg = {"type": "bullish", "low": highs[i - 2], "high": lows[i]}
+        if lows[i - 2] > highs[i]:
+            fvg = {"type": "bearish", "low": highs[i], "high": lows[i - 2]}
+    return {
+        "bull_msb": bull_msb,
+        "bull_level": hi,
+        "bear_msb": bear_msb,
+        "bear_level": lo,
+        "fvg": fvg,
+        "fvg_reject": check_fvg_rejection(candles, fvg) if fvg else False,
+    }
+
+
+def stream_structure(inst_id, bar, series, lookback, create=True):
+    """
+    Analiz cache'indeki StreamingStructure'ı ilerletip döner; cache kapalıysa / son bar onaysızsa None.
+    create=False → cache'te kullanılabilir durum yoksa da None.
+    """
+    cache = get_analysis_cache()
+    key = _stream_key("structure", inst_id, bar, series, lookback) if cache is not None else None
+    if key is None:
+        return None
+    highs, lows, closes, ts_col = series.high, series.low, series.close, series.ts
+    n = len(series)
+    return advance_stream(
+        cache,
+        key,
+        series,
+        lambda: StreamingStructure(lookback),
+        lambda st, i: st.push(highs[i], lows[i], closes[i], ts_col[i]),
+        valid=lambda st: st.covers(n),
+        create=create,
+    )
+
+
+def seed_structure(inst_id, bar, series, lookback):
+    """Toplu motorun hesapladığı (cache'te olmayan) seri için akış durumunu kurup cache'e yazar."""
+    cache = get_analysis_cache()
+    key = _stream_key("structure", inst_id, bar, series, lookback) if cache is not None else None
+    if key is None:
+        return
+    state = StreamingStructure(lookback)
+    highs, lows, closes, ts_col = series.high, series.low, series.close, series.ts
+    for i in range(len(series) - 1):
+        state.push(highs[i], lows[i], closes[i], ts_col[i])
+    cache.put(key, state)
+
+
+def cached_structure(inst_id, bar, candles, lookback):
+    """compute_structure + run'lar arası akış durumu (yalnız yeni kapanan barlar işlenir)."""
+    series = as_series(candles)
+    state = stream_structure(inst_id, bar, series, lookback)
+    if state is None:
+        return compute_structure(series, lookback)
+    return structure_from_state(series, lookback, state.closed_state(len(series)))
+
+
+def _window_state(kind, inst_id, bar, series, new, *params):
+    """
+    Pencerenin kapanmış barlarından (son bar hariç) kurulan EmaState / MacdState.
+    Anahtar pencerenin ilk ve son kapanmış ts'ini içerir → ema(pencere) ile aynı tohum;
+    aynı pencere için cache'ten O(1) döner.
+    """
+    closes = series.close
+    cache = get_analysis_cache()
+    key = _stream_key(kind, inst_id, bar, series, *params, series.ts[0], series.ts[-2]) if cache is not None else None
+    state = cache.get(key) if key is not None else None
+    if state is None:
+        state = new()
+        for i in range(len(series) - 1):
+            state.update(closes[i])
+        if key is not None:
+            cache.put(key, state)
+    return state
+
+
+def cached_ema(inst_id, bar, candles, period):
+    """ema(closes, period) ile birebir aynı; pencere durumu analiz cache'inde tutulur."""
+    series = as_series(candles)
+    if get_analysis_cache() is None or len(series) < 2:
+        return ema(series.close, period)
+    return _window_state("ema", inst_id, bar, series, lambda: EmaState(period), period).peek(series.close[-1])
+
+
+def cached_macd(inst_id, bar, candles, fast=12, slow=26, signal=9):
+    """(EMA fast, EMA slow, MACD) — ema() ile birebir aynı; pencere durumu analiz cache'inde tutulur."""
+    series = as_series(candles)
+    closes = series.close
+    if get_analysis_cache() is None or len(series) < 2:
+        f = ema(closes, fast)
+        s = ema(closes, slow)
+        return f, s, (f - s if f is not None and s is not None else None)
+    state = _window_state("macd", inst_id, bar, series, lambda: MacdState(fast, slow, signal), fast, slow, signal)
+    return state.peek(closes[-1])
+
+
+# ========== TOPLU (VEKTÖREL) İNDİKATÖR MOTORU ==========
+#
+# Tüm sembollerin mumları (sembol × bar) 2D NumPy dizilerine sağa hizalı paketlenir
+# (kısa seriler solda NaN ile doldurulur). EMA / MSB / FVG / rejection tüm evren için
+# birkaç vektörel geçişte hesaplanır; sonuçlar skaler fonksiyonlarla birebir aynıdır
+# (aynı float işlemleri aynı sırayla yapılır).
+
+def pack_candles(candle_lists):
+    """
+    Mum serilerini (CandleSeries ya da list-of-dict) sağa hizalı (S, W) dizilere paketler.
+    Dönen: {"open","high","low","close": 2D float64, "lengths": 1D int}
+    """
+    n_sym = len(candle_lists)
+    lengths = np.array([len(c) for c in candle_lists], dtype=np.int64)
+    width = int(lengths.max()) if n_sym else 0
+    series_list = [as_series(c) for c in candle_lists]
+    packed = {"lengths": lengths}
+    for field in ("open", "high", "low", "close"):
+        arr = np.full((n_sym, width), np.nan, dtype=np.float64)
+        for r, series in enumerate(series_list):
+            n = len(series)
+            if n:
+                # memoryview → NumPy görünümü (kopyasız), sadece hedef satıra yazılırken kopyalanır
+                arr[r, width - n:] = np.asarray(getattr(series, field))
+        packed[field] = arr
+    return packed
+
+
+def batch_ema(closes, lengths, period):
+    """
+    ema()'nın vektörel hali: (S, W) sağa hizalı kapanışlar → S uzunluklu EMA dizisi.
+    Seri uzunluğu period'dan kısaysa NaN.
+    """
+    n_sym, width = closes.shape
+    k = 2 / (period + 1)
+    offsets = width - lengths
+    acc = np.zeros(n_sym)
+    ema_val = np.full(n_sym, np.nan)
+    for j in range(width):
+        idx = j - offsets
+        col = closes[:, j]
+        seeding = (idx >= 0) & (idx < period)
+        acc[seeding] = acc[seeding] + col[seeding]
+        seed_now = idx == period - 1
+        ema_val[seed_now] = acc[seed_now] / period
+        upd = idx >= period
+        ema_val[upd] = col[upd] * k + ema_val[upd] * (1 - k)
+    return ema_val
+
+
+def batch_structure(candle_map, lookback):
+    """
+    {inst_id: candles} → {inst_id: compute_structure(candles, lookback) ile aynı dict}.
+    """
+    inst_ids = list(candle_map)
+    if not inst_ids:
+        return {}
+    packed = pack_candles([candle_map[i] for i in inst_ids])
+    lengths = packed["lengths"]
+    op, hi, lo, cl = packed["open"], packed["high"], packed["low"], packed["close"]
+    n_sym, width = cl.shape
+    if width == 0:
+        return {inst_id: compute_structure([], lookback) for inst_id in inst_ids}
+
+    # ---- MSB: son mum hariç son `lookback` kapanışın max/min'i ----
+    msb_ok = lengths >= lookback + 2
+    if width >= lookback + 2 and lookback > 0:
+        window = cl[:, width - lookback - 1:width - 1]
+        window = np.where(msb_ok[:, None], window, 0.0)  # kısa serilerin NaN dolgusu
+        levels_hi = np.where(msb_ok, window.max(axis=1), np.nan)
+        levels_lo = np.where(msb_ok, window.min(axis=1), np.nan)
+    else:
+        msb_ok = np.zeros(n_sym, dtype=bool)
+        levels_hi = np.full(n_sym, np.nan)
+        levels_lo = np.full(n_sym, np.nan)
+    last_close = cl[:, -1]
+    with np.errstate(invalid="ignore"):
+        bull_msb = msb_ok & (last_close > levels_hi * 1.001)
+        bear_msb = msb_ok & (last_close < levels_lo * 0.999)
+
+    # ---- FVG: son `lookback` mum içinde en son görülen gap ----
+    fvg_col = np.full(n_sym, -1, dtype=np.int64)
+    fvg_bear = np.zeros(n_sym, dtype=bool)
+    start = max(2, width - lookback)
+    if width >= 3 and start < width:
+        cols = np.arange(start, width)
+        with np.errstate(invalid="ignore"):
+            bull_gap = hi[:, cols - 2] < lo[:, cols]
+            bear_gap = lo[:, cols - 2] > hi[:, cols]
+        # per-sembol indeks i = col - (W - n) >= 2 ve n >= 3 olmalı (NaN karşılaştırmaları zaten False)
+        any_gap = bull_gap | bear_gap
+        has = any_gap.any(axis=1) & (lengths >= 3)
+        last_rel = any_gap.shape[1] - 1 - np.argmax(any_gap[:, ::-1], axis=1)
+        fvg_col = np.where(has, cols[last_rel], -1)
+        fvg_bear = has & bear_gap[np.arange(n_sym), last_rel]
+
+    rows = np.arange(n_sym)
+    safe_col = np.maximum(fvg_col, 2)
+    z_low = np.where(fvg_bear, hi[rows, safe_col], hi[rows, safe_col - 2])
+    z_high = np.where(fvg_bear, lo[rows, safe_col - 2], lo[rows, safe_col])
+
+    # ---- Rejection: son mum ----
+    l_op, l_hi, l_lo, l_cl = op[:, -1], hi[:, -1], lo[:, -1], cl[:, -1]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        touched = ~((l_hi < z_low) | (l_lo > z_high))
+        body = np.abs(l_cl - l_op)
+        wick = l_hi - l_lo
+        spike = (body > 0) & (wick / np.where(body > 0, body, 1.0) > 4.0)
+        bull_rej = (l_cl > l_op) & (l_cl > (z_low * (1 + ZONE_BUFFER / 2)))
+        bear_rej = (l_cl < l_op) & (l_cl < (z_high * (1 - ZONE_BUFFER / 2)))
+    fvg_reject = (fvg_col >= 0) & touched & ~spike & np.where(fvg_bear, bear_rej, bull_rej)
+
+    out = {}
+    for r, inst_id in enumerate(inst_ids):
+        if fvg_col[r] >= 0:
+            fvg = {
+                "type": "bearish" if fvg_bear[r] else "bullish",
+                "low": float(z_low[r]),
+                "high": float(z_high[r]),
+            }
+        else:
+            fvg = None
+        ok = bool(msb_ok[r])
+        out[inst_id] = {
+            "bull_msb": bool(bull_msb[r]),
+            "bull_level": float(levels_hi[r]) if ok else None,
+            "bear_msb": bool(bear_msb[r]),
+            "bear_level": float(levels_lo[r]) if ok else None,
+            "fvg": fvg,
+            "fvg_reject": bool(fvg_reject[r]),
+        }
+    return out
+
+
 # ========== STOP / TP HESAPLAMA ==========
 
 def compute_levels(side, last_close, candles, msb_level, fvg):
@@ -563,20 +3396,14 @@ def get_trend_summary(inst_id):
     if len(candles_4h) < 50 or len(candles_1h) < 50:
         return None
 
-    closes_4h = [c["close"] for c in candles_4h]
-    closes_1h = [c["close"] for c in candles_1h]
+    closes_4h = candles_4h.close
+    closes_1h = candles_1h.close
     last_4h = closes_4h[-1]
     last_1h = closes_1h[-1]
 
-    ema200_4h = ema(closes_4h, 200) if len(closes_4h) >= 200 else None
-    ema_fast_4h = ema(closes_4h, 12)
-    ema_slow_4h = ema(closes_4h, 26)
-    macd_4h = None
-    if ema_fast_4h is not None and ema_slow_4h is not None:
-        macd_4h = ema_fast_4h - ema_slow_4h
-
-    ema_fast_1h = ema(closes_1h, 12)
-    ema_slow_1h = ema(closes_1h, 26)
+    ema200_4h = cached_ema(inst_id, "4H", candles_4h, 200) if len(closes_4h) >= 200 else None
+    _, _, macd_4h = cached_macd(inst_id, "4H", candles_4h)
+    ema_fast_1h, ema_slow_1h, _ = cached_macd(inst_id, "1H", candles_1h)
 
     # 4H Trend
     if ema200_4h is None:
@@ -612,10 +3439,9 @@ def get_trend_summary(inst_id):
             trend_1h = "Yatay"
 
     # Orderflow & whale bilgisi için son trades
-    trades = get_trades(inst_id)
     base = inst_id.split("-")[0]
     _, seg_label, s_whale, m_whale, x_whale = get_mcap_segment(base)
-    of = analyze_trades_orderflow(trades, s_whale, m_whale, x_whale) if trades else None
+    of = get_orderflow(inst_id, s_whale, m_whale, x_whale)
 
     whale_txt = "Anlamlı BUY whale yok"
     delta_txt = "Net delta: Veri yok"
@@ -666,48 +3492,40 @@ def get_market_bias(btc_info, eth_info):
 
 # ========== 4H KESİN SİNYAL ANALİZİ ==========
 
-def analyze_symbol_4h(inst_id, market_bias):
+def analyze_symbol_4h(inst_id, market_bias, structure=None, now_ms=None):
     """
     Tek coin için 4H KESİN sinyal analizi.
     FVG + MSB yapısı + orderflow + whale + orderbook.
     Sadece son 4H mumunun yaşı 90 dakikadan küçükse sinyal üretir (kapanış sonrası).
+    structure: aynı mumlar için önceden hesaplanmış compute_structure/batch_structure çıktısı.
+    now_ms: değerlendirme zamanı (canlı mod / replay); None → şimdiki zaman.
     """
-    now_ms = int(datetime.now(timezone.utc).timestamp() * 1000)
+    if now_ms is None:
+        now_ms = int(datetime.now(timezone.utc).timestamp() * 1000)
 
+    pipeline_count("4h", "symbols")
     candles = get_candles(inst_id, bar="4H", limit=CANDLE_LIMIT_4H)
     if len(candles) < STRUCT_LOOKBACK_4H + 3:
+        pipeline_count("4h", "no_candles")
         return []
 
     last_candle = candles[-1]
     age_ms = now_ms - last_candle["ts"]
     if age_ms > MAX_4H_AGE_MS:
         # Son 4H mumu 1.5 saatten daha eski → yeni kapanış değil → sinyal üretme
+        pipeline_count("4h", "stale")
         return []
 
-    base = inst_id.split("-")[0]
-    _, seg_label, s_whale, m_whale, x_whale = get_mcap_segment(base)
-
-    trades = get_trades(inst_id)
-    if not trades:
-        return []
-
-    of = analyze_trades_orderflow(trades, s_whale, m_whale, x_whale)
-    book = get_orderbook(inst_id)
-    if not book:
-        return []
-
-    bid_n = book["bid_notional"]
-    ask_n = book["ask_notional"]
-
-    # Yapı: MSB + FVG
-    bullish_msb, bull_level = detect_bullish_msb(candles, STRUCT_LOOKBACK_4H)
-    bearish_msb, bear_level = detect_bearish_msb(candles, STRUCT_LOOKBACK_4H)
-    fvg = find_recent_fvg(candles, STRUCT_LOOKBACK_4H)
+    # Yapı: MSB + FVG (sadece mumlarla, ek istek yok; toplu motordan hazır gelebilir)
+    st = structure if structure is not None else cached_structure(inst_id, "4H", candles, STRUCT_LOOKBACK_4H)
+    bullish_msb, bull_level = st["bull_msb"], st["bull_level"]
+    bearish_msb, bear_level = st["bear_msb"], st["bear_level"]
+    fvg = st["fvg"]
 
     bullish_fvg_reject = False
     bearish_fvg_reject = False
     if fvg:
-        rej = check_fvg_rejection(candles, fvg)
+        rej = st["fvg_reject"]
         if rej and fvg["type"] == "bullish":
             bullish_fvg_reject = True
         if rej and fvg["type"] == "bearish":
@@ -716,20 +3534,62 @@ def analyze_symbol_4h(inst_id, market_bias):
     structure_long = bullish_msb or bullish_fvg_reject
     structure_short = bearish_msb or bearish_fvg_reject
 
+    want_long = structure_long and market_bias != "bear"
+    want_short = structure_short and market_bias != "bull"
+    if not (want_long or want_short):
+        # Yapı yok (ya da bias'a ters) → hiçbir yön ateşlenemez, trades/orderbook çekme
+        pipeline_count("4h", "no_structure")
+        return []
+
+    base = inst_id.split("-")[0]
+    _, seg_label, s_whale, m_whale, x_whale = get_mcap_segment(base)
+
+    of = get_orderflow(inst_id, s_whale, m_whale, x_whale)
+    if of is None:
+        pipeline_count("4h", "no_trades")
+        return []
+
+    # Türev koşulları run başında toplu çekilen bağlamdan okunur (sembol başına istek yok)
+    deriv = get_derivatives(inst_id) if DERIV_ENRICH else None
+    deriv_long = derivative_conditions("LONG", deriv)
+    deriv_short = derivative_conditions("SHORT", deriv)
+
+    # Orderbook koşulu sağlansa bile eşiğe ulaşamayan yön için orderbook gereksiz
+    flow_long = [True, of["net_delta"] >= NET_DELTA_MIN_POS, of["has_buy_whale"], of["buy_ratio"] > FLOW_RATIO_MIN]
+    flow_short = [True, of["net_delta"] <= NET_DELTA_MIN_NEG, of["has_sell_whale"], of["sell_ratio"] > FLOW_RATIO_MIN]
+    flow_long += deriv_long
+    flow_short += deriv_short
+    need_long = MIN_CONDITIONS_STRICT + (DERIV_EXTRA_REQUIRED if deriv_long else 0)
+    need_short = MIN_CONDITIONS_STRICT + (DERIV_EXTRA_REQUIRED if deriv_short else 0)
+    want_long = want_long and sum(flow_long) + 1 >= need_long
+    want_short = want_short and sum(flow_short) + 1 >= need_short
+    if not (want_long or want_short):
+        pipeline_count("4h", "weak_flow")
+        return []
+
+    book = get_orderbook(inst_id)
+    if not book:
+        pipeline_count("4h", "no_book")
+        return []
+    pipeline_count("4h", "evaluated")
+
+    bid_n = book["bid_notional"]
+    ask_n = book["ask_notional"]
+
     signals = []
 
     # ---------- LONG 4H ----------
-    if structure_long and market_bias != "bear":
+    if want_long:
         cond_struct = True
         cond_delta = of["net_delta"] >= NET_DELTA_MIN_POS
         cond_ob = bid_n > ask_n * ORDERBOOK_IMB_RATIO
         cond_whale = of["has_buy_whale"]
-        cond_flow = of["buy_ratio"] > 0.55  # son 20 trade daha çok buy
+        cond_flow = of["buy_ratio"] > FLOW_RATIO_MIN  # son 20 trade (pencere modunda tüm pencere) daha çok buy
 
-        conds = [cond_struct, cond_delta, cond_ob, cond_whale, cond_flow]
+        conds = [cond_struct, cond_delta, cond_ob, cond_whale, cond_flow] + deriv_long
         true_count = sum(conds)
 
-        if true_count >= MIN_CONDITIONS_STRICT:
+        if true_count >= need_long:
             confidence = int((true_count / len(conds)) * 100)
             stop, tp1, tp2, tp3 = compute_levels(
                 "LONG", last_candle["close"], candles, bull_level, fvg if bullish_fvg_reject else None
@@ -738,6 +3598,7 @@ def analyze_symbol_4h(inst_id, market_bias):
                 "inst_id": inst_id,
                 "side": "LONG",
                 "last_close": last_candle["close"],
+                "candle_ts": last_candle["ts"],
                 "orderflow": of,
                 "orderbook": book,
                 "confidence": confidence,
@@ -746,6 +3607,7 @@ def analyze_symbol_4h(inst_id, market_bias):
                     "bull_level": bull_level,
                     "bull_fvg_reject": bullish_fvg_reject,
                 },
+                "derivatives": deriv if deriv_long else None,
                 "segment_label": seg_label,
                 "stop": stop,
                 "tp1": tp1,
@@ -755,17 +3617,17 @@ def analyze_symbol_4h(inst_id, market_bias):
             signals.append(signal)
 
     # ---------- SHORT 4H ----------
-    if structure_short and market_bias != "bull":
+    if want_short:
         cond_struct_s = True
         cond_delta_s = of["net_delta"] <= NET_DELTA_MIN_NEG
         cond_ob_s = ask_n > bid_n * ORDERBOOK_IMB_RATIO
         cond_whale_s = of["has_sell_whale"]
-        cond_flow_s = of["sell_ratio"] > 0.55
+        cond_flow_s = of["sell_ratio"] > FLOW_RATIO_MIN
 
-        conds_s = [cond_struct_s, cond_delta_s, cond_ob_s, cond_whale_s, cond_flow_s]
+        conds_s = [cond_struct_s, cond_delta_s, cond_ob_s, cond_whale_s, cond_flow_s] + deriv_short
         true_count_s = sum(conds_s)
 
-        if true_count_s >= MIN_CONDITIONS_STRICT:
+        if true_count_s >= need_short:
             confidence_s = int((true_count_s / len(conds_s)) * 100)
             stop, tp1, tp2, tp3 = compute_levels(
                 "SHORT", last_candle["close"], candles, bear_level, fvg if bearish_fvg_reject else None
@@ -774,6 +3636,7 @@ def analyze_symbol_4h(inst_id, market_bias):
                 "inst_id": inst_id,
                 "side": "SHORT",
                 "last_close": last_candle["close"],
+                "candle_ts": last_candle["ts"],
                 "orderflow": of,
                 "orderbook": book,
                 "confidence": confidence_s,
@@ -782,6 +3645,7 @@ def analyze_symbol_4h(inst_id, market_bias):
                     "bear_level": bear_level,
                     "bear_fvg_reject": bearish_fvg_reject,
                 },
+                "derivatives": deriv if deriv_short else None,
                 "segment_label": seg_label,
                 "stop": stop,
                 "tp1": tp1,
@@ -795,41 +3659,31 @@ def analyze_symbol_4h(inst_id, market_bias):
 
 # ========== 1H PRE-SIGNAL ANALİZİ ==========
 
-def analyze_symbol_1h_presignal(inst_id, market_bias):
+def analyze_symbol_1h_presignal(inst_id, market_bias, structure=None):
     """
     1H ön-uyarı sinyali.
     Daha gevşek koşullar: yapı + delta veya whale veya orderflow.
     İşlem önerisi değil, "hazırlan" mesajı.
+    structure: aynı mumlar için önceden hesaplanmış compute_structure/batch_structure çıktısı.
     """
-    candles_1h = get_candles(inst_id, bar="1H", limit=80)
+    pipeline_count("1h", "symbols")
+    candles_1h = get_candles(inst_id, bar="1H", limit=CANDLE_LIMIT_1H_PRE)
     if len(candles_1h) < 30:
+        pipeline_count("1h", "no_candles")
         return []
 
-    base = inst_id.split("-")[0]
-    _, seg_label, s_whale, m_whale, x_whale = get_mcap_segment(base)
-
-    trades = get_trades(inst_id)
-    if not trades:
-        return []
-
-    of = analyze_trades_orderflow(trades, s_whale, m_whale, x_whale)
-    book = get_orderbook(inst_id)
-    if not book:
-        return []
-
-    bid_n = book["bid_notional"]
-    ask_n = book["ask_notional"]
     last = candles_1h[-1]
 
     # 1H yapısı için daha kısa lookback
-    bullish_msb_1h, bull_level_1h = detect_bullish_msb(candles_1h, lookback=15)
-    bearish_msb_1h, bear_level_1h = detect_bearish_msb(candles_1h, lookback=15)
-    fvg_1h = find_recent_fvg(candles_1h, lookback=15)
+    st = structure if structure is not None else cached_structure(inst_id, "1H", candles_1h, STRUCT_LOOKBACK_1H)
+    bullish_msb_1h = st["bull_msb"]
+    bearish_msb_1h = st["bear_msb"]
+    fvg_1h = st["fvg"]
 
     bull_reject_1h = False
     bear_reject_1h = False
     if fvg_1h:
-        rej = check_fvg_rejection(candles_1h, fvg_1h)
+        rej = st["fvg_reject"]
         if rej and fvg_1h["type"] == "bullish":
             bull_reject_1h = True
         if rej and fvg_1h["type"] == "bearish":
@@ -838,14 +3692,46 @@ def analyze_symbol_1h_presignal(inst_id, market_bias):
     structure_long_1h = bullish_msb_1h or bull_reject_1h
     structure_short_1h = bearish_msb_1h or bear_reject_1h
 
+    want_long = structure_long_1h and market_bias != "bear"
+    want_short = structure_short_1h and market_bias != "bull"
+    if not (want_long or want_short):
+        pipeline_count("1h", "no_structure")
+        return []
+
+    base = inst_id.split("-")[0]
+    _, seg_label, s_whale, m_whale, x_whale = get_mcap_segment(base)
+
+    of = get_orderflow(inst_id, s_whale, m_whale, x_whale)
+    if of is None:
+        pipeline_count("1h", "no_trades")
+        return []
+
+    # Orderbook koşulu sağlansa bile 3 koşula ulaşamayan yön için orderbook gereksiz
+    flow_long = [True, of["net_delta"] > 0, of["has_buy_whale"], of["buy_ratio"] > FLOW_RATIO_MIN]
+    flow_short = [True, of["net_delta"] < 0, of["has_sell_whale"], of["sell_ratio"] > FLOW_RATIO_MIN]
+    want_long = want_long and sum(flow_long) + 1 >= 3
+    want_short = want_short and sum(flow_short) + 1 >= 3
+    if not (want_long or want_short):
+        pipeline_count("1h", "weak_flow")
+        return []
+
+    book = get_orderbook(inst_id)
+    if not book:
+        pipeline_count("1h", "no_book")
+        return []
+    pipeline_count("1h", "evaluated")
+
+    bid_n = book["bid_notional"]
+    ask_n = book["ask_notional"]
+
     presignals = []
 
     # LONG pre-signal
-    if structure_long_1h and market_bias != "bear":
+    if want_long:
         cond_struct = True
         cond_delta = of["net_delta"] > 0
         cond_whale = of["has_buy_whale"]
-        cond_flow = of["buy_ratio"] > 0.55
+        cond_flow = of["buy_ratio"] > FLOW_RATIO_MIN
         cond_ob = bid_n > ask_n  # çok agresif olmasın, oran istemiyoruz
 
         conds = [cond_struct, cond_delta, cond_whale, cond_flow, cond_ob]
@@ -869,11 +3755,11 @@ def analyze_symbol_1h_presignal(inst_id, market_bias):
             )
 
     # SHORT pre-signal
-    if structure_short_1h and market_bias != "bull":
+    if want_short:
         cond_struct_s = True
         cond_delta_s = of["net_delta"] < 0
         cond_whale_s = of["has_sell_whale"]
-        cond_flow_s = of["sell_ratio"] > 0.55
+        cond_flow_s = of["sell_ratio"] > FLOW_RATIO_MIN
         cond_ob_s = ask_n > bid_n
 
         conds_s = [cond_struct_s, cond_delta_s, cond_whale_s, cond_flow_s, cond_ob_s]
@@ -899,9 +3785,765 @@ def analyze_symbol_1h_presignal(inst_id, market_bias):
     return presignals
 
 
+# ========== TARAMA MOTORU ==========
+
+# Aşamalı pipeline sayaçları: {"4h": {"symbols": .., "stale": .., ...}, "1h": {...}}
+PIPELINE_STATS = {}
+_PIPELINE_LOCK = threading.Lock()
+
+# Aşama sırası (ucuzdan pahalıya): mumlar → tazelik/yapı → trades → orderbook
+PIPELINE_STAGES = ("no_candles", "stale", "no_structure", "no_trades", "weak_flow", "no_book", "evaluated")
+
+
+def pipeline_count(tf, stage):
+    with _PIPELINE_LOCK:
+        tf_stats = PIPELINE_STATS.setdefault(tf, {})
+        tf_stats[stage] = tf_stats.get(stage, 0) + 1
+
+
+def pipeline_summary():
+    """Her zaman dilimi için aşama başına kaç sembolün elendiğini özetler."""
+    lines = []
+    with _PIPELINE_LOCK:
+        for tf in sorted(PIPELINE_STATS):
+            st = PIPELINE_STATS[tf]
+            parts = [f"{stage}={st[stage]}" for stage in PIPELINE_STAGES if st.get(stage)]
+            lines.append(f"Pipeline {tf.upper()}: {st.get('symbols', 0)} sembol → " + ", ".join(parts))
+    return lines
+
+
+def precompute_structures(symbols, workers=SCAN_WORKERS, deadline=None):
+    """
+    Toplu motor: tüm sembollerin 4H / 1H mumlarını run snapshot'ı üzerinden (eşzamanlı)
+    çekip MSB/FVG yapısını tek vektörel geçişte hesaplar. Analizörler aynı mumları
+    snapshot'tan tekrar okuduğu için ek istek oluşmaz.
+    deadline (time.monotonic) geçtiyse kalan semboller yüklenmez (tarama zaten atlayacak).
+    Analiz cache'i açıksa önce sembolün akış durumuna bakılır (yalnız yeni kapanan barlar işlenir);
+    toplu motor yalnız cache'te olmayan serileri hesaplar ve onların durumunu cache'e yazar.
+    NumPy yoksa, motor kapalıysa ya da snapshot yoksa None (analizörler skaler hesaplar).
+    """
+    if np is None or not USE_BATCH_ENGINE or SNAPSHOT is None or not symbols:
+        return None
+
+    def load(inst_id):
+        if deadline is not None and time.monotonic() >= deadline:
+            return None
+        return (
+            get_candles(inst_id, bar="4H", limit=CANDLE_LIMIT_4H),
+            get_candles(inst_id, bar="1H", limit=CANDLE_LIMIT_1H_PRE),
+        )
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        loaded = list(pool.map(load, symbols))
+
+    out = {}
+    for tf, bar, lookback, k in (("4h", "4H", STRUCT_LOOKBACK_4H, 0), ("1h", "1H", STRUCT_LOOKBACK_1H, 1)):
+        result = {}
+        misses = {}
+        for inst_id, pair in zip(symbols, loaded):
+            if pair is None:
+                continue
+            series = as_series(pair[k])
+            state = stream_structure(inst_id, bar, series, lookback, create=False)
+            if state is not None:
+                result[inst_id] = structure_from_state(series, lookback, state.closed_state(len(series)))
+            else:
+                misses[inst_id] = series
+        result.update(batch_structure(misses, lookback))
+        for inst_id, series in misses.items():
+            seed_structure(inst_id, bar, series, lookback)
+        out[tf] = {inst_id: result[inst_id] for inst_id in symbols if inst_id in result}
+    return out
+
+
+def analyze_symbol(inst_id, market_bias, structures=None):
+    """
+    Tek sembol için 1H pre-signal + 4H kesin sinyal analizi.
+    structures: precompute_structures çıktısı (opsiyonel).
+    Hata davranışı eski sıralı döngüyle aynı: 1H hata verirse sembol atlanır,
+    4H hata verirse önceden hesaplanan 1H pre-signal'leri korunur.
+    Dönen: (pre_signals, signals_4h)
+    """
+    st_1h = structures["1h"].get(inst_id) if structures else None
+    st_4h = structures["4h"].get(inst_id) if structures else None
+    try:
+        with span("analyze.1h"):
+            pres = analyze_symbol_1h_presignal(inst_id, market_bias, structure=st_1h)
+    except Exception as e:
+        print(f"  {inst_id} analiz hatası:", e)
+        return [], []
+    try:
+        with span("analyze.4h"):
+            sigs4 = analyze_symbol_4h(inst_id, market_bias, structure=st_4h)
+    except Exception as e:
+        print(f"  {inst_id} analiz hatası:", e)
+        sigs4 = None
+    return pres or [], sigs4 or []
+
+
+def scan_priority(symbols, structures=None, now_ms=None):
+    """
+    Beklenen değere göre tarama sırası (symbols indeksleri):
+    1) son 4H mumu taze (MAX_4H_AGE_MS içinde açılmış → kesin sinyal adayı)
+    2) yapı kırılımı olanlar (4H / 1H MSB ya da FVG retest; toplu motor çıktısından)
+    3) listenin kendi sırası (24h hacim)
+    Mumu henüz snapshot'ta olmayan sembol taze sayılmaz.
+    """
+    if now_ms is None:
+        now_ms = int(datetime.now(timezone.utc).timestamp() * 1000)
+    snap = SNAPSHOT
+    keyed = []
+    for idx, inst_id in enumerate(symbols):
+        fresh = False
+        if snap is not None:
+            found, c4 = snap.lookup_covering(("candles", inst_id, "4H"), 1, count=False)
+            if found and c4 is not None and len(c4):
+                fresh = now_ms - c4.ts[-1] <= MAX_4H_AGE_MS
+        breaks = 0
+        if structures:
+            for tf in ("4h", "1h"):
+                st = structures[tf].get(inst_id)
+                if st and (st["bull_msb"] or st["bear_msb"] or st["fvg_reject"]):
+                    breaks += 1
+        keyed.append((not fresh, -breaks, idx))
+    keyed.sort()
+    return [idx for _, _, idx in keyed]
+
+
+def _timed_analyze(inst_id, market_bias, structures=None, deadline=None):
+    if deadline is not None and time.monotonic() >= deadline:
+        # Süre bütçesi doldu → başlatma (sonuç None = atlandı)
+        return None
+    t0 = time.perf_counter()
+    pres, sigs4 = analyze_symbol(inst_id, market_bias, structures)
+    return pres, sigs4, time.perf_counter() - t0
+
+
+def scan_symbols(symbols, market_bias, workers=SCAN_WORKERS, structures=None, deadline=None, emit=None):
+    """
+    Sembol listesini tarar.
+    - workers <= 1 → sıralı tarama (eski davranış)
+    - workers > 1  → en fazla `workers` sembol aynı anda analiz edilir (thread havuzu),
+      OKX istekleri TRANSPORT'un uç başına token bucket'larıyla sınırlanır.
+    Semboller scan_priority sırasıyla başlatılır; deadline (time.monotonic) geçtikten sonra
+    sıradaki semboller başlatılmaz (devam edenler tamamlanır) ve stats["skipped"]'e yazılır.
+    Sonuçlar her iki modda da sembol sırasına göre birleştirilir, yani
+    pre_signals / signals_4h sıralı tarama ile birebir aynıdır.
+    structures: precompute_structures çıktısı (toplu motor), None → skaler yapı hesabı.
+    emit(pre_signals, signals_4h): her sembol biter bitmez (tamamlanma sırasıyla) çağrılır (SignalStream.put).
+    Dönen: (pre_signals, signals_4h, stats)
+    """
+    n = len(symbols)
+    results = [None] * n
+    order = scan_priority(symbols, structures)
+    t_start = time.perf_counter()
+
+    if workers <= 1:
+        for i, idx in enumerate(order, start=1):
+            print(f"[{i}/{n}] {symbols[idx]} analiz ediliyor...")
+            results[idx] = _timed_analyze(symbols[idx], market_bias, structures, deadline)
+            if emit is not None and results[idx] is not None:
+                emit(results[idx][0], results[idx][1])
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            # Havuz kuyruğu FIFO → öncelik sırasıyla gönderilen iş o sırayla başlar
+            futures = {
+                pool.submit(_timed_analyze, symbols[idx], market_bias, structures, deadline): idx
+                for idx in order
+            }
+            done = 0
+            for fut in as_completed(futures):
+                idx = futures[fut]
+                results[idx] = fut.result()
+                done += 1
+                if results[idx] is not None:
+                    print(f"[{done}/{n}] {symbols[idx]} analiz edildi")
+                    if emit is not None:
+                        emit(results[idx][0], results[idx][1])
+
+    wall = time.perf_counter() - t_start
+
+    pre_signals = []
+    signals_4h = []
+    busy = 0.0
+    for res in results:
+        if res is None:
+            continue
+        pres, sigs4, elapsed = res
+        pre_signals.extend(pres)
+        signals_4h.extend(sigs4)
+        busy += elapsed
+    skipped = [symbols[idx] for idx in order if results[idx] is None]
+    if skipped:
+        print(f"⏱ Süre bütçesi doldu: {len(skipped)} sembol atlandı")
+
+    stats = {
+        "symbols": n,
+        "workers": max(1, workers),
+        "wall_s": wall,
+        # Sembol başına sürelerin toplamı ≈ aynı taramanın sıralı süresi. Ölçüm değil tahmin:
+        # eşzamanlı modda token bucket beklemeleri de sembol süresine girer (sıralıda çoğu olmazdı)
+        "sequential_est_s": busy,
+        "speedup_est": (busy / wall) if wall > 0 else 1.0,
+        "skipped": skipped,
+    }
+    return pre_signals, signals_4h, stats
+
+
+def scan_in_chunks(symbols, market_bias, chunk=STREAM_SCAN_CHUNK, workers=SCAN_WORKERS, deadline=None, emit=None):
+    """
+    Akışlı teslim için bariyersiz tarama: semboller liste sırasıyla (24h hacim önceliği) `chunk`'lık dilimlere bölünür,
+    her dilim için toplu ön-hesap + scan_symbols çalışır ve dilimin sinyalleri emit ile hemen çıkar.
+    Sonraki dilimin mumları, mevcut dilim analiz edilirken arka planda indirilir.
+    Dilimler sembol sırasıyla birleştiği için sonuç tek seferlik ön-hesap + taramayla birebir aynıdır
+    (yalnız scan_priority sırası dilim içinde uygulanır).
+    Dönen: (pre_signals, signals_4h, stats) — scan_symbols'unkiyle aynı anahtarlar + precompute_s.
+    """
+    parts = [symbols[i:i + chunk] for i in range(0, len(symbols), max(1, chunk))]
+    pre_signals = []
+    signals_4h = []
+    skipped = []
+    busy = 0.0
+    precompute_s = 0.0
+    t_start = time.perf_counter()
+
+    def precompute(part):
+        t0 = time.perf_counter()
+        struct_deadline = None
+        if deadline is not None:
+            struct_deadline = time.monotonic() + max(0.0, deadline - time.monotonic()) * SCAN_PRECOMPUTE_SHARE
+        with span("stage.structures"):
+            structures = precompute_structures(part, workers=workers, deadline=struct_deadline)
+        return structures, time.perf_counter() - t0
+
+    with ThreadPoolExecutor(max_workers=1) as prefetch:
+        pending = prefetch.submit(precompute, parts[0]) if parts else None
+        for k, part in enumerate(parts):
+            structures, elapsed = pending.result()
+            precompute_s += elapsed
+            pending = prefetch.submit(precompute, parts[k + 1]) if k + 1 < len(parts) else None
+            pres, sigs4, stats = scan_symbols(
+                part, market_bias, workers=workers, structures=structures, deadline=deadline, emit=emit
+            )
+            pre_signals.extend(pres)
+            signals_4h.extend(sigs4)
+            skipped.extend(stats["skipped"])
+            busy += stats["sequential_est_s"]
+
+    wall = time.perf_counter() - t_start
+    stats = {
+        "symbols": len(symbols),
+        "workers": max(1, workers),
+        "wall_s": wall,
+        "precompute_s": precompute_s,
+        "sequential_est_s": busy,
+        "speedup_est": (busy / wall) if wall > 0 else 1.0,
+        "skipped": skipped,
+        "chunks": len(parts),
+    }
+    return pre_signals, signals_4h, stats
+
+
+# ========== PARÇALI TARAMA ==========
+
+# Koordinatörden worker süreçlerine aktarılan ayarlar. Worker'lar "spawn" ile temiz başlar
+# (modül yeniden import edilir) → env dışı runtime değişiklikleri buradan taşınır.
+SHARD_INHERIT = (
+    "OKX_BASE", "CANDLE_DB_PATH", "MCAP_CACHE", "DERIV_ENRICH", "RESAMPLE_FROM_1H",
+    "ORDERFLOW_WINDOW", "SCAN_WORKERS", "USE_BATCH_ENGINE", "RATE_LIMITS", "STREAM_SCAN_CHUNK",
+) + tuple(SWEEP_GRID)
+
+
+def shard_symbols(symbols, shards):
+    """
+    Sembolleri `shards` parçaya liste sırasıyla (24h hacim) round-robin dağıtır → her parça
+    yüksek ve düşük hacimli sembollerden benzer pay alır. Tazelik / yapı önceliği koordinatörde
+    bilinmez (mumlar henüz çekilmedi); her worker kendi parçasını ön-hesaptan sonra
+    scan_priority ile sıralar.
+    """
+    out = [[] for _ in range(max(1, shards))]
+    for k, inst_id in enumerate(symbols):
+        out[k % len(out)].append(inst_id)
+    return [part for part in out if part]
+
+
+def worker_telemetry():
+    """Worker sürecinin run sayaçları (pipeline, span/HTTP örnekleri, uç sayaçları, snapshot, mum deposu)."""
+    with _PIPELINE_LOCK:
+        pipeline = {tf: dict(st) for tf, st in PIPELINE_STATS.items()}
+    store = CANDLE_STORE
+    return {
+        "pipeline": pipeline,
+        "metrics": METRICS.export(),
+        "http": TRANSPORT.stats(),
+        "snapshot": (
+            {"hits": SNAPSHOT.hits, "misses": SNAPSHOT.misses, "coalesced": SNAPSHOT.coalesced}
+            if SNAPSHOT is not None else {}
+        ),
+        "candle_store": (
+            {"requests": store.requests, "bars_downloaded": store.bars_downloaded, "bars_served": store.bars_served}
+            if store is not None else {}
+        ),
+    }
+
+
+def merge_telemetry(telemetry):
+    """worker_telemetry çıktısını koordinatörün sayaçlarına ekler (run raporu tek süreçteki gibi dolar)."""
+    with _PIPELINE_LOCK:
+        for tf, st in telemetry["pipeline"].items():
+            tf_stats = PIPELINE_STATS.setdefault(tf, {})
+            for stage, count in st.items():
+                tf_stats[stage] = tf_stats.get(stage, 0) + count
+    METRICS.merge(telemetry["metrics"])
+    TRANSPORT.merge_stats(telemetry["http"])
+    snap = SNAPSHOT
+    if snap is not None and telemetry["snapshot"]:
+        with snap._lock:
+            snap.hits += telemetry["snapshot"]["hits"]
+            snap.misses += telemetry["snapshot"]["misses"]
+            snap.coalesced += telemetry["snapshot"]["coalesced"]
+    store = get_candle_store()
+    if store is not None and telemetry["candle_store"]:
+        with store._lock:
+            store.requests += telemetry["candle_store"]["requests"]
+            store.bars_downloaded += telemetry["candle_store"]["bars_downloaded"]
+            store.bars_served += telemetry["candle_store"]["bars_served"]
+
+
+def _shard_worker(tasks, results, config, rate_share, market_bias, deadline_at, seed, stream=False):
+    """
+    Worker süreci: kuyruktan (parça no, semboller) çeker, kendi snapshot'ı / transport'u ile
+    ön-hesap + scan_symbols çalıştırır. Sembol sonuçları ("emit", ...) ile anında,
+    parça özeti ve sayaçları ("done", ...) ile gönderilir. None → çık.
+    deadline_at: duvar saati (time.time) — süreçler arası ortak süre bütçesi.
+    stream: koordinatör akışlı teslim yapıyor → parça scan_in_chunks ile taranır.
+    """
+    global SNAPSHOT, TRANSPORT, CANDLE_STORE, ANALYSIS_CACHE, ANALYSIS_CACHE_PATH, HTTP_RECORD_PATH
+    globals().update(config)
+    # Per-IP limit tüm süreçlerce paylaşılır → her worker bucket kapasitesinin payı kadarını kullanır
+    for key, (cap, period) in list(RATE_LIMITS.items()):
+        RATE_LIMITS[key] = (max(1, int(cap * rate_share)), period)
+    TRANSPORT = HttpTransport()
+    CANDLE_STORE = None
+    # JSON analiz cache'i ve HTTP kaydı tek yazarlı → worker'larda kapalı
+    ANALYSIS_CACHE = None
+    ANALYSIS_CACHE_PATH = ""
+    HTTP_RECORD_PATH = ""
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        shard, inst_ids = task
+        # Sayaçlar parça başına gönderilir → her parçada sıfırdan
+        METRICS.reset()
+        PIPELINE_STATS.clear()
+        TRANSPORT.reset_stats()
+        store = get_candle_store()
+        if store is not None:
+            store.requests = store.bars_downloaded = store.bars_served = 0
+        t0 = time.perf_counter()
+        try:
+            SNAPSHOT = MarketSnapshot()
+            for key, value in seed.items():
+                SNAPSHOT.put(key, value)
+            deadline = None
+            struct_deadline = None
+            if deadline_at is not None:
+                remaining = max(0.0, deadline_at - time.time())
+                deadline = time.monotonic() + remaining
+                struct_deadline = time.monotonic() + remaining * SCAN_PRECOMPUTE_SHARE
+            emit = lambda p, s: results.put(("emit", shard, p, s))  # noqa: E731
+            if stream and STREAM_SCAN_CHUNK > 0:
+                # Akışlı: parça da dilimlerle ön-hesaplanır, ilk sinyaller tüm mumları beklemez
+                pres, sigs4, stats = scan_in_chunks(inst_ids, market_bias, deadline=deadline, emit=emit)
+                precompute_s = stats["precompute_s"]
+            else:
+                structures = precompute_structures(inst_ids, deadline=struct_deadline)
+                precompute_s = time.perf_counter() - t0
+                pres, sigs4, stats = scan_symbols(
+                    inst_ids, market_bias, workers=SCAN_WORKERS, structures=structures, deadline=deadline, emit=emit
+                )
+            timing = {
+                "precompute_s": precompute_s,
+                "scan_s": stats["wall_s"],
+                "sequential_est_s": stats["sequential_est_s"],
+                "skipped": stats["skipped"],
+                "error": None,
+            }
+        except Exception as e:
+            print(f"  Parça {shard} hatası:", e)
+            pres, sigs4 = [], []
+            timing = {"precompute_s": 0.0, "scan_s": 0.0, "sequential_est_s": 0.0,
+                      "skipped": list(inst_ids), "error": str(e)}
+        telemetry = worker_telemetry()
+        timing.update(
+            shard=shard,
+            pid=os.getpid(),
+            symbols=len(inst_ids),
+            wall_s=time.perf_counter() - t0,
+            requests=sum(st["requests"] for st in telemetry["http"].values()),
+        )
+        results.put(("done", shard, pres, sigs4, timing, telemetry))
+
+
+def scan_sharded(symbols, market_bias, shards=SCAN_SHARDS, processes=SCAN_PROCESSES, deadline=None, emit=None, seed=None):
+    """
+    Parçalı tarama (koordinatör):
+    - semboller shard_symbols ile `shards` parçaya bölünüp yerel iş kuyruğuna konur
+    - `processes` worker süreci ("spawn": koordinatörün thread'lerinden kilit devralmaz) kuyruktan
+      parça çekip mevcut analizörlerle tarar (hızlı biten süreç sıradaki parçayı alır);
+      OKX hız sınırı süreçlere eşit paylaştırılır
+    - pre_signals / signals_4h sembol sırasına göre birleştirilir → scan_symbols ile birebir aynı
+    - worker'ların pipeline / span / HTTP / snapshot / mum deposu sayaçları koordinatöre eklenir
+    deadline (time.monotonic) worker'lara duvar saati olarak aktarılır.
+    seed: worker snapshot'larına önceden konacak anahtarlar (örn. türev bağlamı; tekrar çekilmez).
+    emit(pre_signals, signals_4h): sembol sonuçları worker'lardan geldikçe koordinatörde çağrılır.
+    Dönen: (pre_signals, signals_4h, stats) — stats["shards"]: parça başına süre / istek / pid.
+    """
+    n = len(symbols)
+    parts = shard_symbols(symbols, shards)
+    procs = max(1, min(len(parts), processes or os.cpu_count() or 1))
+    config = {name: globals()[name] for name in SHARD_INHERIT}
+    deadline_at = time.time() + max(0.0, deadline - time.monotonic()) if deadline is not None else None
+    t_start = time.perf_counter()
+
+    ctx = multiprocessing.get_context("spawn")
+    tasks = ctx.Queue()
+    results = ctx.Queue()
+    for shard, inst_ids in enumerate(parts):
+        tasks.put((shard, inst_ids))
+    for _ in range(procs):
+        tasks.put(None)
+    workers = [
+        ctx.Process(
+            target=_shard_worker,
+            args=(tasks, results, config, 1.0 / procs, market_bias, deadline_at, seed or {}, emit is not None),
+            daemon=True,
+        )
+        for _ in range(procs)
+    ]
+    for w in workers:
+        w.start()
+
+    done = {}
+    while len(done) < len(parts):
+        try:
+            msg = results.get(timeout=SHARD_POLL_S)
+        except queue.Empty:
+            if not any(w.is_alive() for w in workers) and results.empty():
+                # Tüm worker'lar öldü → bitmeyen parçalar atlanmış sayılır
+                break
+            continue
+        if msg[0] == "emit":
+            if emit is not None:
+                emit(msg[2], msg[3])
+            continue
+        _, shard, pres, sigs4, timing, telemetry = msg
+        merge_telemetry(telemetry)
+        done[shard] = (pres, sigs4, timing)
+        print(
+            f"Parça {shard + 1}/{len(parts)}: {timing['symbols']} sembol, {timing['wall_s']:.1f} sn "
+            f"(pid {timing['pid']}, {timing['requests']} istek)"
+        )
+    for w in workers:
+        w.join(SHARD_POLL_S)
+        if w.is_alive():
+            w.terminate()
+    wall = time.perf_counter() - t_start
+
+    for shard, inst_ids in enumerate(parts):
+        if shard not in done:
+            done[shard] = ([], [], {"shard": shard, "pid": None, "symbols": len(inst_ids), "wall_s": 0.0,
+                                    "precompute_s": 0.0, "scan_s": 0.0, "sequential_est_s": 0.0, "requests": 0,
+                                    "skipped": list(inst_ids), "error": "worker öldü"})
+
+    # Deterministik birleştirme: sembolün listedeki yerine göre (aynı sembolün sinyalleri kendi sırasında)
+    pos = {inst_id: i for i, inst_id in enumerate(symbols)}
+    pre_signals = sorted((s for pres, _, _ in done.values() for s in pres), key=lambda s: pos[s["inst_id"]])
+    signals_4h = sorted((s for _, sigs4, _ in done.values() for s in sigs4), key=lambda s: pos[s["inst_id"]])
+    timings = [done[shard][2] for shard in range(len(parts))]
+    skipped_set = {inst_id for t in timings for inst_id in t["skipped"]}
+    skipped = [inst_id for inst_id in symbols if inst_id in skipped_set]
+    if skipped:
+        print(f"⏱ Parçalı tarama: {len(skipped)} sembol atlandı")
+
+    busy = sum(t["precompute_s"] + t["sequential_est_s"] for t in timings)
+    stats = {
+        "symbols": n,
+        "workers": procs * SCAN_WORKERS,
+        "processes": procs,
+        "wall_s": wall,
+        "sequential_est_s": busy,
+        "speedup_est": (busy / wall) if wall > 0 else 1.0,
+        "skipped": skipped,
+        "shards": [dict(t, skipped=len(t["skipped"])) for t in timings],
+    }
+    return pre_signals, signals_4h, stats
+
+
+# ========== SİNYAL DEPOSU ==========
+
+class SignalStore:
+    """
+    4H kesin sinyallerin SQLite deposu.
+    - (instId, side, candle ts) tekil indeksi → aynı 4H kurulumu sonraki run'da tekrar gönderilmez;
+      Telegram teslimi başarısız olan (delivery = failed) kurulum bir sonraki run'da yeniden gönderilir
+      (delivery: queued → sent / failed, record_delivery)
+    - açık sinyaller her run'da yalnız son işlenen bardan sonra kapanan mumlarla ilerletilir
+      (outcome_step); maliyet toplam sinyal geçmişiyle değil yeni bar sayısıyla orantılı
+    status: open → tp1 / tp2 / tp3 / stop / expired (BACKTEST_MAX_HOLD_BARS içinde sonuç yok)
+    Kapanmış sinyaller SIGNAL_RETENTION_DAYS sonra silinir (prune).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS signals (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                inst_id TEXT NOT NULL,
+                side TEXT NOT NULL,
+                candle_ts INTEGER NOT NULL,
+                run_id INTEGER NOT NULL,
+                created REAL NOT NULL,
+                entry REAL NOT NULL,
+                stop REAL NOT NULL,
+                tp1 REAL NOT NULL,
+                tp2 REAL NOT NULL,
+                tp3 REAL NOT NULL,
+                confidence INTEGER NOT NULL,
+                status TEXT NOT NULL DEFAULT 'open',
+                best_tp INTEGER NOT NULL DEFAULT 0,
+                last_ts INTEGER NOT NULL,
+                bars INTEGER NOT NULL DEFAULT 0,
+                closed_ts INTEGER,
+                delivery TEXT NOT NULL DEFAULT 'queued'
+            )
+            """
+        )
+        if "delivery" not in {r[1] for r in self._conn.execute("PRAGMA table_info(signals)")}:
+            # Eski depo: mevcut kayıtlar "queued" sayılır (önceki gibi bastırılır)
+            self._conn.execute("ALTER TABLE signals ADD COLUMN delivery TEXT NOT NULL DEFAULT 'queued'")
+        self._conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS signals_key ON signals (inst_id, side, candle_ts)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS signals_status ON signals (status, inst_id)")
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def add(self, sig, run_id):
+        """
+        Sinyali kaydeder. True → gönderilmeli (yeni ya da önceki teslimi başarısız),
+        False → aynı (instId, side, mum ts) daha önce kaydedilmiş ve teslim edilmiş / kuyrukta.
+        """
+        key = (sig["inst_id"], sig["side"], sig["candle_ts"])
+        with self._lock:
+            cur = self._conn.execute(
+                """
+                INSERT OR IGNORE INTO signals
+                    (inst_id, side, candle_ts, run_id, created, entry, stop, tp1, tp2, tp3, confidence, last_ts)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                key + (run_id, time.time(), sig["last_close"], sig["stop"], sig["tp1"], sig["tp2"], sig["tp3"],
+                       sig["confidence"], sig["candle_ts"]),
+            )
+            if cur.rowcount == 0:
+                cur = self._conn.execute(
+                    "UPDATE signals SET delivery = 'queued', run_id = ? "
+                    "WHERE inst_id = ? AND side = ? AND candle_ts = ? AND delivery = 'failed'",
+                    (run_id,) + key,
+                )
+            self._conn.commit()
+        return cur.rowcount > 0
+
+    def record_delivery(self, keys, ok):
+        """
+        Telegram teslim sonucu. Aynı sinyal birden çok parça / sohbette olabilir:
+        bir başarılı teslim yeterlidir, "sent" sonradan "failed" olmaz.
+        """
+        keys = [tuple(k) for k in keys]
+        with self._lock:
+            if ok:
+                sql = "UPDATE signals SET delivery = 'sent' WHERE inst_id = ? AND side = ? AND candle_ts = ?"
+            else:
+                sql = ("UPDATE signals SET delivery = 'failed' "
+                       "WHERE inst_id = ? AND side = ? AND candle_ts = ? AND delivery != 'sent'")
+            self._conn.executemany(sql, keys)
+            self._conn.commit()
+
+    def prune(self, retention_days=SIGNAL_RETENTION_DAYS, now=None):
+        """retention_days'ten eski kapanmış sinyalleri siler. Dönen: silinen kayıt sayısı."""
+        cutoff = (now if now is not None else time.time()) - retention_days * 86400
+        with self._lock:
+            cur = self._conn.execute("DELETE FROM signals WHERE status != 'open' AND created < ?", (cutoff,))
+            self._conn.commit()
+        return cur.rowcount
+
+    def open_signals(self):
+        with self._lock:
+            return self._conn.execute(
+                """
+                SELECT id, inst_id, side, stop, tp1, tp2, tp3, best_tp, last_ts, bars
+                FROM signals WHERE status = 'open' ORDER BY inst_id, id
+                """
+            ).fetchall()
+
+    def track(self, load_series, max_hold=BACKTEST_MAX_HOLD_BARS):
+        """
+        Açık sinyalleri yeni kapanan 4H barlarla ilerletir. load_series(inst_id) → 4H CandleSeries.
+        Dönen: (olaylar, istatistik). Olay: {"inst_id", "side", "event": tp1|tp2|tp3|stop|expired, "best_tp"}
+        """
+        events = []
+        updates = []
+        new_bars = 0
+        by_inst = {}
+        for row in self.open_signals():
+            by_inst.setdefault(row[1], []).append(row)
+        for inst_id, rows in by_inst.items():
+            series = load_series(inst_id)
+            ts_col = series.ts
+            confirm = series.confirm
+            for row_id, _, side, stop, tp1, tp2, tp3, best, last_ts, bars in rows:
+                status = "open"
+                closed_ts = None
+                j = bisect.bisect_right(ts_col, last_ts)
+                while j < len(series) and confirm[j] and status == "open":
+                    prev_best = best
+                    best, outcome = outcome_step(side, series.high[j], series.low[j], stop, tp1, tp2, tp3, best)
+                    bars += 1
+                    new_bars += 1
+                    last_ts = ts_col[j]
+                    for level in range(prev_best + 1, best + 1):
+                        events.append({"inst_id": inst_id, "side": side, "event": f"tp{level}", "best_tp": best})
+                    if outcome is None and bars >= max_hold:
+                        outcome = f"tp{best}" if best else "expired"
+                        events.append({"inst_id": inst_id, "side": side, "event": "expired", "best_tp": best})
+                    elif outcome is not None and outcome != "tp3":
+                        events.append({"inst_id": inst_id, "side": side, "event": "stop", "best_tp": best})
+                    if outcome is not None:
+                        status = outcome
+                        closed_ts = last_ts
+                    j += 1
+                updates.append((status, best, last_ts, bars, closed_ts, row_id))
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE signals SET status = ?, best_tp = ?, last_ts = ?, bars = ?, closed_ts = ? WHERE id = ?",
+                updates,
+            )
+            self._conn.commit()
+        closed = sum(1 for u in updates if u[0] != "open")
+        return events, {"tracked": len(updates), "new_bars": new_bars, "closed": closed}
+
+    def summary(self):
+        """status → sinyal sayısı (saklama süresi içindeki geçmiş)."""
+        with self._lock:
+            return dict(self._conn.execute("SELECT status, COUNT(*) FROM signals GROUP BY status").fetchall())
+
+
+SIGNAL_STORE = None
+_SIGNAL_STORE_LOCK = threading.Lock()
+
+
+def get_signal_store():
+    """SIGNAL_DB_PATH tanımlıysa paylaşılan SignalStore örneğini (lazy) döner."""
+    global SIGNAL_STORE
+    if not SIGNAL_DB_PATH:
+        return None
+    if SIGNAL_STORE is None or SIGNAL_STORE.path != SIGNAL_DB_PATH:
+        with _SIGNAL_STORE_LOCK:
+            if SIGNAL_STORE is None or SIGNAL_STORE.path != SIGNAL_DB_PATH:
+                SIGNAL_STORE = SignalStore(SIGNAL_DB_PATH)
+    return SIGNAL_STORE
+
+
+def signal_ref(signals_4h):
+    """Mesajdaki 4H sinyallerin (instId, side, mum ts) anahtarları → outbox ref metni (yoksa None)."""
+    keys = [[s["inst_id"], s["side"], s["candle_ts"]] for s in signals_4h if "candle_ts" in s]
+    return json.dumps(keys) if keys else None
+
+
+def record_signal_delivery(ref, ok):
+    """TelegramDelivery.on_result: ref'teki sinyallerin teslim sonucunu depoya yazar."""
+    store = get_signal_store()
+    if store is not None:
+        store.record_delivery(json.loads(ref), ok)
+
+
 # ========== TELEGRAM MESAJI OLUŞTURMA ==========
 
-def build_telegram_message(btc_info, eth_info, pre_signals, signals_4h):
+def format_pre_signal(s):
+    """Tek 1H pre-signal'ın mesaj satırları."""
+    of = s["orderflow"]
+    whale_str = "Yok"
+    if s["side"] == "LONG" and of["buy_whale"]:
+        bw = of["buy_whale"]
+        whale_str = f"{bw['tier']}-BUY ~${bw['usd']:,.0f}"
+    elif s["side"] == "SHORT" and of["sell_whale"]:
+        sw = of["sell_whale"]
+        whale_str = f"{sw['tier']}-SELL ~${sw['usd']:,.0f}"
+
+    return [
+        f"\n*{s['inst_id']} ({s['side']})* {s['segment_label']}",
+        f"- Fiyat (1H): `{s['last_close']:.4f}`",
+        f"- Net delta: `{of['net_delta']:.0f} USDT`",
+        f"- Whale: {whale_str}",
+        f"- Orderflow: BUY %{of['buy_ratio']*100:.0f} / SELL %{of['sell_ratio']*100:.0f}",
+        f"- Skor: *%{s['score']}*",
+    ]
+
+
+def format_signal_4h(s):
+    """Tek 4H kesin sinyalin mesaj satırları."""
+    of = s["orderflow"]
+    book = s["orderbook"]
+    if s["side"] == "LONG":
+        w = of["buy_whale"]
+    else:
+        w = of["sell_whale"]
+    whale_str = "Yok"
+    if w:
+        whale_str = f"{w['tier']}-{w['side'].upper()} ~${w['usd']:,.0f}"
+
+    struct_txt = []
+    if s["side"] == "LONG":
+        if s["structure"].get("bull_msb"):
+            struct_txt.append("Bullish MSB")
+        if s["structure"].get("bull_fvg_reject"):
+            struct_txt.append("Bullish FVG retest")
+    else:
+        if s["structure"].get("bear_msb"):
+            struct_txt.append("Bearish MSB")
+        if s["structure"].get("bear_fvg_reject"):
+            struct_txt.append("Bearish FVG retest")
+
+    struct_str = ", ".join(struct_txt) if struct_txt else "Yapı: N/A"
+
+    lines = [
+        f"\n*{s['inst_id']} ({s['side']})* {s['segment_label']}",
+        f"- Kapanış (4H): `{s['last_close']:.4f}`",
+        f"- Yapı: {struct_str}",
+        f"- Net delta: `{of['net_delta']:.0f} USDT`",
+        f"- Orderbook (Bid/Ask): `{book['bid_notional']:.0f} / {book['ask_notional']:.0f}`",
+        f"- Orderflow: BUY %{of['buy_ratio']*100:.0f} / SELL %{of['sell_ratio']*100:.0f}",
+        f"- Whale: {whale_str}",
+    ]
+    dv = s.get("derivatives")
+    if dv:
+        funding_txt = f"%{dv['funding']*100:.4f}" if dv["funding"] is not None else "N/A"
+        basis_txt = f"%{dv['basis']*100:.3f}" if dv["basis"] is not None else "N/A"
+        oi_txt = f"${dv['oi_usd']:,.0f}" if dv["oi_usd"] is not None else "N/A"
+        lines.append(f"- Perp: funding {funding_txt} | basis {basis_txt} | OI {oi_txt}")
+    lines.append(f"- Güven: *%{s['confidence']}*")
+    lines.append(f"- 🎯 TP1/TP2/TP3: `{s['tp1']:.4f} / {s['tp2']:.4f} / {s['tp3']:.4f}`")
+    lines.append(f"- 🛑 Stop: `{s['stop']:.4f}`")
+    return lines
+
+
+def build_telegram_message(btc_info, eth_info, pre_signals, signals_4h, skipped=None, outcomes=None):
     lines = []
     lines.append("📊 *Piyasa Durumu (BTC & ETH)*")
 
@@ -926,132 +4568,1865 @@ def build_telegram_message(btc_info, eth_info, pre_signals, signals_4h):
         pre_signals_sorted = sorted(pre_signals, key=lambda x: x["score"], reverse=True)[:10]
         lines.append("\n⏳ *1H Ön-Uyarılar (Pre-Signal)*")
         for s in pre_signals_sorted:
-            of = s["orderflow"]
-            book = s["orderbook"]
-            whale_str = "Yok"
-            if s["side"] == "LONG" and of["buy_whale"]:
-                bw = of["buy_whale"]
-                whale_str = f"{bw['tier']}-BUY ~${bw['usd']:,.0f}"
-            elif s["side"] == "SHORT" and of["sell_whale"]:
-                sw = of["sell_whale"]
-                whale_str = f"{sw['tier']}-SELL ~${sw['usd']:,.0f}"
-
-            lines.append(
-                f"\n*{s['inst_id']} ({s['side']})* {s['segment_label']}"
-            )
-            lines.append(f"- Fiyat (1H): `{s['last_close']:.4f}`")
-            lines.append(f"- Net delta: `{of['net_delta']:.0f} USDT`")
-            lines.append(f"- Whale: {whale_str}")
-            lines.append(
-                f"- Orderflow: BUY %{of['buy_ratio']*100:.0f} / SELL %{of['sell_ratio']*100:.0f}"
-            )
-            lines.append(f"- Skor: *%{s['score']}*")
+            lines.extend(format_pre_signal(s))
 
     # 4H Kesin Sinyaller
     if signals_4h:
         sig_sorted = sorted(signals_4h, key=lambda x: x["confidence"], reverse=True)[:8]
         lines.append("\n🚀 *4H Kesin Sinyaller*")
         for s in sig_sorted:
-            of = s["orderflow"]
-            book = s["orderbook"]
-            if s["side"] == "LONG":
-                w = of["buy_whale"]
-            else:
-                w = of["sell_whale"]
-            whale_str = "Yok"
-            if w:
-                whale_str = f"{w['tier']}-{w['side'].upper()} ~${w['usd']:,.0f}"
-
-            struct_txt = []
-            if s["side"] == "LONG":
-                if s["structure"].get("bull_msb"):
-                    struct_txt.append("Bullish MSB")
-                if s["structure"].get("bull_fvg_reject"):
-                    struct_txt.append("Bullish FVG retest")
-            else:
-                if s["structure"].get("bear_msb"):
-                    struct_txt.append("Bearish MSB")
-                if s["structure"].get("bear_fvg_reject"):
-                    struct_txt.append("Bearish FVG retest")
+            lines.extend(format_signal_4h(s))
+
+    if not pre_signals and not signals_4h:
+        lines.append("\n_Bu saatte yeni pre-signal veya kesin sinyal yok._")
 
-            struct_str = ", ".join(struct_txt) if struct_txt else "Yapı: N/A"
+    if outcomes:
+        # Önceki run'ların açık sinyallerinde bu run görülen TP / stop / süre dolumu
+        labels = {"tp1": "TP1 ✅", "tp2": "TP2 ✅", "tp3": "TP3 ✅", "stop": "Stop 🛑", "expired": "Süre doldu ⌛"}
+        lines.append("\n📈 *Sinyal Takibi*")
+        for ev in outcomes[:15]:
+            label = labels[ev["event"]]
+            if ev["event"] in ("stop", "expired") and ev["best_tp"]:
+                label += f" (TP{ev['best_tp']} sonrası)"
+            lines.append(f"- {ev['inst_id']} ({ev['side']}): {label}")
+        if len(outcomes) > 15:
+            lines.append(f"- ... +{len(outcomes) - 15} olay")
+
+    if skipped:
+        # Süre bütçesi doldu → kısmi sonuç
+        shown = ", ".join(skipped[:10]) + (" ..." if len(skipped) > 10 else "")
+        lines.append(f"\n⏱ *Kısmi tarama:* süre bütçesi doldu, {len(skipped)} sembol taranamadı")
+        lines.append(f"`{shown}`")
 
-            lines.append(
-                f"\n*{s['inst_id']} ({s['side']})* {s['segment_label']}"
-            )
-            lines.append(f"- Kapanış (4H): `{s['last_close']:.4f}`")
-            lines.append(f"- Yapı: {struct_str}")
-            lines.append(f"- Net delta: `{of['net_delta']:.0f} USDT`")
-            lines.append(
-                f"- Orderbook (Bid/Ask): `{book['bid_notional']:.0f} / {book['ask_notional']:.0f}`"
+    lines.append(f"\n_Zaman:_ `{ts()}`")
+    return "\n".join(lines)
+
+
+class SignalStream:
+    """
+    Tarama sırasında sinyal teslim hattı. Analiz sonuçları put() ile kuyruğa girer, ayrı bir
+    thread teslim eder:
+    - confidence >= STREAM_MIN_CONFIDENCE 4H sinyalleri hemen, tek tek
+    - pre-signal'lar ve daha düşük güvenli 4H sinyaller biriktirilir; ilki geldikten
+      STREAM_PRESIGNAL_DEBOUNCE_S sonra ya da STREAM_PRESIGNAL_BATCH dolunca tek mesajla
+    close() kalanları gönderip thread'i bekler. started: ilk uyarı süresinin ölçüldüğü
+    time.perf_counter() referansı (run başı).
+    """
+
+    _STOP = object()
+
+    def __init__(self, send=None, started=None, min_confidence=STREAM_MIN_CONFIDENCE,
+                 debounce_s=STREAM_PRESIGNAL_DEBOUNCE_S, batch=STREAM_PRESIGNAL_BATCH):
+        self.send = send or telegram
+        self.started = started if started is not None else time.perf_counter()
+        self.min_confidence = min_confidence
+        self.debounce_s = debounce_s
+        self.batch = batch
+        self._queue = queue.Queue()
+        self._pending_pre = []
+        self._pending_4h = []
+        self._pending_since = None
+        self._thread = None
+        self.immediate = 0
+        self.batches = 0
+        self.first_alert_s = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="signal-stream", daemon=True)
+        self._thread.start()
+        return self
+
+    def put(self, pre_signals, signals_4h):
+        if pre_signals or signals_4h:
+            self._queue.put((list(pre_signals), list(signals_4h)))
+
+    def close(self, timeout=None):
+        self._queue.put(self._STOP)
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _deliver(self, text, signals_4h=()):
+        ref = signal_ref(signals_4h)
+        if ref is not None:
+            self.send(text, ref=ref)
+        else:
+            self.send(text)
+        if self.first_alert_s is None:
+            self.first_alert_s = time.perf_counter() - self.started
+
+    def _flush(self):
+        if not self._pending_pre and not self._pending_4h:
+            return
+        lines = []
+        sigs4 = self._pending_4h
+        if self._pending_4h:
+            lines.append("🚀 *4H Sinyaller (anlık)*")
+            for s in sorted(self._pending_4h, key=lambda x: x["confidence"], reverse=True):
+                lines.extend(format_signal_4h(s))
+        if self._pending_pre:
+            lines.append("\n⏳ *1H Ön-Uyarılar (anlık)*" if lines else "⏳ *1H Ön-Uyarılar (anlık)*")
+            for s in sorted(self._pending_pre, key=lambda x: x["score"], reverse=True):
+                lines.extend(format_pre_signal(s))
+        lines.append(f"\n_Zaman:_ `{ts()}`")
+        self._pending_pre = []
+        self._pending_4h = []
+        self._pending_since = None
+        self.batches += 1
+        self._deliver("\n".join(lines), sigs4)
+
+    def _run(self):
+        while True:
+            timeout = None
+            if self._pending_since is not None:
+                timeout = max(0.0, self._pending_since + self.debounce_s - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                self._flush()
+                continue
+            if item is self._STOP:
+                self._flush()
+                return
+            pre_signals, signals_4h = item
+            for s in signals_4h:
+                if s["confidence"] >= self.min_confidence:
+                    self.immediate += 1
+                    self._deliver("\n".join(["⚡ *4H Kesin Sinyal*"] + format_signal_4h(s) + [f"\n_Zaman:_ `{ts()}`"]), [s])
+                else:
+                    self._pending_4h.append(s)
+            self._pending_pre.extend(pre_signals)
+            if (self._pending_pre or self._pending_4h) and self._pending_since is None:
+                self._pending_since = time.monotonic()
+            if len(self._pending_pre) + len(self._pending_4h) >= self.batch:
+                self._flush()
+
+    def stats(self):
+        return {
+            "immediate_4h": self.immediate,
+            "batches": self.batches,
+            "first_alert_s": self.first_alert_s,
+        }
+
+
+# ========== CANLI MOD (WEBSOCKET) ==========
+#
+# Saatlik REST taraması yerine uzun süre çalışan daemon:
+# - trades / books (public) ve candle1H / candle4H (business) kanallarına abone olur
+# - bellekteki durumu sürekli günceller
+# - bir mum kapandığı an (yeni bar açıldığında) mevcut 4H / 1H sinyal mantığını çalıştırır
+# Analizörler değişmez: değerlendirme anında canlı durum bir MarketSnapshot'a yüklenir,
+# analizörler veriyi REST yerine oradan okur.
+
+_WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+def _ws_accept_key(key):
+    return base64.b64encode(hashlib.sha1((key + _WS_GUID).encode()).digest()).decode()
+
+
+def _recv_exact(sock, n):
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            raise ConnectionError("WebSocket bağlantısı kapandı")
+        buf += chunk
+    return bytes(buf)
+
+
+def _recv_http_head(sock):
+    head = bytearray()
+    while not head.endswith(b"\r\n\r\n"):
+        ch = sock.recv(1)
+        if not ch:
+            raise ConnectionError("HTTP başlığı okunamadı")
+        head += ch
+    return head.decode("latin-1")
+
+
+def _ws_mask(payload, key):
+    n = len(payload)
+    if not n:
+        return payload
+    mask = int.from_bytes((key * (n // 4 + 1))[:n], "big")
+    return (int.from_bytes(payload, "big") ^ mask).to_bytes(n, "big")
+
+
+def ws_send_frame(sock, opcode, payload, mask):
+    """Tek (FIN) WebSocket frame'i gönderir. İstemci frame'leri maskeli olmalıdır (RFC 6455)."""
+    n = len(payload)
+    header = bytearray([0x80 | opcode])
+    mbit = 0x80 if mask else 0
+    if n < 126:
+        header.append(mbit | n)
+    elif n < 65536:
+        header.append(mbit | 126)
+        header += struct.pack("!H", n)
+    else:
+        header.append(mbit | 127)
+        header += struct.pack("!Q", n)
+    if mask:
+        key = os.urandom(4)
+        header += key
+        payload = _ws_mask(payload, key)
+    sock.sendall(bytes(header) + payload)
+
+
+def ws_read_frame(sock):
+    """Dönen: (fin, opcode, payload)"""
+    b1, b2 = _recv_exact(sock, 2)
+    fin = bool(b1 & 0x80)
+    opcode = b1 & 0x0F
+    n = b2 & 0x7F
+    if n == 126:
+        n = struct.unpack("!H", _recv_exact(sock, 2))[0]
+    elif n == 127:
+        n = struct.unpack("!Q", _recv_exact(sock, 8))[0]
+    key = _recv_exact(sock, 4) if b2 & 0x80 else None
+    payload = _recv_exact(sock, n) if n else b""
+    if key:
+        payload = _ws_mask(payload, key)
+    return fin, opcode, payload
+
+
+def ws_read_message(sock, mask_replies):
+    """
+    Parçalı frame'leri birleştirip bir text mesajı döner; ping'e pong ile cevap verir.
+    Kapanış frame'inde ConnectionError fırlatır.
+    """
+    parts = []
+    while True:
+        fin, opcode, payload = ws_read_frame(sock)
+        if opcode == 0x8:
+            raise ConnectionError("WebSocket close frame")
+        if opcode == 0x9:
+            ws_send_frame(sock, 0xA, payload, mask_replies)
+            continue
+        if opcode == 0xA:
+            continue
+        parts.append(payload)
+        if fin:
+            return b"".join(parts).decode("utf-8")
+
+
+class WebSocketClient:
+    """
+    Standart kütüphane ile minimal WebSocket istemcisi (ws:// ve wss://).
+    Sadece text mesajları; ping/pong ve parçalı frame'ler desteklenir.
+    """
+
+    def __init__(self, url, timeout=10):
+        parts = urlsplit(url)
+        secure = parts.scheme == "wss"
+        port = parts.port or (443 if secure else 80)
+        sock = socket.create_connection((parts.hostname, port), timeout=timeout)
+        if secure:
+            sock = ssl.create_default_context().wrap_socket(sock, server_hostname=parts.hostname)
+
+        key = base64.b64encode(os.urandom(16)).decode()
+        path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        request = (
+            f"GET {path} HTTP/1.1\r\n"
+            f"Host: {parts.hostname}:{port}\r\n"
+            "Upgrade: websocket\r\n"
+            "Connection: Upgrade\r\n"
+            f"Sec-WebSocket-Key: {key}\r\n"
+            "Sec-WebSocket-Version: 13\r\n\r\n"
+        )
+        sock.sendall(request.encode())
+        head = _recv_http_head(sock)
+        status = head.split("\r\n", 1)[0]
+        if " 101" not in status or _ws_accept_key(key) not in head:
+            sock.close()
+            raise ConnectionError(f"WebSocket handshake başarısız: {status}")
+        self.url = url
+        self.sock = sock
+        self._send_lock = threading.Lock()
+
+    def send(self, text):
+        with self._send_lock:
+            ws_send_frame(self.sock, 0x1, text.encode("utf-8"), mask=True)
+
+    def recv(self, timeout=None):
+        """Bir text mesajı döner; timeout içinde veri gelmezse None."""
+        pending = getattr(self.sock, "pending", lambda: 0)()
+        if not pending:
+            readable, _, _ = select.select([self.sock], [], [], timeout)
+            if not readable:
+                return None
+        # Frame ortasında zaman aşımı akışı bozar → mesajın tamamı bloklu okunur
+        self.sock.settimeout(30)
+        return ws_read_message(self.sock, mask_replies=True)
+
+    def close(self):
+        try:
+            with self._send_lock:
+                ws_send_frame(self.sock, 0x8, b"", mask=True)
+        except Exception:
+            pass
+        try:
+            self.sock.close()
+        except Exception:
+            pass
+
+
+class LiveSymbolState:
+    """Tek sembol için canlı durum: mum satırları, son trade'ler (en yeni başta), son orderbook."""
+
+    def __init__(self):
+        self.candles = {}  # bar -> [(ts, o, h, l, c, vol, volCcy, confirm), ...] kronolojik
+        self.trades = deque(maxlen=TRADES_LIMIT)
+        self.book = None  # LocalOrderBook
+        self.resync_pending = False  # defter bozuldu, yeniden abonelik snapshot'ı bekleniyor
+        self.stale_bars = set()  # kopma sonrası REST ile tazelenemeyen barlar: ilk push kapanış sayılmaz
+
+    def update_candle(self, bar, row, max_bars):
+        """
+        Mum satırını uygular. Yeni bir bar açıldıysa (önceki bar kapandı) True döner.
+        Bar stale_bars'taysa son satır kopmadan kalmadır → ilk yeni bar kapanış olayı üretmez.
+        """
+        rows = self.candles.setdefault(bar, [])
+        if rows and rows[-1][0] == row[0]:
+            rows[-1] = row
+            return False
+        if rows and row[0] < rows[-1][0]:
+            # Eski bar için geç gelen güncelleme
+            for i in range(len(rows) - 1, -1, -1):
+                if rows[i][0] == row[0]:
+                    rows[i] = row
+                    break
+            return False
+        rolled = bool(rows) and bar not in self.stale_bars
+        self.stale_bars.discard(bar)
+        if rolled and not rows[-1][7]:
+            # Yeni bar açıldı → önceki bar kesin kapandı (son push'u confirm=0 olabilir); takip confirm'e bakar
+            rows[-1] = rows[-1][:7] + (1,)
+        rows.append(row)
+        if len(rows) > max_bars:
+            del rows[: len(rows) - max_bars]
+        return rolled
+
+
+class LiveScanner:
+    """
+    WebSocket tabanlı canlı tarayıcı.
+    - bootstrap(): REST ile başlangıç durumu (mumlar + son trade'ler)
+    - run(): WS okuyucu thread'leri + mum kapanışında sinyal değerlendirmesi
+    Yerel bir WsReplayServer'a (OKX_WS_PUBLIC / OKX_WS_BUSINESS) bağlanarak test edilebilir.
+    """
+
+    CANDLE_BARS = ("1H", "4H")
+
+    def __init__(
+        self,
+        symbols,
+        public_url=OKX_WS_PUBLIC,
+        business_url=OKX_WS_BUSINESS,
+        record_path=LIVE_RECORD_PATH,
+        notify=True,
+    ):
+        self.symbols = list(symbols)
+        for ref in ("BTC-USDT", "ETH-USDT"):
+            if ref not in self.symbols:
+                self.symbols.append(ref)
+        self.urls = {"public": public_url, "business": business_url}
+        self.record_path = record_path
+        self.notify = notify
+        self.state = {inst_id: LiveSymbolState() for inst_id in self.symbols}
+        self.max_bars = max(CANDLE_LIMIT_4H, CANDLE_LIMIT_1H)
+        self.signals = []  # [(bar, pre_signals, signals_4h)] — değerlendirme geçmişi
+        self.messages = 0
+        self._lock = threading.Lock()
+        self._record_lock = threading.Lock()
+        self._events = queue.Queue()
+        self._stop = threading.Event()
+        self._clients = {}
+        self._resyncing = set()  # kopan ve REST senkronu bitmemiş akışlar (kind)
+        self._synced = threading.Condition(self._lock)
+        self.bootstrapped = False
+
+    # ---- başlangıç durumu ----
+
+    def bootstrap(self, workers=SCAN_WORKERS):
+        def load(inst_id):
+            candles = {bar: get_candles(inst_id, bar=bar, limit=self.max_bars) for bar in self.CANDLE_BARS}
+            trades = get_trades(inst_id)
+            if ORDERFLOW_WINDOW:
+                ORDERFLOW.backfill(inst_id)
+                ORDERFLOW.add_trades(inst_id, trades)
+            return inst_id, candles, trades
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            for inst_id, candles, trades in pool.map(load, self.symbols):
+                st = self.state[inst_id]
+                with self._lock:
+                    for bar, series in candles.items():
+                        st.candles[bar] = series.rows()
+                    st.trades.clear()
+                    st.trades.extend(trades)
+        self.bootstrapped = True
+
+    def resync(self, kind, workers=SCAN_WORKERS):
+        """
+        Kopan akış yeniden bağlanınca (abonelikten sonra, ilk push işlenmeden) REST ile tazelenir:
+        - business: mumlar yeniden çekilir → kopukluktaki barlar doldurulur; son bar ilerlediyse
+          kaçırılan kapanış için olay üretilir (WS'in ilk push'u bayat satırdan "kapanış" sayılmaz)
+        - public: trade penceresi sıfırlanıp yeniden doldurulur (kopukluktaki trade'ler eksik kalmasın)
+        Değerlendirme her iki akışın senkronu bitene kadar bekler (bkz. _wait_synced).
+        """
+        def load(inst_id):
+            if kind == "business":
+                return inst_id, {bar: _fetch_candles(inst_id, bar, self.max_bars) for bar in self.CANDLE_BARS}
+            if ORDERFLOW_WINDOW:
+                ORDERFLOW.reset(inst_id)
+                ORDERFLOW.backfill(inst_id)
+            trades = _fetch_trades(inst_id, TRADES_LIMIT) or []
+            if ORDERFLOW_WINDOW:
+                ORDERFLOW.add_trades(inst_id, trades)
+            return inst_id, trades
+
+        events = []
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            for inst_id, fresh in pool.map(load, self.symbols):
+                st = self.state[inst_id]
+                with self._lock:
+                    if kind != "business":
+                        st.trades.clear()
+                        st.trades.extend(fresh)
+                        continue
+                    for bar, series in fresh.items():
+                        rows = st.candles.get(bar, [])
+                        if not len(series):
+                            st.stale_bars.add(bar)
+                            continue
+                        if rows and series.ts[-1] > rows[-1][0]:
+                            events.append((bar, inst_id, series.ts[-1]))
+                        st.candles[bar] = series.rows()
+                        st.stale_bars.discard(bar)
+        for event in events:
+            self._events.put(event)
+        print(f"WS {kind} yeniden senkron: {len(self.symbols)} sembol, {len(events)} kaçırılan kapanış")
+
+    def _wait_synced(self, timeout=LIVE_RESYNC_WAIT_S):
+        with self._synced:
+            return self._synced.wait_for(lambda: not self._resyncing, timeout)
+
+    # ---- WebSocket ----
+
+    def subscriptions(self, kind):
+        if kind == "public":
+            channels = ("trades", LIVE_BOOK_CHANNEL)
+        else:
+            channels = tuple(f"candle{bar}" for bar in self.CANDLE_BARS)
+        return [{"channel": ch, "instId": inst_id} for inst_id in self.symbols for ch in channels]
+
+    def _reader(self, kind):
+        attempt = 0
+        while not self._stop.is_set():
+            client = None
+            try:
+                client = WebSocketClient(self.urls[kind])
+                self._clients[kind] = client
+                args = self.subscriptions(kind)
+                for i in range(0, len(args), WS_SUBSCRIBE_CHUNK):
+                    client.send(json.dumps({"op": "subscribe", "args": args[i:i + WS_SUBSCRIBE_CHUNK]}))
+                if kind in self._resyncing:
+                    # Push'lar sokette bekler; durum tazelenmeden işlenmez
+                    try:
+                        self.resync(kind)
+                    finally:
+                        with self._synced:
+                            self._resyncing.discard(kind)
+                            self._synced.notify_all()
+                attempt = 0
+                last_rx = time.monotonic()
+                while not self._stop.is_set():
+                    raw = client.recv(timeout=1.0)
+                    if raw is None:
+                        if time.monotonic() - last_rx > WS_PING_INTERVAL_S:
+                            client.send("ping")
+                            last_rx = time.monotonic()
+                        continue
+                    last_rx = time.monotonic()
+                    self.handle_message(kind, raw)
+            except Exception as e:
+                if self._stop.is_set():
+                    break
+                print(f"WS {kind} bağlantı hatası:", e)
+                if self.bootstrapped or self.messages:
+                    # Kopukluktaki veri eksik: yeniden bağlanınca REST senkronu, o zamana kadar değerlendirme bekler
+                    with self._synced:
+                        self._resyncing.add(kind)
+                time.sleep(min(BACKOFF_MAX_S, BACKOFF_BASE_S * (2 ** attempt)) + random.random())
+                attempt += 1
+            finally:
+                if client is not None:
+                    client.close()
+
+    def resubscribe(self, kind, arg):
+        """Tek kanalı kapatıp yeniden açar → sunucu yeni bir snapshot gönderir. Gönderildiyse True."""
+        client = self._clients.get(kind)
+        if client is None:
+            return False
+        try:
+            client.send(json.dumps({"op": "unsubscribe", "args": [arg]}))
+            client.send(json.dumps({"op": "subscribe", "args": [arg]}))
+            return True
+        except Exception as e:
+            print(f"WS {kind} yeniden abonelik hatası:", e)
+            return False
+
+    def _record(self, kind, raw):
+        if not self.record_path:
+            return
+        line = json.dumps({"t": time.time(), "path": urlsplit(self.urls[kind]).path, "msg": raw})
+        with self._record_lock:
+            with open(self.record_path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+    def handle_message(self, kind, raw):
+        self._record(kind, raw)
+        if raw == "pong":
+            return
+        try:
+            msg = json.loads(raw)
+        except ValueError:
+            return
+        if "event" in msg:
+            if msg.get("event") == "error":
+                print("WS hata:", msg.get("msg"))
+            return
+
+        arg = msg.get("arg") or {}
+        channel = arg.get("channel", "")
+        inst_id = arg.get("instId")
+        st = self.state.get(inst_id)
+        data = msg.get("data") or []
+        if st is None or not data:
+            return
+        self.messages += 1
+
+        if channel == "trades":
+            with self._lock:
+                for t in data:
+                    st.trades.appendleft(t)
+            if ORDERFLOW_WINDOW:
+                ORDERFLOW.add_trades(inst_id, data)
+        elif channel.startswith("books"):
+            # books: snapshot + delta (checksum'lı); books5: her mesaj tam snapshot
+            action = msg.get("action", "snapshot")
+            with self._lock:
+                if action != "snapshot" and st.resync_pending:
+                    # Yeni snapshot gelene kadar delta'lar yok sayılır (her delta'da yeniden abonelik olmasın)
+                    return
+                if st.book is None:
+                    st.book = LocalOrderBook()
+                for d in data:
+                    ok = st.book.apply_snapshot(d) if action == "snapshot" else st.book.apply_update(d)
+                    if not ok:
+                        break
+                st.resync_pending = not ok
+            if not ok:
+                print(f"WS {inst_id} orderbook checksum/sıra hatası → yeniden abone olunuyor")
+                if not self.resubscribe(kind, arg):
+                    # Gönderilemedi: bir sonraki delta yeniden denesin (kopan bağlantı zaten baştan abone olur)
+                    with self._lock:
+                        st.resync_pending = False
+        elif channel.startswith("candle"):
+            bar = channel[len("candle"):]
+            for row in parse_candle_rows(data):
+                with self._lock:
+                    rolled = st.update_candle(bar, row, self.max_bars)
+                if rolled:
+                    # Önceki bar kapandı → olay yeni barın açılış ts'i ile; değerlendirme kapanan bar üzerinde
+                    self._events.put((bar, inst_id, row[0]))
+
+    # ---- değerlendirme ----
+
+    def build_snapshot(self, inst_ids, until_ts=None):
+        """
+        Canlı durumdan analizörlerin okuyacağı bir MarketSnapshot hazırlar.
+        until_ts: verilirse ts >= until_ts olan (yeni açılmış) mumlar dışarıda kalır.
+        """
+        snap = MarketSnapshot()
+        with self._lock:
+            for inst_id in inst_ids:
+                st = self.state.get(inst_id)
+                if st is None:
+                    continue
+                for bar, rows in st.candles.items():
+                    if until_ts is not None:
+                        rows = [r for r in rows if r[0] < until_ts]
+                    snap.put_candles(inst_id, bar, CandleSeries.from_rows(rows), self.max_bars)
+                snap.put(("trades", inst_id, TRADES_LIMIT), list(st.trades))
+                if st.book is not None and st.book.valid:
+                    snap.put(("books", inst_id, ORDERBOOK_DEPTH), st.book.summary(ORDERBOOK_DEPTH))
+        return snap
+
+    def evaluate(self, bar, inst_ids, now_ms):
+        """
+        now_ms: yeni açılan barın ts'i. Analizörler az önce kapanan bar üzerinde çalışır
+        (son mum = kapanan bar, değerlendirme zamanı onun ts'i) — backtest_series ile aynı.
+        4H sinyaller main() ile aynı yoldan geçer: candle_ts = sinyalin verildiği (yeni açılan) bar
+        (REST taramasındaki last_candle["ts"]), SignalStore tekrarı bastırır, mesaj ref'le gider
+        ve açık sinyaller kapanan barla ilerletilir.
+        """
+        global SNAPSHOT
+        refs = ["BTC-USDT", "ETH-USDT"]
+        snap = self.build_snapshot(list(inst_ids) + refs, until_ts=now_ms)
+        closed_ts = now_ms - BAR_MS[bar]
+        prev = SNAPSHOT
+        SNAPSHOT = snap
+        try:
+            btc_info = get_trend_summary("BTC-USDT")
+            eth_info = get_trend_summary("ETH-USDT")
+            market_bias = get_market_bias(btc_info, eth_info)
+            pre_signals = []
+            signals_4h = []
+            for inst_id in inst_ids:
+                try:
+                    if bar == "4H":
+                        signals_4h.extend(analyze_symbol_4h(inst_id, market_bias, now_ms=closed_ts))
+                    elif bar == "1H":
+                        pre_signals.extend(analyze_symbol_1h_presignal(inst_id, market_bias))
+                except Exception as e:
+                    print(f"  {inst_id} canlı analiz hatası:", e)
+        finally:
+            SNAPSHOT = prev
+
+        for s in signals_4h:
+            s["candle_ts"] = now_ms
+        outcomes = None
+        store = get_signal_store()
+        if store is not None:
+            run_id = int(time.time() * 1000)
+            found = len(signals_4h)
+            signals_4h = [s for s in signals_4h if store.add(s, run_id)]
+            if found > len(signals_4h):
+                print(f"  {found - len(signals_4h)} sinyal daha önce gönderildi → bastırıldı")
+            if bar == "4H":
+                with self._lock:
+                    closed = {
+                        inst_id: [r for r in st.candles.get("4H", []) if r[0] < now_ms]
+                        for inst_id, st in self.state.items()
+                    }
+                outcomes, _ = store.track(lambda inst_id: CandleSeries.from_rows(closed.get(inst_id, [])))
+
+        self.signals.append((bar, pre_signals, signals_4h))
+        print(
+            f"[{ts()}] {bar} kapanışı: {len(inst_ids)} sembol → "
+            f"{len(pre_signals)} pre-signal, {len(signals_4h)} kesin sinyal"
+        )
+        if self.notify and (pre_signals or signals_4h or outcomes):
+            telegram(
+                build_telegram_message(btc_info, eth_info, pre_signals, signals_4h, outcomes=outcomes),
+                ref=signal_ref(signals_4h),
             )
-            lines.append(
-                f"- Orderflow: BUY %{of['buy_ratio']*100:.0f} / SELL %{of['sell_ratio']*100:.0f}"
+        return pre_signals, signals_4h
+
+    def _drain_events(self, timeout):
+        try:
+            first = self._events.get(timeout=timeout)
+        except queue.Empty:
+            return []
+        events = [first]
+        deadline = time.monotonic() + LIVE_EVAL_DEBOUNCE_S
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                events.append(self._events.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return events
+
+    def run(self, max_runtime_s=None):
+        threads = [
+            threading.Thread(target=self._reader, args=(kind,), daemon=True) for kind in ("public", "business")
+        ]
+        for t in threads:
+            t.start()
+        started = time.monotonic()
+        try:
+            while not self._stop.is_set():
+                if max_runtime_s is not None and time.monotonic() - started >= max_runtime_s:
+                    break
+                events = self._drain_events(timeout=0.5)
+                by_bar = {}
+                for bar, inst_id, when in events:
+                    ids, latest = by_bar.get(bar, ([], 0))
+                    if inst_id not in ids:
+                        ids.append(inst_id)
+                    by_bar[bar] = (ids, max(latest, when))
+                if by_bar and not self._wait_synced():
+                    print("WS yeniden senkronu gecikti → değerlendirme eksik veriyle yapılıyor")
+                for bar, (ids, when) in sorted(by_bar.items()):
+                    self.evaluate(bar, ids, when)
+        finally:
+            self.stop()
+            for t in threads:
+                t.join(timeout=5)
+
+    def stop(self):
+        self._stop.set()
+        with self._synced:
+            self._resyncing.clear()
+            self._synced.notify_all()
+        for client in list(self._clients.values()):
+            client.close()
+
+
+def run_live(max_runtime_s=None):
+    print(f"[{ts()}] PREMIUM PRO canlı mod başlıyor...")
+    ensure_mcap_cache(background=True, apply_refresh=True)
+    symbols = get_spot_usdt_top_symbols(limit=TOP_LIMIT)
+    if not symbols:
+        print("Top USDT listesi alınamadı.")
+        return None
+    scanner = LiveScanner(symbols)
+    print(f"{len(scanner.symbols)} sembol için başlangıç durumu yükleniyor...")
+    scanner.bootstrap()
+    print("WebSocket akışı başladı.")
+    scanner.run(max_runtime_s=max_runtime_s)
+    if ANALYSIS_CACHE is not None:
+        ANALYSIS_CACHE.save()
+    telegram_flush()
+    return scanner
+
+
+class WsReplayServer:
+    """
+    Kaydedilmiş WS mesajlarını (LIVE_RECORD_PATH formatında JSONL:
+    {"t": epoch_sn, "path": "/ws/v5/public", "msg": "..."}) yerel bir ws:// sunucusundan
+    tekrar oynatır. İstemci subscribe olunca o path'e ait mesajlar sırayla gönderilir.
+    speed > 0 ise kayıttaki zaman aralıkları speed kat hızla korunur, 0 → beklemeden.
+    {"path": ..., "drop": true} kaydı bağlantıyı koparır; yeniden bağlanan istemci kaldığı kayıttan devam eder.
+    """
+
+    def __init__(self, record_path, host="127.0.0.1", port=0, speed=0.0):
+        self.records = {}
+        with open(record_path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    rec = json.loads(line)
+                    self.records.setdefault(rec["path"], []).append(rec)
+        self.speed = speed
+        self._pos = {}  # path → sıradaki kayıt (yeniden bağlantılar kaldığı yerden devam eder)
+        self._pos_lock = threading.Lock()
+        replay = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                replay._serve(self.request)
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self.server = socketserver.ThreadingTCPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.host, self.port = self.server.server_address[:2]
+        self._thread = None
+
+    def url(self, path):
+        return f"ws://{self.host}:{self.port}{path}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _serve(self, sock):
+        head = _recv_http_head(sock)
+        path = head.split(" ", 2)[1].split("?", 1)[0]
+        key = ""
+        for line in head.split("\r\n"):
+            if line.lower().startswith("sec-websocket-key:"):
+                key = line.split(":", 1)[1].strip()
+        sock.sendall(
+            (
+                "HTTP/1.1 101 Switching Protocols\r\n"
+                "Upgrade: websocket\r\nConnection: Upgrade\r\n"
+                f"Sec-WebSocket-Accept: {_ws_accept_key(key)}\r\n\r\n"
+            ).encode()
+        )
+        send_lock = threading.Lock()
+
+        def send(text):
+            with send_lock:
+                ws_send_frame(sock, 0x1, text.encode("utf-8"), mask=False)
+
+        # İlk subscribe mesajını bekle, sonra kayıtları oynat; ping'lere paralel cevap ver
+        subscribed = threading.Event()
+
+        def reader():
+            try:
+                while True:
+                    text = ws_read_message(sock, mask_replies=False)
+                    if text == "ping":
+                        send("pong")
+                        continue
+                    msg = json.loads(text)
+                    for arg in msg.get("args", []):
+                        send(json.dumps({"event": msg.get("op"), "arg": arg}))
+                    subscribed.set()
+            except Exception:
+                subscribed.set()
+
+        threading.Thread(target=reader, daemon=True).start()
+        subscribed.wait()
+        records = self.records.get(path, [])
+        with self._pos_lock:
+            start = self._pos.get(path, 0)
+        t0 = records[start].get("t", 0) if start < len(records) else 0
+        started = time.monotonic()
+        try:
+            for i in range(start, len(records)):
+                rec = records[i]
+                if self.speed > 0:
+                    delay = (rec.get("t", t0) - t0) / self.speed - (time.monotonic() - started)
+                    if delay > 0:
+                        time.sleep(delay)
+                with self._pos_lock:
+                    self._pos[path] = i + 1
+                if rec.get("drop"):
+                    sock.shutdown(socket.SHUT_RDWR)
+                    return
+                send(rec["msg"])
+            # Kayıt bitti: bağlantıyı açık tut (istemci kapatana kadar ping/pong)
+            while True:
+                time.sleep(1)
+                sock.getpeername()
+        except Exception:
+            pass
+
+
+def serve_ws_replay(record_path, port=8765, speed=1.0):
+    server = WsReplayServer(record_path, port=port, speed=speed).start()
+    print(f"WS replay sunucusu: {server.url('/ws/v5/public')} ve {server.url('/ws/v5/business')}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+# ========== BACKTEST ==========
+#
+# Depodaki (CandleStore) geçmiş 4H mumları bar bar yürür, her barda analyze_symbol_4h'in
+# kendisini çalıştırır (mumlar / trade'ler MarketSnapshot'a yüklenir) ve compute_levels
+# stop / TP1-3 sonuçlarını sonraki barlarda simüle eder. 1H ön-sinyal kuralları da son
+# BACKTEST_BARS_1H 1H bar üzerinde aynı şekilde yürütülür; isabet BACKTEST_PRESIGNAL_HORIZON
+# bar sonraki kapanışın yönüyle ölçülür. Semboller process havuzuna dağıtılır.
+# - Trade geçmişi: bar aralığında depoda trade varsa onlar (son TRADES_LIMIT) kullanılır;
+#   yoksa BACKTEST_FLOW_PROXY="candle" ile mumdan order-flow yaklaşımı (whale bilinmez).
+# - Mum yaklaşımının deltası canlı TRADES_LIMIT trade penceresinin ölçeğine indirgenir
+#   (depodaki ortalama trade büyüklüğü × TRADES_LIMIT). Sembolün hiç trade kaydı yoksa ölçek
+#   bilinmez → net delta 0 (delta koşulu sağlanmaz); NET_DELTA_MIN_POS / NEG bu barlarda
+#   doğrulanmış sayılmaz (rapordaki flow_bars: trades / proxy / proxy_unscaled / none).
+# - Orderbook geçmişi yoktur → orderbook koşulu backtest'te hiçbir zaman sağlanmaz (muhafazakâr).
+
+_NEUTRAL_BOOK = {"bid_notional": 0.0, "ask_notional": 0.0, "best_bid": None, "best_ask": None}
+
+
+def candle_flow_proxy(series, i, window_notional=None):
+    """
+    Trade kaydı olmayan bar için mumdan order-flow yaklaşımı:
+    quote hacmi kapanışın bar aralığındaki konumuna göre alış/satışa bölünür (CLV).
+    Oranlar ölçekten bağımsızdır; delta ise canlıdaki gibi son TRADES_LIMIT trade'lik
+    pencereye (window_notional, trade_window_notional) indirgenir. window_notional None →
+    ölçek bilinmez, net_delta 0 (delta koşulu hiçbir yönde sağlanmaz).
+    Whale tespiti yapılamaz → has_*_whale False.
+    """
+    h = series.high[i]
+    l = series.low[i]
+    c = series.close[i]
+    quote = series.vol_ccy[i]
+    buy_frac = (c - l) / (h - l) if h > l else 0.5
+    flow_notional = min(quote, window_notional) if window_notional else 0.0
+    buy_notional = flow_notional * buy_frac
+    sell_notional = flow_notional - buy_notional
+    return {
+        "buy_notional": buy_notional,
+        "sell_notional": sell_notional,
+        "net_delta": buy_notional - sell_notional,
+        "buy_whale": None,
+        "sell_whale": None,
+        "has_buy_whale": False,
+        "has_sell_whale": False,
+        "buy_ratio": buy_frac,
+        "sell_ratio": 1 - buy_frac,
+    }
+
+
+def simulate_outcome(side, series, entry_idx, stop, tp1, tp2, tp3, max_hold=BACKTEST_MAX_HOLD_BARS):
+    """
+    Sinyal barından sonraki barlarda stop / TP seviyelerini yürütür.
+    Aynı barda hem stop hem TP görülürse stop önce sayılır (muhafazakâr).
+    Dönen: {"outcome": "tp3"|"tp2"|"tp1"|"stop"|"open", "best_tp": 0-3, "bars": n}
+    """
+    highs = series.high
+    lows = series.low
+    best = 0
+    end = min(len(series), entry_idx + 1 + max_hold)
+    for j in range(entry_idx + 1, end):
+        best, outcome = outcome_step(side, highs[j], lows[j], stop, tp1, tp2, tp3, best)
+        if outcome is not None:
+            return {"outcome": outcome, "best_tp": best, "bars": j - entry_idx}
+    return {"outcome": f"tp{best}" if best else "open", "best_tp": best, "bars": end - 1 - entry_idx}
+
+
+def outcome_step(side, high, low, stop, tp1, tp2, tp3, best):
+    """
+    simulate_outcome'un tek bar adımı (SignalStore'un artımlı takibi de bunu kullanır).
+    Dönen: (best_tp, sonuç) — sonuç None → sinyal açık; stop görülünce f"tp{best}" ya da "stop", TP3 → "tp3".
+    """
+    if side == "LONG":
+        if low <= stop:
+            return best, (f"tp{best}" if best else "stop")
+        hit = 3 if high >= tp3 else 2 if high >= tp2 else 1 if high >= tp1 else 0
+    else:
+        if high >= stop:
+            return best, (f"tp{best}" if best else "stop")
+        hit = 3 if low <= tp3 else 2 if low <= tp2 else 1 if low <= tp1 else 0
+    best = max(best, hit)
+    return best, ("tp3" if best == 3 else None)
+
+
+def trade_window_notional(store, inst_id):
+    """Canlı order-flow penceresinin (son TRADES_LIMIT trade) tahmini notional'ı; trade kaydı yoksa None."""
+    mean = store.trade_notional_mean(inst_id) if store is not None else None
+    return mean * TRADES_LIMIT if mean else None
+
+
+def _backtest_flow(snap, inst_id, series, i, trades, flow_stats, window_notional=None):
+    """Bar i için order-flow girdisini snapshot'a koyar (trade kaydı / mum yaklaşımı / boş)."""
+    snap.discard(("orderflow", inst_id))
+    if trades:
+        snap.put(("trades", inst_id, TRADES_LIMIT), trades[:TRADES_LIMIT])
+        source = "trades"
+    elif BACKTEST_FLOW_PROXY == "candle":
+        snap.put(("orderflow", inst_id), candle_flow_proxy(series, i, window_notional))
+        source = "proxy" if window_notional else "proxy_unscaled"
+    else:
+        snap.put(("trades", inst_id, TRADES_LIMIT), [])
+        source = "none"
+    if flow_stats is not None:
+        flow_stats[source] = flow_stats.get(source, 0) + 1
+
+
+def backtest_series(inst_id, series, bias_by_ts, trades_loader=None, start_bars=STRUCT_LOOKBACK_4H + 3, flow_stats=None,
+                    window_notional=None):
+    """
+    Tek sembolün 4H serisini bar bar yürütür. Dönen: (sinyal kayıtları, yürünen bar sayısı)
+    bias_by_ts: {4H bar ts: "bull"|"bear"|"neutral"} (yoksa neutral)
+    trades_loader(since_ms, until_ms) → OKX formatında trade listesi (en yeni başta)
+    flow_stats: verilirse order-flow kaynağı sayaçları ({"trades"|"proxy"|...: bar}) buraya eklenir.
+    window_notional: mum yaklaşımı deltasının ölçeği (trade_window_notional).
+    """
+    global SNAPSHOT, ANALYSIS_CACHE_PATH
+    bar_ms = BAR_MS["4H"]
+    snap = MarketSnapshot()
+    prev = SNAPSHOT, ANALYSIS_CACHE_PATH
+    SNAPSHOT = snap
+    ANALYSIS_CACHE_PATH = ""  # geçmiş pencereler canlı analiz cache'ini doldurmasın
+    results = []
+    walked = 0
+    try:
+        snap.put(("books", inst_id, ORDERBOOK_DEPTH), _NEUTRAL_BOOK)
+        snap.put(("derivatives", "USDT-SWAP"), {})  # geçmiş funding / OI yok → türev koşulları eklenmez
+        ts_col = series.ts
+        for i in range(start_bars - 1, len(series)):
+            walked += 1
+            window = series[max(0, i + 1 - CANDLE_LIMIT_4H):i + 1]
+            snap.put_candles(inst_id, "4H", window, CANDLE_LIMIT_4H)
+            bar_ts = ts_col[i]
+
+            trades = trades_loader(bar_ts, bar_ts + bar_ms) if trades_loader else []
+            _backtest_flow(snap, inst_id, series, i, trades, flow_stats, window_notional)
+
+            bias = bias_by_ts.get(bar_ts, "neutral")
+            for sig in analyze_symbol_4h(inst_id, bias, now_ms=bar_ts):
+                out = simulate_outcome(sig["side"], series, i, sig["stop"], sig["tp1"], sig["tp2"], sig["tp3"])
+                results.append(
+                    {
+                        "inst_id": inst_id,
+                        "ts": bar_ts,
+                        "side": sig["side"],
+                        "confidence": sig["confidence"],
+                        "entry": sig["last_close"],
+                        "stop": sig["stop"],
+                        "tp1": sig["tp1"],
+                        "tp2": sig["tp2"],
+                        "tp3": sig["tp3"],
+                        **out,
+                    }
+                )
+    finally:
+        SNAPSHOT, ANALYSIS_CACHE_PATH = prev
+    return results, walked
+
+
+def presignal_bias_ts(bar_ts):
+    """1H bar kapanışında bilinen son kapanmış 4H barın ts'i (bias_by_ts anahtarı; ileriye bakmaz)."""
+    bar4 = BAR_MS["4H"]
+    return (bar_ts + BAR_MS["1H"]) // bar4 * bar4 - bar4
+
+
+def backtest_series_1h(inst_id, series, bias_by_ts, trades_loader=None, start_bars=30,
+                       horizon=BACKTEST_PRESIGNAL_HORIZON, flow_stats=None, window_notional=None):
+    """
+    Tek sembolün 1H serisini bar bar yürütüp her barda analyze_symbol_1h_presignal'ı çalıştırır.
+    Ön-sinyalin seviyesi yok → sonuç `horizon` bar sonraki kapanışın yönü:
+    "hit" (sinyal yönünde) / "miss" / "open" (seri yetmedi). ret: yönlü getiri.
+    Dönen: (ön-sinyal kayıtları, yürünen bar sayısı)
+    """
+    global SNAPSHOT, ANALYSIS_CACHE_PATH
+    bar_ms = BAR_MS["1H"]
+    snap = MarketSnapshot()
+    prev = SNAPSHOT, ANALYSIS_CACHE_PATH
+    SNAPSHOT = snap
+    ANALYSIS_CACHE_PATH = ""
+    results = []
+    walked = 0
+    closes = series.close
+    try:
+        snap.put(("books", inst_id, ORDERBOOK_DEPTH), _NEUTRAL_BOOK)
+        ts_col = series.ts
+        for i in range(start_bars - 1, len(series)):
+            walked += 1
+            window = series[max(0, i + 1 - CANDLE_LIMIT_1H_PRE):i + 1]
+            snap.put_candles(inst_id, "1H", window, CANDLE_LIMIT_1H_PRE)
+            bar_ts = ts_col[i]
+            trades = trades_loader(bar_ts, bar_ts + bar_ms) if trades_loader else []
+            _backtest_flow(snap, inst_id, series, i, trades, flow_stats, window_notional)
+
+            bias = bias_by_ts.get(presignal_bias_ts(bar_ts), "neutral")
+            for sig in analyze_symbol_1h_presignal(inst_id, bias):
+                entry = sig["last_close"]
+                if i + horizon < len(series):
+                    ret = (closes[i + horizon] / entry - 1) * (1 if sig["side"] == "LONG" else -1)
+                    outcome = "hit" if ret > 0 else "miss"
+                else:
+                    ret, outcome = None, "open"
+                results.append(
+                    {
+                        "inst_id": inst_id,
+                        "ts": bar_ts,
+                        "side": sig["side"],
+                        "score": sig["score"],
+                        "entry": entry,
+                        "ret": ret,
+                        "outcome": outcome,
+                    }
+                )
+    finally:
+        SNAPSHOT, ANALYSIS_CACHE_PATH = prev
+    return results, walked
+
+
+def _backtest_worker(args):
+    """Process havuzu işçisi: sembolün 4H ve 1H serisini kendi depo bağlantısıyla okuyup yürütür."""
+    global MCAP_CACHE, CANDLE_DB_PATH, CANDLE_STORE, ORDERFLOW_WINDOW
+    inst_id, db_path, mcap, bias_by_ts, bars_1h = args
+    MCAP_CACHE = mcap
+    CANDLE_DB_PATH = db_path
+    CANDLE_STORE = None
+    ORDERFLOW_WINDOW = ""  # backtest her zaman bar içi trade snapshot'ı kullanır
+    t0 = time.perf_counter()
+    store = get_candle_store()
+    flow_stats = {}
+    window = trade_window_notional(store, inst_id)
+    loader = lambda a, b: store.load_trades(inst_id, a, b)
+    results, walked = backtest_series(
+        inst_id, store.load_all(inst_id, "4H"), bias_by_ts, loader, flow_stats=flow_stats, window_notional=window
+    )
+    pre_results = []
+    if bars_1h > 0:
+        series_1h = store.load_all(inst_id, "1H")
+        series_1h = series_1h[max(0, len(series_1h) - bars_1h):]
+        pre_results, walked_1h = backtest_series_1h(
+            inst_id, series_1h, bias_by_ts, loader, flow_stats=flow_stats, window_notional=window
+        )
+        walked += walked_1h
+    return inst_id, results, pre_results, walked, flow_stats, time.perf_counter() - t0
+
+
+def backtest_bias_timeline(store):
+    """BTC 4H + 1H geçmişinden her 4H bar için get_market_bias (trend mantığının aynısı)."""
+    global SNAPSHOT, ANALYSIS_CACHE_PATH
+    btc_4h = store.load_all("BTC-USDT", "4H")
+    btc_1h = store.load_all("BTC-USDT", "1H")
+    if not len(btc_4h) or not len(btc_1h):
+        return {}
+    timeline = {}
+    prev = SNAPSHOT, ANALYSIS_CACHE_PATH
+    ANALYSIS_CACHE_PATH = ""
+    try:
+        ts_1h = btc_1h.ts
+        j = 0
+        for i in range(len(btc_4h)):
+            t = btc_4h.ts[i]
+            while j < len(ts_1h) and ts_1h[j] <= t + BAR_MS["4H"] - BAR_MS["1H"]:
+                j += 1
+            snap = MarketSnapshot()
+            snap.put_candles("BTC-USDT", "4H", btc_4h[max(0, i + 1 - CANDLE_LIMIT_4H):i + 1], CANDLE_LIMIT_4H)
+            snap.put_candles("BTC-USDT", "1H", btc_1h[max(0, j - CANDLE_LIMIT_1H):j], CANDLE_LIMIT_1H)
+            snap.put(("trades", "BTC-USDT", TRADES_LIMIT), [])
+            SNAPSHOT = snap
+            timeline[t] = get_market_bias(get_trend_summary("BTC-USDT"), None)
+    finally:
+        SNAPSHOT, ANALYSIS_CACHE_PATH = prev
+    return timeline
+
+
+def run_backtest(symbols=None, bars=BACKTEST_BARS_4H, workers=BACKTEST_WORKERS, fetch=True, bars_1h=BACKTEST_BARS_1H):
+    """
+    Depodaki geçmiş üzerinde 4H sinyal ve 1H ön-sinyal kurallarını process havuzunda çalıştırır.
+    fetch=True → eksik geçmiş önce history-candles ile depoya çekilir. bars_1h=0 → 1H backtest'i yok.
+    Dönen rapor ayrıca BACKTEST_REPORT_PATH'e JSON olarak yazılır.
+    """
+    store = get_candle_store()
+    if store is None:
+        print("Backtest için CANDLE_DB_PATH gerekli.")
+        return None
+    if not MCAP_CACHE:
+        ensure_mcap_cache(background=False)
+    if symbols is None:
+        symbols = get_spot_usdt_top_symbols(limit=TOP_LIMIT)
+
+    if fetch:
+        print(f"Geçmiş hazırlanıyor: {len(symbols)} sembol × {bars} bar (4H)...")
+        refs = [("BTC-USDT", "1H", bars * 4)]
+        jobs = [(inst_id, "4H", bars) for inst_id in symbols] + refs
+        if bars_1h > 0:
+            jobs += [(inst_id, "1H", bars_1h) for inst_id in symbols]
+        with ThreadPoolExecutor(max_workers=max(1, SCAN_WORKERS)) as pool:
+            list(pool.map(lambda j: store.backfill(*j), jobs))
+
+    bias_by_ts = backtest_bias_timeline(store)
+    mcap = dict(MCAP_CACHE)
+    t0 = time.perf_counter()
+    signals = []
+    presignals = []
+    total_bars = 0
+    flow_bars = {}
+    per_symbol = {}
+    with ProcessPoolExecutor(max_workers=max(1, workers)) as pool:
+        jobs = [(inst_id, store.path, mcap, bias_by_ts, bars_1h) for inst_id in symbols]
+        for inst_id, results, pre_results, walked, flow_stats, elapsed in pool.map(_backtest_worker, jobs):
+            signals.extend(results)
+            presignals.extend(pre_results)
+            total_bars += walked
+            for k, v in flow_stats.items():
+                flow_bars[k] = flow_bars.get(k, 0) + v
+            per_symbol[inst_id] = {
+                "bars": walked, "signals": len(results), "presignals": len(pre_results), "elapsed_s": elapsed
+            }
+    wall = time.perf_counter() - t0
+
+    outcomes = {}
+    for sig in signals:
+        outcomes[sig["outcome"]] = outcomes.get(sig["outcome"], 0) + 1
+    closed = sum(v for k, v in outcomes.items() if k != "open")
+    wins = sum(v for k, v in outcomes.items() if k.startswith("tp"))
+    pre_outcomes = {}
+    for sig in presignals:
+        pre_outcomes[sig["outcome"]] = pre_outcomes.get(sig["outcome"], 0) + 1
+    pre_closed = pre_outcomes.get("hit", 0) + pre_outcomes.get("miss", 0)
+    report = {
+        "symbols": len(symbols),
+        "bars": total_bars,
+        "wall_s": wall,
+        "bars_per_s": (total_bars / wall) if wall > 0 else 0.0,
+        "signals": len(signals),
+        "outcomes": outcomes,
+        "win_rate": (wins / closed) if closed else None,
+        "presignals": len(presignals),
+        "presignal_outcomes": pre_outcomes,
+        "presignal_hit_rate": (pre_outcomes.get("hit", 0) / pre_closed) if pre_closed else None,
+        # Delta eşikleri "proxy_unscaled" barlarda doğrulanmaz (ölçek yok → net delta 0)
+        "flow_bars": flow_bars,
+        "params": {
+            "NET_DELTA_MIN_POS": NET_DELTA_MIN_POS,
+            "NET_DELTA_MIN_NEG": NET_DELTA_MIN_NEG,
+            "ORDERBOOK_IMB_RATIO": ORDERBOOK_IMB_RATIO,
+            "STRUCT_LOOKBACK_4H": STRUCT_LOOKBACK_4H,
+            "MIN_CONDITIONS_STRICT": MIN_CONDITIONS_STRICT,
+            "BACKTEST_FLOW_PROXY": BACKTEST_FLOW_PROXY,
+            "BACKTEST_PRESIGNAL_HORIZON": BACKTEST_PRESIGNAL_HORIZON,
+        },
+        "per_symbol": per_symbol,
+        "trades": sorted(signals, key=lambda s: (s["ts"], s["inst_id"], s["side"])),
+        "presignal_trades": sorted(presignals, key=lambda s: (s["ts"], s["inst_id"], s["side"])),
+    }
+    print(
+        f"Backtest: {len(symbols)} sembol, {total_bars} bar, {wall:.1f} sn "
+        f"({report['bars_per_s']:.0f} bar/sn), {len(signals)} sinyal, sonuçlar: {outcomes}"
+    )
+    print(
+        f"1H ön-sinyal: {len(presignals)} sinyal, {BACKTEST_PRESIGNAL_HORIZON} bar sonra: {pre_outcomes}; "
+        f"order-flow kaynağı (bar): {flow_bars} — proxy_unscaled barlarda delta eşiği doğrulanmaz"
+    )
+    if BACKTEST_REPORT_PATH:
+        with open(BACKTEST_REPORT_PATH, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return report
+
+
+# ========== PARAMETRE TARAMASI (SWEEP) ==========
+#
+# Yapı tespiti (MSB/FVG) ve stop/TP sonuçları order-flow eşiklerinden bağımsızdır. Bu yüzden:
+# 1) Her sembol için, her (STRUCT_LOOKBACK_4H, ZONE_BUFFER) varyantında bar başına
+#    yapı / bias uygunluğu ve compute_levels + simulate_outcome getirisi bir kez hesaplanır.
+#    Bar başına order-flow özellikleri (net delta, en büyük buy/sell, buy oranı) de bir kez çıkarılır.
+# 2) Bu diziler shared memory'ye konur; işçiler kombinasyonları tüm barlar üzerinde
+#    vektörel maske işlemleriyle değerlendirir (yeniden yapı hesabı yok).
+# Orderbook geçmişi olmadığı için ORDERBOOK_IMB_RATIO taramada etkisizdir (koşul hep False).
+
+_SWEEP_STRUCT_KEYS = ("STRUCT_LOOKBACK_4H", "ZONE_BUFFER")
+_SWEEP_SHM = {}
+
+
+def _signal_return(side, entry, outcome, levels):
+    """Ulaşılan en iyi TP'de (yoksa stop'ta) çıkış varsayımıyla getiri; açık pozisyon → 0."""
+    stop, tp1, tp2, tp3 = levels
+    exit_px = {"tp1": tp1, "tp2": tp2, "tp3": tp3, "stop": stop}.get(outcome)
+    if exit_px is None or not entry:
+        return 0.0
+    ret = (exit_px - entry) / entry
+    return ret if side == "LONG" else -ret
+
+
+def _sweep_symbol_worker(args):
+    """
+    Tek sembol için eşikten bağımsız özellikleri çıkarır.
+    Dönen: {"flow": {...: ndarray}, "variants": {(lookback, zone): {...: ndarray}}}
+    """
+    global MCAP_CACHE, CANDLE_DB_PATH, CANDLE_STORE, ZONE_BUFFER
+    inst_id, db_path, mcap, bias_by_ts, variants = args
+    MCAP_CACHE = mcap
+    CANDLE_DB_PATH = db_path
+    CANDLE_STORE = None
+    store = get_candle_store()
+    series = store.load_all(inst_id, "4H")
+    n = len(series)
+    bar_ms = BAR_MS["4H"]
+    base = inst_id.split("-")[0]
+    # Çarpansız S eşiği; WHALE_SCALE kombinasyon başına uygulanır
+    s_whale = get_mcap_segment(base)[2] / WHALE_SCALE
+
+    window = trade_window_notional(store, inst_id)
+    delta = np.zeros(n)
+    max_buy = np.zeros(n)
+    max_sell = np.zeros(n)
+    buy_ratio = np.full(n, 0.5)
+    sell_ratio = np.full(n, 0.5)
+    has_flow = np.zeros(n, dtype=bool)
+    ts_col = series.ts
+    for i in range(n):
+        trades = store.load_trades(inst_id, ts_col[i], ts_col[i] + bar_ms)[:TRADES_LIMIT]
+        if trades:
+            # Eşik 0 → her trade whale sayılır, yani buy/sell_whale = en büyük trade
+            of = analyze_trades_orderflow(trades, 0, 0, 0)
+            max_buy[i] = of["buy_whale"]["usd"] if of["buy_whale"] else 0.0
+            max_sell[i] = of["sell_whale"]["usd"] if of["sell_whale"] else 0.0
+        elif BACKTEST_FLOW_PROXY == "candle":
+            of = candle_flow_proxy(series, i, window)
+        else:
+            continue
+        has_flow[i] = True
+        delta[i] = of["net_delta"]
+        buy_ratio[i] = of["buy_ratio"]
+        sell_ratio[i] = of["sell_ratio"]
+
+    out = {
+        "flow": {
+            "delta": delta,
+            "max_buy": max_buy,
+            "max_sell": max_sell,
+            "buy_ratio": buy_ratio,
+            "sell_ratio": sell_ratio,
+            "has_flow": has_flow,
+            "s_whale": np.full(n, float(s_whale)),
+        },
+        "variants": {},
+    }
+
+    bias = [bias_by_ts.get(ts_col[i], "neutral") for i in range(n)]
+    for lookback, zone in variants:
+        ZONE_BUFFER = zone
+        elig_long = np.zeros(n, dtype=bool)
+        elig_short = np.zeros(n, dtype=bool)
+        ret_long = np.zeros(n)
+        ret_short = np.zeros(n)
+        # Sonuç kodu: -1 stop, 0 açık, 1-3 ulaşılan en iyi TP
+        out_long = np.zeros(n, dtype=np.int8)
+        out_short = np.zeros(n, dtype=np.int8)
+        for i in range(lookback + 2, n):
+            window = series[max(0, i + 1 - CANDLE_LIMIT_4H):i + 1]
+            st = compute_structure(window, lookback)
+            fvg = st["fvg"]
+            rej = st["fvg_reject"]
+            bull_rej = bool(rej and fvg and fvg["type"] == "bullish")
+            bear_rej = bool(rej and fvg and fvg["type"] == "bearish")
+            last_close = series.close[i]
+            if (st["bull_msb"] or bull_rej) and bias[i] != "bear":
+                levels = compute_levels("LONG", last_close, window, st["bull_level"], fvg if bull_rej else None)
+                res = simulate_outcome("LONG", series, i, *levels)
+                elig_long[i] = True
+                ret_long[i] = _signal_return("LONG", last_close, res["outcome"], levels)
+                out_long[i] = res["best_tp"] or (-1 if res["outcome"] == "stop" else 0)
+            if (st["bear_msb"] or bear_rej) and bias[i] != "bull":
+                levels = compute_levels("SHORT", last_close, window, st["bear_level"], fvg if bear_rej else None)
+                res = simulate_outcome("SHORT", series, i, *levels)
+                elig_short[i] = True
+                ret_short[i] = _signal_return("SHORT", last_close, res["outcome"], levels)
+                out_short[i] = res["best_tp"] or (-1 if res["outcome"] == "stop" else 0)
+        out["variants"][(lookback, zone)] = {
+            "elig_long": elig_long,
+            "elig_short": elig_short,
+            "ret_long": ret_long,
+            "ret_short": ret_short,
+            "out_long": out_long,
+            "out_short": out_short,
+        }
+    return out
+
+
+def _shm_put(name, arr, meta, blocks):
+    shm = shared_memory.SharedMemory(create=True, size=max(1, arr.nbytes))
+    view = np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)
+    view[...] = arr
+    blocks.append(shm)
+    meta[name] = (shm.name, arr.shape, arr.dtype.str)
+
+
+def _sweep_attach(meta):
+    """İşçi başlatıcı: shared memory dizilerine kopyasız bağlanır."""
+    for name, (shm_name, shape, dtype) in meta.items():
+        shm = shared_memory.SharedMemory(name=shm_name)
+        _SWEEP_SHM[name] = (shm, np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf))
+
+
+def _sweep_eval(combos):
+    """Bir grup kombinasyonu paylaşılan diziler üzerinde vektörel değerlendirir."""
+    a = {name: arr for name, (_, arr) in _SWEEP_SHM.items()}
+    rows = []
+    for combo in combos:
+        v = combo["_variant"]
+        whale = a["s_whale"] * combo["WHALE_SCALE"]
+        has_flow = a["has_flow"]
+        # struct (her zaman True) + delta + orderbook (backtest'te hep False) + whale + flow
+        count_long = (
+            1
+            + (a["delta"] >= combo["NET_DELTA_MIN_POS"])
+            + ((a["max_buy"] >= whale) & (a["max_buy"] > 0))
+            + (a["buy_ratio"] > combo["FLOW_RATIO_MIN"])
+        )
+        count_short = (
+            1
+            + (a["delta"] <= combo["NET_DELTA_MIN_NEG"])
+            + ((a["max_sell"] >= whale) & (a["max_sell"] > 0))
+            + (a["sell_ratio"] > combo["FLOW_RATIO_MIN"])
+        )
+        need = combo["MIN_CONDITIONS_STRICT"]
+        fire_long = a[f"elig_long_{v}"] & has_flow & (count_long >= need)
+        fire_short = a[f"elig_short_{v}"] & has_flow & (count_short >= need)
+        n_sig = int(fire_long.sum() + fire_short.sum())
+        rets = np.concatenate([a[f"ret_long_{v}"][fire_long], a[f"ret_short_{v}"][fire_short]])
+        outs = np.concatenate([a[f"out_long_{v}"][fire_long], a[f"out_short_{v}"][fire_short]])
+        wins = int((outs > 0).sum())
+        closed = int((outs != 0).sum())
+        row = {k: val for k, val in combo.items() if not k.startswith("_")}
+        row.update(
+            {
+                "signals": n_sig,
+                "win_rate": (wins / closed) if closed else 0.0,
+                "avg_return": float(rets.mean()) if n_sig else 0.0,
+                "total_return": float(rets.sum()) if n_sig else 0.0,
+            }
+        )
+        rows.append(row)
+    return rows
+
+
+def sweep_combinations(grid=None, mode=SWEEP_MODE, samples=SWEEP_SAMPLES, seed=0):
+    grid = grid or SWEEP_GRID
+    keys = list(grid)
+    if mode == "random":
+        rng = random.Random(seed)
+        seen = set()
+        combos = []
+        total = 1
+        for k in keys:
+            total *= len(grid[k])
+        while len(combos) < min(samples, total):
+            values = tuple(rng.choice(grid[k]) for k in keys)
+            if values not in seen:
+                seen.add(values)
+                combos.append(dict(zip(keys, values)))
+        return combos
+    return [dict(zip(keys, values)) for values in itertools.product(*(grid[k] for k in keys))]
+
+
+def run_sweep(symbols=None, grid=None, mode=SWEEP_MODE, workers=BACKTEST_WORKERS, fetch=True):
+    """
+    Strateji eşikleri üzerinde grid / random arama. Piyasa verisi bir kez yüklenir,
+    eşikten bağımsız özellikler bir kez hesaplanıp shared memory'ye konur ve
+    kombinasyonlar tüm çekirdeklerde değerlendirilir. Sıralı tablo SWEEP_RESULTS_PATH'e yazılır.
+    """
+    if np is None:
+        print("Parametre taraması için NumPy gerekli.")
+        return None
+    store = get_candle_store()
+    if store is None:
+        print("Parametre taraması için CANDLE_DB_PATH gerekli.")
+        return None
+    if not MCAP_CACHE:
+        ensure_mcap_cache(background=False)
+    if symbols is None:
+        symbols = get_spot_usdt_top_symbols(limit=TOP_LIMIT)
+    grid = grid or SWEEP_GRID
+    if fetch:
+        jobs = [(inst_id, "4H", BACKTEST_BARS_4H) for inst_id in symbols]
+        jobs.append(("BTC-USDT", "1H", BACKTEST_BARS_4H * 4))
+        with ThreadPoolExecutor(max_workers=max(1, SCAN_WORKERS)) as pool:
+            list(pool.map(lambda j: store.backfill(*j), jobs))
+
+    t0 = time.perf_counter()
+    bias_by_ts = backtest_bias_timeline(store)
+    variants = sorted(
+        set(
+            itertools.product(
+                grid.get("STRUCT_LOOKBACK_4H", [STRUCT_LOOKBACK_4H]), grid.get("ZONE_BUFFER", [ZONE_BUFFER])
             )
-            lines.append(f"- Whale: {whale_str}")
-            lines.append(f"- Güven: *%{s['confidence']}*")
-            lines.append(
-                f"- 🎯 TP1/TP2/TP3: `{s['tp1']:.4f} / {s['tp2']:.4f} / {s['tp3']:.4f}`"
+        )
+    )
+    mcap = dict(MCAP_CACHE)
+    with ProcessPoolExecutor(max_workers=max(1, workers)) as pool:
+        parts = list(pool.map(_sweep_symbol_worker, [(i, store.path, mcap, bias_by_ts, variants) for i in symbols]))
+    t_features = time.perf_counter() - t0
+
+    # Tüm sembolleri tek boyutlu bar eksenine birleştir → shared memory
+    arrays = {name: np.concatenate([p["flow"][name] for p in parts]) for name in parts[0]["flow"]}
+    for vi, variant in enumerate(variants):
+        for name in parts[0]["variants"][variant]:
+            arrays[f"{name}_{vi}"] = np.concatenate([p["variants"][variant][name] for p in parts])
+    meta = {}
+    blocks = []
+    try:
+        for name, arr in arrays.items():
+            _shm_put(name, arr, meta, blocks)
+
+        combos = sweep_combinations(grid, mode=mode)
+        for combo in combos:
+            variant = (
+                combo.get("STRUCT_LOOKBACK_4H", STRUCT_LOOKBACK_4H),
+                combo.get("ZONE_BUFFER", ZONE_BUFFER),
             )
-            lines.append(f"- 🛑 Stop: `{s['stop']:.4f}`")
+            combo["_variant"] = variants.index(variant)
+            for key, default in (
+                ("NET_DELTA_MIN_POS", NET_DELTA_MIN_POS),
+                ("NET_DELTA_MIN_NEG", NET_DELTA_MIN_NEG),
+                ("MIN_CONDITIONS_STRICT", MIN_CONDITIONS_STRICT),
+                ("FLOW_RATIO_MIN", FLOW_RATIO_MIN),
+                ("WHALE_SCALE", WHALE_SCALE),
+            ):
+                combo.setdefault(key, default)
+
+        t1 = time.perf_counter()
+        chunks = [combos[i:i + SWEEP_CHUNK] for i in range(0, len(combos), SWEEP_CHUNK)]
+        rows = []
+        with ProcessPoolExecutor(max_workers=max(1, workers), initializer=_sweep_attach, initargs=(meta,)) as pool:
+            for part in pool.map(_sweep_eval, chunks):
+                rows.extend(part)
+        t_eval = time.perf_counter() - t1
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+
+    rows.sort(key=lambda r: (r["signals"] >= SWEEP_MIN_SIGNALS, r["total_return"], r["win_rate"]), reverse=True)
+    for rank, row in enumerate(rows, start=1):
+        row["rank"] = rank
+    if SWEEP_RESULTS_PATH and rows:
+        fields = ["rank"] + [k for k in rows[0] if k != "rank"]
+        with open(SWEEP_RESULTS_PATH, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(rows)
+    bars = int(arrays["delta"].shape[0])
+    print(
+        f"Sweep: {len(symbols)} sembol, {bars} bar, {len(variants)} yapı varyantı, "
+        f"{len(rows)} kombinasyon — özellikler {t_features:.1f} sn, değerlendirme {t_eval:.1f} sn "
+        f"({len(rows) / t_eval if t_eval > 0 else 0:.0f} komb/sn)"
+    )
+    return rows
+
+
+# ========== RUN RAPORU ==========
+
+def build_run_report(started_at, wall_s, scan=None, counts=None, alerts=None, signal_tracking=None):
+    """
+    Run sonunda makine-okunur rapor: aşama / fetcher / analizör span'leri, uç başına HTTP
+    istek / bayt / hata / retry sayıları ve gecikme yüzdelikleri, snapshot ve mum deposu sayaçları.
+    """
+    http = {}
+    latencies = METRICS.summary("http:")
+    for endpoint, st in TRANSPORT.stats().items():
+        lat = latencies.get("http:" + endpoint, {})
+        http[endpoint] = {
+            "requests": st["requests"],
+            "errors": st["errors"],
+            "retries": st["retries"],
+            "rate_limited": st["rate_limited"],
+            "bytes": st["bytes"],
+            "p50_s": lat.get("p50_s", 0.0),
+            "p95_s": lat.get("p95_s", 0.0),
+            "p99_s": lat.get("p99_s", 0.0),
+            "max_s": st["latency_max_s"],
+        }
+    spans = {k: v for k, v in METRICS.summary().items() if not k.startswith("http:")}
+    store = get_candle_store()
+    return {
+        "started_at": datetime.fromtimestamp(started_at, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "started_ts": started_at,
+        "wall_s": wall_s,
+        "counts": counts or {},
+        "scan": scan or {},
+        "alerts": alerts or {},
+        "signal_tracking": signal_tracking or {},
+        "spans": spans,
+        "http": http,
+        "pipeline": {tf: dict(st) for tf, st in PIPELINE_STATS.items()},
+        "snapshot": SNAPSHOT.stats() if SNAPSHOT is not None else {},
+        "candle_store": store.stats() if store is not None else {},
+        "analysis_cache": ANALYSIS_CACHE.stats() if ANALYSIS_CACHE is not None else {},
+    }
 
-    if not pre_signals and not signals_4h:
-        lines.append("\n_Bu saatte yeni pre-signal veya kesin sinyal yok._")
 
-    lines.append(f"\n_Zaman:_ `{ts()}`")
-    return "\n".join(lines)
+def _prom_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def prometheus_text(report, prefix=METRICS_PREFIX):
+    """Raporu node_exporter textfile collector formatına çevirir (gauge + summary)."""
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f"# HELP {prefix}_{name} {help_text}")
+        lines.append(f"# TYPE {prefix}_{name} {kind}")
+        for suffix, labels, value in samples:
+            label_txt = ",".join(f'{k}="{_prom_label(v)}"' for k, v in labels.items())
+            lines.append(f"{prefix}_{name}{suffix}{{{label_txt}}} {value}" if label_txt else f"{prefix}_{name}{suffix} {value}")
+
+    metric("run_timestamp_seconds", "gauge", "Son run başlangıcı (unix).", [("", {}, report["started_ts"])])
+    metric("run_wall_seconds", "gauge", "Son run toplam süresi.", [("", {}, report["wall_s"])])
+    metric(
+        "run_count",
+        "gauge",
+        "Son run sayaçları (sembol, sinyal).",
+        [("", {"kind": k}, v) for k, v in sorted(report["counts"].items())],
+    )
+
+    alerts = report.get("alerts") or {}
+    if alerts.get("first_alert_s") is not None:
+        metric(
+            "first_alert_seconds",
+            "gauge",
+            "Run başından ilk Telegram uyarısının gönderilmesine kadar geçen süre.",
+            [("", {}, alerts["first_alert_s"])],
+        )
+
+    span_samples = []
+    for name, st in report["spans"].items():
+        for q in ("50", "95", "99"):
+            span_samples.append(("", {"span": name, "quantile": f"0.{q}"}, st[f"p{q}_s"]))
+        span_samples.append(("_sum", {"span": name}, st["total_s"]))
+        span_samples.append(("_count", {"span": name}, st["count"]))
+    metric("span_seconds", "summary", "Span süreleri (aşama / fetcher / analizör).", span_samples)
+
+    lat_samples = []
+    for endpoint, st in sorted(report["http"].items()):
+        for q in ("50", "95", "99"):
+            lat_samples.append(("", {"endpoint": endpoint, "quantile": f"0.{q}"}, st[f"p{q}_s"]))
+    metric("http_latency_seconds", "summary", "Uç başına HTTP gecikmesi.", lat_samples)
+    for field in ("requests", "errors", "retries", "rate_limited", "bytes"):
+        metric(
+            f"http_{field}",
+            "gauge",
+            f"Son run'da uç başına HTTP {field}.",
+            [("", {"endpoint": e}, st[field]) for e, st in sorted(report["http"].items())],
+        )
+    return "\n".join(lines) + "\n"
+
+
+def write_run_report(report):
+    """RUN_REPORT_PATH'e JSON, PROMETHEUS_TEXTFILE doluysa .prom yazar (atomik rename)."""
+    if RUN_REPORT_PATH:
+        with open(RUN_REPORT_PATH, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Run raporu: {RUN_REPORT_PATH}")
+    if PROMETHEUS_TEXTFILE:
+        tmp = PROMETHEUS_TEXTFILE + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(prometheus_text(report))
+        # Collector yarım dosya okumasın
+        os.replace(tmp, PROMETHEUS_TEXTFILE)
 
 
 # ========== MAIN ==========
 
 def main():
+    global SNAPSHOT
     print(f"[{ts()}] PREMIUM PRO bot çalışıyor...")
+    run_started = time.time()
+    t_run = time.perf_counter()
+    deadline = time.monotonic() + SCAN_DEADLINE_S if SCAN_DEADLINE_S > 0 else None
+
+    # Bu run boyunca her endpoint/instId/parametre yalnızca bir kez çekilir
+    SNAPSHOT = MarketSnapshot()
+    PIPELINE_STATS.clear()
+    METRICS.reset()
 
-    # 1) MCAP haritasını hazırla
-    print("CoinGecko'dan market cap verileri çekiliyor...")
-    build_mcap_cache()
+    # 1) MCAP haritasını hazırla (disk cache; eskiyse tarama ile eşzamanlı arka planda yenilenir)
+    with span("stage.mcap_cache"):
+        mcap_refresh = ensure_mcap_cache(background=True)
 
     # 2) BTC & ETH piyasa özeti
-    btc_info = get_trend_summary("BTC-USDT")
-    eth_info = get_trend_summary("ETH-USDT")
+    with span("stage.trend_summary"):
+        btc_info = get_trend_summary("BTC-USDT")
+        eth_info = get_trend_summary("ETH-USDT")
 
     market_bias = get_market_bias(btc_info, eth_info)
     print("Market bias:", market_bias)
 
-    # 3) Top 150 USDT spot listesi
-    symbols = get_spot_usdt_top_symbols(limit=TOP_LIMIT)
+    # 3) Top 150 USDT spot listesi (ya da tüm USDT evreninden ticker ön-filtresiyle ilk K)
+    with span("stage.top_symbols"):
+        if PREFILTER_TOP_K > 0:
+            symbols = prefilter_symbols(PREFILTER_TOP_K)
+            print(f"Ön-filtre: {len(get_spot_usdt_tickers())} USDT paritesi skorlandı → ilk {len(symbols)} derin analize")
+        else:
+            symbols = get_spot_usdt_top_symbols(limit=TOP_LIMIT)
     if not symbols:
         print("Top USDT listesi alınamadı.")
+        if mcap_refresh is not None:
+            mcap_refresh.join(MCAP_REFRESH_JOIN_S)
         return
     print(f"{len(symbols)} sembol taranıyor...")
 
-    pre_signals = []
-    signals_4h = []
+    deriv_matched = 0
+    if DERIV_ENRICH:
+        with span("stage.derivatives"):
+            before = sum(st["requests"] for st in TRANSPORT.stats().values())
+            swap_ctx = get_swap_context()
+            deriv_requests = sum(st["requests"] for st in TRANSPORT.stats().values()) - before
+        deriv_matched = sum(1 for inst_id in symbols if inst_id.split("-")[0] in swap_ctx)
+        print(
+            f"Türev bağlamı: {len(swap_ctx)} USDT-SWAP, {deriv_matched}/{len(symbols)} sembol eşlendi, "
+            f"{deriv_requests} HTTP istek"
+        )
 
-    for i, inst_id in enumerate(symbols, start=1):
-        print(f"[{i}/{len(symbols)}] {inst_id} analiz ediliyor...")
-        try:
-            # 1H pre-signal
-            pres = analyze_symbol_1h_presignal(inst_id, market_bias)
-            if pres:
-                pre_signals.extend(pres)
+    sharded = SCAN_SHARDS > 1
+    chunked = STREAM_ALERTS and STREAM_SCAN_CHUNK > 0
+    structures = None
+    if not sharded and not chunked:
+        # Akışlı modda tüm evrenin ön-hesabı ilk uyarıyı bekletir → scan_in_chunks dilim dilim yapar
+        # Parçalı taramada ön-hesabı her worker kendi parçası için yapar
+        t0 = time.perf_counter()
+        with span("stage.structures"):
+            # Ön-hesap kalan bütçenin en fazla SCAN_PRECOMPUTE_SHARE'ini kullanır; gerisi derin analize kalır
+            struct_deadline = None
+            if deadline is not None:
+                struct_deadline = time.monotonic() + max(0.0, deadline - time.monotonic()) * SCAN_PRECOMPUTE_SHARE
+            structures = precompute_structures(symbols, deadline=struct_deadline)
+        if structures is not None:
+            print(f"Toplu yapı motoru: {len(symbols)} sembol, {time.perf_counter() - t0:.1f} sn")
+
+    # Önceki run'larda gönderilmiş (teslimi başarısız olmamış) 4H kurulumları (instId, side, mum ts)
+    # hem anlık hem özet mesajdan düşülür
+    signal_store = get_signal_store()
+    run_id = int(run_started * 1000)
+    is_new = {}  # (instId, side, mum ts) → bu run'da yeni mi (anlık akış ve özet aynı kararı kullanır)
+
+    def fresh(sigs):
+        if signal_store is None:
+            return sigs
+        out = []
+        for s in sigs:
+            key = (s["inst_id"], s["side"], s["candle_ts"])
+            if key not in is_new:
+                is_new[key] = signal_store.add(s, run_id)
+            if is_new[key]:
+                out.append(s)
+        return out
+
+    stream = SignalStream(started=t_run).start() if STREAM_ALERTS else None
+    emit = (lambda pres, sigs: stream.put(pres, fresh(sigs))) if stream is not None else None
+    with span("stage.scan"):
+        if sharded:
+            # Türev bağlamı koordinatörde bir kez çekildi; worker'lar snapshot'tan okur
+            seed = {("derivatives", "USDT-SWAP"): swap_ctx} if DERIV_ENRICH else None
+            pre_signals, signals_4h, scan_stats = scan_sharded(
+                symbols, market_bias, shards=SCAN_SHARDS, processes=SCAN_PROCESSES, deadline=deadline, emit=emit, seed=seed
+            )
+        elif chunked:
+            pre_signals, signals_4h, scan_stats = scan_in_chunks(
+                symbols, market_bias, workers=SCAN_WORKERS, deadline=deadline, emit=emit
+            )
+            print(
+                f"Toplu yapı motoru: {len(symbols)} sembol, {scan_stats['chunks']} dilim, "
+                f"{scan_stats['precompute_s']:.1f} sn (taramayla örtüşür)"
+            )
+        else:
+            pre_signals, signals_4h, scan_stats = scan_symbols(
+                symbols, market_bias, workers=SCAN_WORKERS, structures=structures, deadline=deadline, emit=emit
+            )
+    signals_4h = fresh(signals_4h)
+    if stream is not None:
+        # Bekleyen toplu uyarılar özet mesajından önce gider
+        stream.close()
+        alerts = stream.stats()
+        first = f"{alerts['first_alert_s']:.1f} sn" if alerts["first_alert_s"] is not None else "yok"
+        print(f"Akışlı uyarı: {alerts['immediate_4h']} anlık 4H, {alerts['batches']} toplu mesaj, ilk uyarı {first}")
+    print(
+        f"Tarama: {scan_stats['wall_s']:.1f} sn, {scan_stats['workers']} worker "
+        f"(sıralı tahmini {scan_stats['sequential_est_s']:.1f} sn, "
+        f"tahmini hızlanma x{scan_stats['speedup_est']:.1f})"
+    )
+    if sharded:
+        walls = [sh["wall_s"] for sh in scan_stats["shards"]]
+        print(
+            f"Parçalı tarama: {len(walls)} parça / {scan_stats['processes']} süreç, "
+            f"parça süresi min {min(walls):.1f} / max {max(walls):.1f} sn, "
+            f"{sum(sh['requests'] for sh in scan_stats['shards'])} worker HTTP isteği"
+        )
 
-            # 4H kesin sinyal
-            sigs4 = analyze_symbol_4h(inst_id, market_bias)
-            if sigs4:
-                signals_4h.extend(sigs4)
+    for line in pipeline_summary():
+        print(line)
+
+    snap = SNAPSHOT.stats()
+    print(
+        f"Snapshot: {snap['requests']} veri isteği, {snap['fetched']} HTTP, "
+        f"{snap['hits']} hit, {snap['coalesced']} birleştirildi (hit oranı %{snap['hit_rate']*100:.0f})"
+    )
+
+    store = get_candle_store()
+    if store is not None:
+        cs = store.stats()
+        print(
+            f"Mum deposu: {cs['bars_downloaded']} bar indirildi / {cs['bars_served']} bar servis edildi "
+            f"(%{cs['saved_ratio']*100:.1f} tasarruf, {cs['requests']} istek)"
+        )
 
-        except Exception as e:
-            print(f"  {inst_id} analiz hatası:", e)
+    cache = get_analysis_cache()
+    if cache is not None:
+        ac = cache.stats()
+        print(
+            f"Analiz cache: {ac['hits']} hit / {ac['misses']} miss (hit oranı %{ac['hit_rate']*100:.0f}), "
+            f"{ac['entries']} kayıt, {ac['evictions']} çıkarıldı"
+        )
+        cache.save()
+
+    outcomes = None
+    track_stats = {}
+    if signal_store is not None:
+        with span("stage.signal_tracking"):
+            outcomes, track_stats = signal_store.track(lambda inst_id: get_candles(inst_id, bar="4H", limit=CANDLE_LIMIT_4H))
+            track_stats["pruned"] = signal_store.prune()
+        print(
+            f"Sinyal deposu: {sum(is_new.values())} yeni, {len(is_new) - sum(is_new.values())} tekrar bastırıldı; "
+            f"{track_stats['tracked']} açık sinyal {track_stats['new_bars']} yeni barla ilerletildi, "
+            f"{track_stats['closed']} kapandı, {track_stats['pruned']} eski kayıt silindi"
+        )
 
-        # Çok hızlı istek atmamak için küçük bekleme
-        if i % 10 == 0:
-            time.sleep(0.2)
+    msg = build_telegram_message(
+        btc_info, eth_info, pre_signals, signals_4h, skipped=scan_stats["skipped"], outcomes=outcomes
+    )
+    telegram(msg, ref=signal_ref(signals_4h))
+    if TELEGRAM_DELIVERY is not None:
+        # Teslim arka planda sürdü; süreç bitmeden outbox'ın boşalmasını bekle (kalanlar diskte kalır)
+        left = telegram_flush()
+        tg = TELEGRAM_DELIVERY.stats()
+        print(
+            f"✅ Telegram: {tg['sent']} parça gönderildi, {tg['retries']} retry, "
+            f"{tg['rate_limited']} rate-limit, {tg['dropped']} bırakıldı, {tg['expired']} eskidi, {left} outbox'ta bekliyor"
+        )
 
-    msg = build_telegram_message(btc_info, eth_info, pre_signals, signals_4h)
-    telegram(msg)
-    print("✅ Telegram'a mesaj gönderildi.")
+    if mcap_refresh is not None:
+        # Süreç bitmeden yenilenen cache diske yazılsın
+        mcap_refresh.join(MCAP_REFRESH_JOIN_S)
+
+    report = build_run_report(
+        run_started,
+        time.perf_counter() - t_run,
+        scan=scan_stats,
+        alerts=stream.stats() if stream is not None else None,
+        signal_tracking=dict(track_stats, statuses=signal_store.summary()) if signal_store is not None else None,
+        counts={
+            "symbols": len(symbols),
+            "deriv_matched": deriv_matched,
+            "skipped": len(scan_stats["skipped"]),
+            "signals_suppressed": len(is_new) - sum(is_new.values()),
+            "pre_signals": len(pre_signals),
+            "signals_4h": len(signals_4h),
+        },
+    )
+    for endpoint, st in sorted(report["http"].items()):
+        print(
+            f"HTTP {endpoint}: {st['requests']} istek, {st['bytes'] / 1024:.0f} KB, "
+            f"p50 {st['p50_s']*1000:.0f} / p95 {st['p95_s']*1000:.0f} / p99 {st['p99_s']*1000:.0f} ms, "
+            f"{st['errors']} hata, {st['retries']} retry, {st['rate_limited']} rate-limit"
+        )
+    for stage in ("mcap_cache", "trend_summary", "top_symbols", "derivatives", "structures", "scan", "signal_tracking"):
+        st = report["spans"].get("stage." + stage)
+        if st:
+            print(f"Aşama {stage}: {st['total_s']:.2f} sn")
+    write_run_report(report)
+    return {"scan": scan_stats, "pre_signals": len(pre_signals), "signals_4h": len(signals_4h)}
+
+
+def cli(argv):
+    """
+    Kullanım:
+      python3 main_premium_pro.py                     → tek seferlik tarama (cron)
+      python3 main_premium_pro.py live [sn]           → WebSocket canlı mod (opsiyonel süre sınırı)
+      python3 main_premium_pro.py ws-replay kayit.jsonl [port] [hız]
+      python3 main_premium_pro.py backtest [bar_sayısı]  → depodaki 4H geçmişte sinyal backtest'i
+      python3 main_premium_pro.py sweep [grid|random]   → strateji eşikleri üzerinde parametre taraması
+      python3 main_premium_pro.py verify-resample [bar] [instId ...]  → 1H'den türetilen barları OKX ile karşılaştır
+    Benchmark ayrı modülde: python3 bench.py [koşu] [--update-baseline]
+    """
+    mode = argv[0] if argv else "scan"
+    if mode == "scan":
+        main()
+    elif mode == "live":
+        run_live(max_runtime_s=float(argv[1]) if len(argv) > 1 else None)
+    elif mode == "backtest":
+        run_backtest(bars=int(argv[1]) if len(argv) > 1 else BACKTEST_BARS_4H)
+    elif mode == "sweep":
+        run_sweep(mode=argv[1] if len(argv) > 1 else SWEEP_MODE)
+    elif mode == "verify-resample":
+        bar = argv[1] if len(argv) > 1 else "4H"
+        for inst_id in argv[2:] or ["BTC-USDT", "ETH-USDT"]:
+            res = verify_resample(inst_id, bar)
+            print(
+                f"{inst_id} {bar}: {res['compared']} bar karşılaştırıldı, "
+                f"{len(res['mismatches'])} uyuşmazlık, {len(res['missing'])} eksik"
+            )
+            for t, field, a, b in res["mismatches"][:10]:
+                print(f"  {t} {field}: OKX {a} / yerel {b}")
+    elif mode == "ws-replay" and len(argv) > 1:
+        port = int(argv[2]) if len(argv) > 2 else 8765
+        speed = float(argv[3]) if len(argv) > 3 else 1.0
+        serve_ws_replay(argv[1], port=port, speed=speed)
+    else:
+        print(cli.__doc__)
 
 
 if __name__ == "__main__":
-    main()
+    cli(sys.argv[1:])
@@ -0,0 +1,35 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bench  # noqa: E402
+import main_premium_pro as bot  # noqa: E402
+
+
+@pytest.fixture
+def mock_api(monkeypatch, tmp_path):
+    """
+    Yerel MockApiServer + temiz modül durumu: disk depoları kapalı, hız sınırı gevşek,
+    her test kendi snapshot / transport'u ile başlar.
+    """
+    srv = bench.MockApiServer(latency_ms=0).start()
+    monkeypatch.setattr(bot, "OKX_BASE", srv.base_url)
+    monkeypatch.setattr(bot, "COINGECKO", srv.base_url + "/api/v3")
+    monkeypatch.setattr(bot, "TELEGRAM_API", srv.base_url)
+    monkeypatch.setattr(bot, "TELEGRAM_TOKEN", "test")
+    monkeypatch.setattr(bot, "CHAT_ID", "test")
+    for name in ("CANDLE_DB_PATH", "ANALYSIS_CACHE_PATH", "MCAP_CACHE_PATH", "SIGNAL_DB_PATH",
+                 "TELEGRAM_OUTBOX_PATH", "RUN_REPORT_PATH", "PROMETHEUS_TEXTFILE", "HTTP_RECORD_PATH"):
+        monkeypatch.setattr(bot, name, "")
+    monkeypatch.setattr(bot, "RATE_LIMITS", {k: (100_000, 1.0) for k in bot.RATE_LIMITS})
+    monkeypatch.setattr(bot, "TRANSPORT", bot.HttpTransport())
+    monkeypatch.setattr(bot, "SNAPSHOT", bot.MarketSnapshot())
+    monkeypatch.setattr(bot, "CANDLE_STORE", None)
+    monkeypatch.setattr(bot, "ANALYSIS_CACHE", None)
+    monkeypatch.setattr(bot, "MCAP_CACHE", {})
+    monkeypatch.setattr(bot, "PIPELINE_STATS", {})
+    yield srv
+    srv.stop()
@@ -0,0 +1,73 @@
+import random
+
+import pytest
+
+from conftest import bot
+
+
+def _series(n, seed=0):
+    rng = random.Random(seed)
+    rows = []
+    px = 100.0
+    for k in range(n):
+        o = px
+        c = px * (1 + rng.uniform(-0.03, 0.03))
+        rows.append((k * bot.BAR_MS["4H"], o, max(o, c) * (1 + rng.uniform(0, 0.01)),
+                     min(o, c) * (1 - rng.uniform(0, 0.01)), c, 1.0, c, 1))
+        px = c
+    return bot.CandleSeries.from_rows(rows)
+
+
+@pytest.fixture
+def analysis_cache(monkeypatch, tmp_path):
+    monkeypatch.setattr(bot, "ANALYSIS_CACHE_PATH", str(tmp_path / "analysis_cache.json"))
+    monkeypatch.setattr(bot, "ANALYSIS_CACHE", None)
+    return bot.get_analysis_cache()
+
+
+def test_cached_indicators_match_window_ema_on_sliding_windows(analysis_cache):
+    full = _series(700)
+    for end in range(300, 700, 7):
+        window = full[end - 300:end]
+        closes = window.close
+        assert bot.cached_ema("BTC-USDT", "4H", window, 200) == bot.ema(closes, 200)
+        f, s, m = bot.cached_macd("BTC-USDT", "4H", window)
+        assert (f, s) == (bot.ema(closes, 12), bot.ema(closes, 26))
+        assert m == f - s
+    # Aynı pencere ikinci kez → cache'ten
+    hits = analysis_cache.stats()["hits"]
+    bot.cached_ema("BTC-USDT", "4H", full[:300], 200)
+    bot.cached_ema("BTC-USDT", "4H", full[:300], 200)
+    assert analysis_cache.stats()["hits"] > hits
+
+
+def test_cached_structure_matches_compute_structure_across_runs(analysis_cache, tmp_path):
+    full = _series(600, seed=3)
+    for end in range(200, 600, 3):
+        window = full[end - 150:end]
+        assert bot.cached_structure("ETH-USDT", "4H", window, 20) == bot.compute_structure(window, 20)
+    analysis_cache.save()
+    # Diskten geri yüklenen durum da aynı sonucu vermeli
+    bot.ANALYSIS_CACHE = None
+    window = full[450:600]
+    assert bot.cached_structure("ETH-USDT", "4H", window, 20) == bot.compute_structure(window, 20)
+
+
+def test_precompute_reuses_structure_states_across_runs(mock_api, monkeypatch, tmp_path):
+    monkeypatch.setattr(bot, "ANALYSIS_CACHE_PATH", str(tmp_path / "analysis_cache.json"))
+    monkeypatch.setattr(bot, "ANALYSIS_CACHE", None)
+    symbols = bot.get_spot_usdt_top_symbols()[:20]
+    first = bot.precompute_structures(symbols)
+    assert bot.get_analysis_cache().stats()["hits"] == 0
+    bot.get_analysis_cache().save()
+
+    # Sonraki run: yeni süreç gibi boş snapshot, cache diskten
+    bot.SNAPSHOT = bot.MarketSnapshot()
+    bot.ANALYSIS_CACHE = None
+    second = bot.precompute_structures(symbols)
+    stats = bot.get_analysis_cache().stats()
+    assert stats["hits"] == 2 * len(symbols) and stats["misses"] == 0
+    assert second == first
+    for inst_id in symbols:
+        candles = bot.get_candles(inst_id, bar="4H", limit=bot.CANDLE_LIMIT_4H)
+        assert second["4h"][inst_id] == bot.compute_structure(candles, bot.STRUCT_LOOKBACK_4H)
@@ -0,0 +1,36 @@
+from conftest import bot
+
+
+def test_blank_fields_mean_no_derivatives_context(monkeypatch):
+    responses = {
+        "/api/v5/public/funding-rate": [
+            {"instId": "AAA-USDT-SWAP", "fundingRate": "-0.0001"},
+            {"instId": "BBB-USDT-SWAP", "fundingRate": ""},
+            {"instId": "CCC-USDT-SWAP", "fundingRate": "-0.0001"},
+        ],
+        "/api/v5/public/open-interest": [
+            {"instId": "AAA-USDT-SWAP", "oiUsd": ""},
+            {"instId": "BBB-USDT-SWAP", "oiUsd": "5000000000"},
+            {"instId": "CCC-USDT-SWAP", "oiUsd": "5000000000"},
+        ],
+        "/api/v5/market/tickers": [
+            {"instId": "AAA-USDT-SWAP", "last": "10.1"},
+            {"instId": "BBB-USDT-SWAP", "last": "10.1"},
+            {"instId": "CCC-USDT-SWAP", "last": "10.1"},
+        ],
+    }
+    monkeypatch.setattr(bot, "SNAPSHOT", bot.MarketSnapshot())
+    monkeypatch.setattr(bot, "okx_jget", lambda path, params=None: responses[path])
+    monkeypatch.setattr(bot, "get_spot_usdt_tickers", lambda: [
+        {"instId": "AAA-USDT", "last": "10"}, {"instId": "BBB-USDT", "last": "10"}, {"instId": "CCC-USDT", "last": ""},
+    ])
+    ctx = bot.fetch_swap_context()
+
+    # Boş oiUsd / fundingRate → None, NaN değil; türev koşulları hiç eklenmez
+    assert ctx["AAA"]["oi_usd"] is None and ctx["BBB"]["funding"] is None
+    for base in ("AAA", "BBB"):
+        assert bot.derivative_conditions("LONG", ctx[base]) == []
+        assert bot.derivative_conditions("SHORT", ctx[base]) == []
+    # Spot fiyatı boş → basis bilinmiyor, funding koşulu yine değerlendirilir
+    assert ctx["CCC"]["basis"] is None
+    assert bot.derivative_conditions("LONG", ctx["CCC"]) == [True, False]
@@ -0,0 +1,185 @@
+import json
+import socket
+import threading
+import time
+
+import main_premium_pro as bot
+
+
+def test_ws_frame_roundtrip():
+    a, b = socket.socketpair()
+    try:
+        for n in (0, 10, 125, 126, 300, 70_000):
+            text = "x" * n
+            bot.ws_send_frame(a, 0x1, text.encode(), mask=True)  # istemci → maskeli
+            assert bot.ws_read_message(b, mask_replies=False) == text
+            bot.ws_send_frame(b, 0x1, text.encode(), mask=False)
+            assert bot.ws_read_message(a, mask_replies=True) == text
+
+        # Parçalı mesaj arasına ping: pong otomatik döner, parçalar birleşir
+        a.sendall(bytes([0x01, 0x80 | 3]) + b"\0\0\0\0" + b"abc")
+        bot.ws_send_frame(a, 0x9, b"hi", mask=True)
+        a.sendall(bytes([0x80, 0x80 | 3]) + b"\0\0\0\0" + b"def")
+        assert bot.ws_read_message(b, mask_replies=False) == "abcdef"
+        assert bot.ws_read_frame(a) == (True, 0xA, b"hi")
+    finally:
+        a.close()
+        b.close()
+
+
+def candle_message(inst_id, bar, row):
+    return json.dumps({"arg": {"channel": f"candle{bar}", "instId": inst_id}, "data": [row]})
+
+
+def write_record(path, inst_id, last_ts):
+    """Açık barın güncellemesi + yeni 4H barın açılışı (önceki bar kapanır)."""
+    step = bot.BAR_MS["4H"]
+    rows = [
+        [str(last_ts), "10", "11", "9", "10.5", "100", "1000", "1000", "0"],
+        [str(last_ts + step), "10.5", "10.6", "10.4", "10.5", "1", "10", "10", "0"],
+    ]
+    with open(path, "w", encoding="utf-8") as f:
+        for k, row in enumerate(rows):
+            rec = {"t": k * 0.01, "path": "/ws/v5/business", "msg": candle_message(inst_id, "4H", row)}
+            f.write(json.dumps(rec) + "\n")
+
+
+def test_replay_evaluates_closed_bar(mock_api, monkeypatch, tmp_path):
+    monkeypatch.setattr(bot, "LIVE_EVAL_DEBOUNCE_S", 0.1)
+    inst_id = bot.get_spot_usdt_top_symbols()[0]
+    calls = []
+
+    def spy(inst, bias, structure=None, now_ms=None):
+        if inst == inst_id:
+            last = bot.get_candles(inst, bar="4H", limit=bot.CANDLE_LIMIT_4H)[-1]
+            calls.append((last["ts"], last["close"], now_ms))
+        return []
+
+    monkeypatch.setattr(bot, "analyze_symbol_4h", spy)
+    scanner = bot.LiveScanner([inst_id], record_path=str(tmp_path / "rec.jsonl"), notify=False)
+    scanner.bootstrap(workers=2)
+    last_ts = scanner.state[inst_id].candles["4H"][-1][0]
+    write_record(tmp_path / "replay.jsonl", inst_id, last_ts)
+
+    srv = bot.WsReplayServer(str(tmp_path / "replay.jsonl")).start()
+    try:
+        scanner.urls = {"public": srv.url("/ws/v5/public"), "business": srv.url("/ws/v5/business")}
+        scanner.run(max_runtime_s=2.0)
+    finally:
+        srv.stop()
+
+    # Olay yeni barın açılışında, değerlendirme kapanan bar (son güncellemesiyle) üzerinde
+    assert calls == [(last_ts, 10.5, last_ts)]
+    assert [bar for bar, _, _ in scanner.signals] == ["4H"]
+    recorded = [json.loads(line) for line in open(tmp_path / "rec.jsonl", encoding="utf-8")]
+    assert [r["msg"] for r in recorded if r["path"] == "/ws/v5/business" and "data" in r["msg"]] == [
+        json.loads(line)["msg"] for line in open(tmp_path / "replay.jsonl", encoding="utf-8")
+    ]
+
+
+def test_reader_reconnects_after_connection_error(monkeypatch, tmp_path):
+    monkeypatch.setattr(bot, "BACKOFF_BASE_S", 0.01)
+    monkeypatch.setattr(bot, "BACKOFF_MAX_S", 0.01)
+    probe = socket.socket()
+    probe.bind(("127.0.0.1", 0))
+    port = probe.getsockname()[1]
+    probe.close()
+
+    write_record(tmp_path / "replay.jsonl", "AAA-USDT", 0)
+    scanner = bot.LiveScanner(["AAA-USDT"], record_path="", notify=False)
+    scanner.urls["business"] = f"ws://127.0.0.1:{port}/ws/v5/business"
+    reader = threading.Thread(target=scanner._reader, args=("business",), daemon=True)
+    reader.start()
+    time.sleep(0.3)  # sunucu yok → bağlantı hatası + backoff
+    assert scanner.messages == 0
+
+    srv = bot.WsReplayServer(str(tmp_path / "replay.jsonl"), port=port).start()
+    try:
+        deadline = time.monotonic() + 5
+        while scanner.messages < 2 and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        scanner.stop()
+        reader.join(timeout=5)
+        srv.stop()
+    assert scanner.messages == 2
+    assert scanner._events.get_nowait() == ("4H", "AAA-USDT", bot.BAR_MS["4H"])
+
+
+def test_live_signals_deduped_through_signal_store(mock_api, monkeypatch, tmp_path):
+    monkeypatch.setattr(bot, "SIGNAL_DB_PATH", str(tmp_path / "signals.sqlite"))
+    monkeypatch.setattr(bot, "SIGNAL_STORE", None)
+    inst_id = bot.get_spot_usdt_top_symbols()[0]
+
+    def fake_4h(inst, bias, structure=None, now_ms=None):
+        last = bot.get_candles(inst, bar="4H", limit=bot.CANDLE_LIMIT_4H)[-1]
+        return [{"inst_id": inst, "side": "LONG", "candle_ts": last["ts"], "last_close": last["close"],
+                 "stop": last["close"] * 0.9, "tp1": last["close"] * 1.1, "tp2": last["close"] * 1.2,
+                 "tp3": last["close"] * 1.3, "confidence": 80}]
+
+    sent = []
+    monkeypatch.setattr(bot, "analyze_symbol_4h", fake_4h)
+    monkeypatch.setattr(bot, "build_telegram_message", lambda *args, **kwargs: "mesaj")
+    monkeypatch.setattr(bot, "telegram", lambda msg, ref=None: sent.append(ref))
+    scanner = bot.LiveScanner([inst_id], record_path="", notify=True)
+    scanner.bootstrap(workers=2)
+    opened = scanner.state[inst_id].candles["4H"][-1][0] + bot.BAR_MS["4H"]
+
+    _, first = scanner.evaluate("4H", [inst_id], opened)
+    _, again = scanner.evaluate("4H", [inst_id], opened)
+    # REST taramasıyla aynı anahtar: sinyalin verildiği (yeni açılan) bar
+    assert [s["candle_ts"] for s in first] == [opened]
+    assert again == []
+    assert sent == [bot.signal_ref(first)]
+    assert bot.get_signal_store().summary() == {"open": 1}
+    bot.get_signal_store().close()
+
+
+def test_reconnect_mid_bar_resyncs_before_bar_close(mock_api, monkeypatch, tmp_path):
+    monkeypatch.setattr(bot, "LIVE_EVAL_DEBOUNCE_S", 0.1)
+    monkeypatch.setattr(bot, "BACKOFF_BASE_S", 0.01)
+    monkeypatch.setattr(bot, "BACKOFF_MAX_S", 0.01)
+    inst_id = bot.get_spot_usdt_top_symbols()[0]
+    calls = []
+
+    def spy(inst, bias, structure=None, now_ms=None):
+        if inst == inst_id:
+            last = bot.get_candles(inst, bar="4H", limit=bot.CANDLE_LIMIT_4H)[-1]
+            calls.append((last["ts"], now_ms))
+        return []
+
+    monkeypatch.setattr(bot, "analyze_symbol_4h", spy)
+    scanner = bot.LiveScanner([inst_id], record_path="", notify=False)
+    scanner.bootstrap(workers=2)
+    st = scanner.state[inst_id]
+    rest_rows = list(st.candles["4H"])
+    step = bot.BAR_MS["4H"]
+    # Kopmadan önceki durum iki bar geride: kopuklukta iki bar kapandı
+    del st.candles["4H"][-2:]
+    stale_ts = st.candles["4H"][-1][0]
+    forming_ts = rest_rows[-1][0]
+    assert forming_ts == stale_ts + 2 * step
+
+    row = lambda ts, close: [str(ts), "10", "11", "9", close, "1", "10", "10", "0"]  # noqa: E731
+    records = [
+        {"t": 0.0, "path": "/ws/v5/business", "msg": candle_message(inst_id, "4H", row(stale_ts, "10.2"))},
+        {"t": 0.0, "path": "/ws/v5/business", "drop": True},
+        {"t": 0.0, "path": "/ws/v5/business", "msg": candle_message(inst_id, "4H", row(forming_ts, "10.4"))},
+    ]
+    with open(tmp_path / "replay.jsonl", "w", encoding="utf-8") as f:
+        for rec in records:
+            f.write(json.dumps(rec) + "\n")
+
+    srv = bot.WsReplayServer(str(tmp_path / "replay.jsonl")).start()
+    try:
+        scanner.urls = {"public": srv.url("/ws/v5/public"), "business": srv.url("/ws/v5/business")}
+        scanner.run(max_runtime_s=3.0)
+    finally:
+        srv.stop()
+
+    # Kaçırılan barlar REST'ten dolduruldu, ilk push yeni barın güncellemesi (kapanış değil)
+    rows = st.candles["4H"]
+    assert rows[:-1] == rest_rows[:-1]
+    assert rows[-1][4] == 10.4
+    # Tek değerlendirme: REST'ten gelen son kapanan bar üzerinde (bayat satırdan değil)
+    assert calls == [(forming_ts - step, forming_ts - step)]
@@ -0,0 +1,72 @@
+import json
+import zlib
+
+import main_premium_pro as bot
+
+
+def okx_checksum(bids, asks):
+    """OKX dokümanındaki tanımla bağımsız checksum: ilk 25 seviye bid:ask sırasıyla, CRC32 (signed)."""
+    parts = []
+    for i in range(25):
+        if i < len(bids):
+            parts.append(f"{bids[i][0]}:{bids[i][1]}")
+        if i < len(asks):
+            parts.append(f"{asks[i][0]}:{asks[i][1]}")
+    crc = zlib.crc32(":".join(parts).encode())
+    return crc - (1 << 32) if crc >= (1 << 31) else crc
+
+
+BIDS = [["100.5", "2", "0", "1"], ["100.4", "1.5", "0", "1"], ["100.2", "3", "0", "1"]]
+ASKS = [["100.6", "1", "0", "1"], ["100.8", "4", "0", "1"]]
+
+
+def snapshot(seq=10):
+    return {"bids": BIDS, "asks": ASKS, "ts": "1", "seqId": seq, "checksum": okx_checksum(BIDS, ASKS)}
+
+
+def test_checksum_snapshot_and_delta():
+    book = bot.LocalOrderBook()
+    assert book.apply_snapshot(snapshot())
+    # 100.4 silinir, 100.45 eklenir, 100.6 güncellenir
+    bids = [["100.5", "2"], ["100.45", "7"], ["100.2", "3"]]
+    asks = [["100.6", "0.5"], ["100.8", "4"]]
+    delta = {"bids": [["100.4", "0", "0", "0"], ["100.45", "7", "0", "1"]], "asks": [["100.6", "0.5", "0", "1"]],
+             "prevSeqId": 10, "seqId": 11, "checksum": okx_checksum(bids, asks)}
+    assert book.apply_update(delta)
+    assert book.top("bid", 3) == [tuple(b) for b in bids]
+
+    bad = dict(delta, prevSeqId=11, seqId=12, bids=[], asks=[["100.8", "5", "0", "1"]], checksum=123)
+    assert not book.apply_update(bad) and not book.valid
+
+    gap = bot.LocalOrderBook()
+    gap.apply_snapshot(snapshot())
+    assert not gap.apply_update(dict(delta, prevSeqId=9))
+
+
+class RecordingClient:
+    def __init__(self):
+        self.sent = []
+
+    def send(self, text):
+        self.sent.append(json.loads(text))
+
+
+def test_resync_sends_one_resubscribe_until_snapshot():
+    scanner = bot.LiveScanner(["AAA-USDT"], notify=False)
+    client = RecordingClient()
+    scanner._clients["public"] = client
+    arg = {"channel": "books", "instId": "AAA-USDT"}
+
+    def msg(action, d):
+        return json.dumps({"arg": arg, "action": action, "data": [d]})
+
+    scanner.handle_message("public", msg("snapshot", snapshot()))
+    broken = {"bids": [], "asks": [["100.8", "5", "0", "1"]], "prevSeqId": 10, "seqId": 11, "checksum": 1}
+    for seq in range(11, 21):
+        scanner.handle_message("public", msg("update", dict(broken, prevSeqId=seq - 1, seqId=seq)))
+    assert [m["op"] for m in client.sent] == ["unsubscribe", "subscribe"]
+    assert scanner.state["AAA-USDT"].resync_pending
+
+    scanner.handle_message("public", msg("snapshot", snapshot(seq=30)))
+    st = scanner.state["AAA-USDT"]
+    assert st.book.valid and not st.resync_pending
@@ -0,0 +1,34 @@
+import main_premium_pro as bot
+
+HOUR_MS = 60 * 60_000
+WINDOWS = {"5m": 5 * 60_000, "1h": HOUR_MS}
+
+
+def test_backfill_flags_truncated_window(mock_api):
+    flow = bot.RollingOrderFlow(windows=WINDOWS)
+    res = flow.backfill("BTC-USDT", now_ms=mock_api.anchor_ms, max_pages=5)
+    # Mock trade'leri 500 ms aralıklı: 5 sayfa = 500 trade ≈ 4 dk < 1 saatlik pencere
+    assert res["pages"] == 5 and res["truncated"]
+    hour = flow.query("BTC-USDT", "1h", 1e9, 1e9, 1e9, now_ms=mock_api.anchor_ms)
+    assert hour["truncated"] and hour["trades"] == 500
+
+    full = bot.RollingOrderFlow(windows={"5m": 5 * 60_000})
+    res = full.backfill("BTC-USDT", now_ms=mock_api.anchor_ms, max_pages=20)
+    assert not res["truncated"] and res["pages"] == 7
+    five = full.query("BTC-USDT", "5m", 1e9, 1e9, 1e9, now_ms=mock_api.anchor_ms)
+    assert not five["truncated"] and five["trades"] == 5 * 60 * 2
+
+
+def test_backfill_resumes_from_stored_cursor(mock_api, monkeypatch, tmp_path):
+    monkeypatch.setattr(bot, "CANDLE_DB_PATH", str(tmp_path / "candles.sqlite"))
+    first = bot.RollingOrderFlow(windows=WINDOWS)
+    first.backfill("BTC-USDT", now_ms=mock_api.anchor_ms, max_pages=5)
+    expected = first.query("BTC-USDT", "1h", 1e9, 1e9, 1e9, now_ms=mock_api.anchor_ms)
+
+    # Sonraki run: yeni süreç gibi boş agregatör, depo aynı → imlece tek sayfada bağlanır
+    second = bot.RollingOrderFlow(windows=WINDOWS)
+    res = second.backfill("BTC-USDT", now_ms=mock_api.anchor_ms, max_pages=5)
+    assert res["pages"] == 1 and res["added"] == 500
+    got = second.query("BTC-USDT", "1h", 1e9, 1e9, 1e9, now_ms=mock_api.anchor_ms)
+    assert got["trades"] == expected["trades"] and got["truncated"]
+    assert abs(got["net_delta"] - expected["net_delta"]) < 1e-6
@@ -0,0 +1,63 @@
+import random
+
+from conftest import bot
+
+HOUR = bot.BAR_MS["1H"]
+
+
+def _hourly(n, start_ms, seed=0, last_confirmed=True):
+    rng = random.Random(seed)
+    rows = []
+    px = 100.0
+    for k in range(n):
+        o = px
+        c = px * (1 + rng.uniform(-0.01, 0.01))
+        h = max(o, c) * (1 + rng.uniform(0, 0.005))
+        l = min(o, c) * (1 - rng.uniform(0, 0.005))
+        vol = rng.uniform(1, 100)
+        confirm = 1 if (k < n - 1 or last_confirmed) else 0
+        rows.append((start_ms + k * HOUR, o, h, l, c, vol, vol * c, confirm))
+        px = c
+    return rows
+
+
+def _naive(rows, bar):
+    step, offset = bot.RESAMPLE_BARS[bar]
+    buckets = {}
+    for r in rows:
+        buckets.setdefault((r[0] - offset) // step * step + offset, []).append(r)
+    out = []
+    for t in sorted(buckets):
+        group = buckets[t]
+        if group[0][0] != t:
+            continue  # seri kovanın ortasından başladı
+        closed = len(group) == step // HOUR and group[-1][7] == 1
+        out.append((t, group[0][1], max(r[2] for r in group), min(r[3] for r in group), group[-1][4],
+                    sum(r[5] for r in group), sum(r[6] for r in group), 1 if closed else 0))
+    return out
+
+
+def test_resample_matches_naive_aggregation():
+    # 03:00 UTC başlangıç → ilk 4H ve 1D kovası eksik; son 1H onaysız → son kova forming
+    start = 1_700_000_000_000 // (24 * HOUR) * (24 * HOUR) + 3 * HOUR
+    rows = _hourly(24 * 9 + 5, start, last_confirmed=False)
+    series = bot.CandleSeries.from_rows(rows)
+    for bar in ("2H", "4H", "6H", "12H", "1D", "1Dutc"):
+        got = bot.resample_candles(series, bar)
+        want = _naive(rows, bar)
+        assert len(got) == len(want), bar
+        for k, exp in enumerate(want):
+            row = got[k]
+            assert row["ts"] == exp[0], bar
+            assert row["confirm"] == exp[7], (bar, k)
+            for field, value in zip(("open", "high", "low", "close", "volume", "vol_ccy"), exp[1:7]):
+                assert abs(row[field] - value) <= 1e-9 * max(1.0, abs(value)), (bar, k, field)
+
+
+def test_resample_without_store_pages_history(mock_api, monkeypatch):
+    # Depo yokken 1H derinliği /market/candles'ın 300 bar sınırını aşar → history-candles ile sayfalanır
+    monkeypatch.setattr(bot, "RESAMPLE_FROM_1H", {"4H"})
+    candles = bot.get_candles("ETH-USDT", bar="4H", limit=bot.CANDLE_LIMIT_4H)
+    assert len(candles) == bot.CANDLE_LIMIT_4H
+    assert bot.TRANSPORT.stats()["/api/v5/market/history-candles"]["requests"] > 0
+    assert bot.ema(list(candles.close), 200) is not None
@@ -0,0 +1,50 @@
+import main_premium_pro as bot
+
+
+def scan(symbols, workers, structures=None):
+    # Her tarama kendi snapshot'ı ile: ikinci tarama ilkinin önbelleğinden okumasın
+    bot.SNAPSHOT = bot.MarketSnapshot()
+    pres, sigs4, stats = bot.scan_symbols(symbols, "bull", workers=workers, structures=structures)
+    assert not stats["skipped"]
+    return pres, sigs4
+
+
+def test_concurrent_scan_matches_sequential(mock_api):
+    symbols = bot.get_spot_usdt_top_symbols()[:40]
+    sequential = scan(symbols, 1)
+    assert sequential[0] or sequential[1]
+    assert scan(symbols, 8) == sequential
+
+    structures = bot.precompute_structures(symbols)
+    assert scan(symbols, 8, structures) == sequential
+
+
+def test_4h_error_keeps_1h_presignals(mock_api, monkeypatch):
+    symbols = bot.get_spot_usdt_top_symbols()[:40]
+    pres, _ = scan(symbols, 1)
+    assert pres
+
+    def boom(*args, **kwargs):
+        raise RuntimeError("4H kırıldı")
+
+    monkeypatch.setattr(bot, "analyze_symbol_4h", boom)
+    assert scan(symbols, 4) == (pres, [])
+
+
+def test_chunked_scan_emits_before_universe_loaded(mock_api):
+    symbols = bot.get_spot_usdt_top_symbols()[:40]
+    sequential = scan(symbols, 1)
+
+    bot.SNAPSHOT = bot.MarketSnapshot()
+    loaded_at_first_emit = []
+
+    def emit(pres, sigs):
+        if not loaded_at_first_emit:
+            found, _ = bot.SNAPSHOT.lookup_covering(("candles", symbols[-1], "4H"), 1, count=False)
+            loaded_at_first_emit.append(found)
+
+    pres, sigs4, stats = bot.scan_in_chunks(symbols, "bull", chunk=8, workers=4, emit=emit)
+    assert (pres, sigs4) == sequential
+    assert stats["chunks"] == 5 and not stats["skipped"]
+    # İlk uyarı anında son dilimin mumları henüz çekilmemiş (tüm evren ön-hesabı beklenmez)
+    assert loaded_at_first_emit == [False]
@@ -0,0 +1,62 @@
+import time
+
+from conftest import bot
+
+
+def signal(inst_id="AAA-USDT", side="LONG", candle_ts=1_700_000_000_000):
+    return {"inst_id": inst_id, "side": side, "candle_ts": candle_ts, "last_close": 10.0, "stop": 9.0,
+            "tp1": 11.0, "tp2": 12.0, "tp3": 13.0, "confidence": 80}
+
+
+def test_dedupe_only_suppresses_delivered_or_queued(tmp_path):
+    store = bot.SignalStore(str(tmp_path / "signals.sqlite"))
+    sig = signal()
+    key = [sig["inst_id"], sig["side"], sig["candle_ts"]]
+    assert store.add(sig, 1)
+    assert not store.add(sig, 2)  # kuyrukta → bastırılır
+
+    store.record_delivery([key], False)
+    assert store.add(sig, 3)  # teslim başarısız → yeniden gönderilir
+    store.record_delivery([key], True)
+    store.record_delivery([key], False)  # başka sohbet / parça başarısız: "sent" korunur
+    assert not store.add(sig, 4)
+    store.close()
+
+
+def test_prune_drops_old_closed_signals(tmp_path):
+    store = bot.SignalStore(str(tmp_path / "signals.sqlite"))
+    store.add(signal("OLD-USDT"), 1)
+    store.add(signal("OPEN-USDT"), 1)
+    store.add(signal("NEW-USDT"), 1)
+    old = time.time() - 10 * 86400
+    with store._lock:
+        store._conn.execute("UPDATE signals SET created = ? WHERE inst_id != 'NEW-USDT'", (old,))
+        store._conn.execute("UPDATE signals SET status = 'stop' WHERE inst_id != 'OPEN-USDT'")
+        store._conn.commit()
+    assert store.prune(retention_days=5) == 1
+    assert store.summary() == {"open": 1, "stop": 1}
+    store.close()
+
+
+def test_delivery_outcome_recorded_in_signal_store(mock_api, tmp_path, monkeypatch):
+    monkeypatch.setattr(bot, "SIGNAL_DB_PATH", str(tmp_path / "signals.sqlite"))
+    monkeypatch.setattr(bot, "SIGNAL_STORE", None)
+    store = bot.get_signal_store()
+    sent, dropped = signal("SENT-USDT"), signal("DROP-USDT")
+    assert store.add(sent, 1) and store.add(dropped, 1)
+
+    mock_api.telegram_script.append({"ok": False, "error_code": 403, "description": "Forbidden"})
+    delivery = bot.TelegramDelivery(
+        "test", ["42"], api=mock_api.base_url, outbox_path=str(tmp_path / "outbox.sqlite")
+    ).start()
+    try:
+        delivery.send("düşecek", ref=bot.signal_ref([dropped]))
+        delivery.send("gidecek", ref=bot.signal_ref([sent]))
+        assert delivery.flush(10) == 0
+        stats = delivery.stats()
+    finally:
+        delivery.stop()
+    assert stats["dropped"] == 1 and stats["sent"] == 1
+    assert store.add(dropped, 2)
+    assert not store.add(sent, 2)
+    store.close()
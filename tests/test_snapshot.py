@@ -0,0 +1,53 @@
+import threading
+import time
+
+import pytest
+
+from conftest import bot
+
+
+def test_failed_load_is_not_cached():
+    snap = bot.MarketSnapshot()
+    results = iter([None, {"ok": 1}])
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return next(results)
+
+    assert snap.get(("books", "X", 5), loader) is None
+    assert snap.lookup(("books", "X", 5)) == (False, None)
+    assert snap.get(("books", "X", 5), loader) == {"ok": 1}
+    assert snap.get(("books", "X", 5), loader) == {"ok": 1}
+    assert len(calls) == 2
+
+
+def test_coalesced_waiters_get_owner_result():
+    for value in (None, [1, 2, 3]):
+        snap = bot.MarketSnapshot()
+        started = threading.Event()
+        release = threading.Event()
+
+        def loader():
+            started.set()
+            release.wait(5)
+            return value
+
+        out = []
+        owner = threading.Thread(target=lambda: out.append(snap.get("k", loader)))
+        owner.start()
+        started.wait(5)
+        waiters = [threading.Thread(target=lambda: out.append(snap.get("k", loader))) for _ in range(3)]
+        for t in waiters:
+            t.start()
+        deadline = time.monotonic() + 5
+        while snap.stats()["coalesced"] < 3:
+            if time.monotonic() > deadline:
+                release.set()
+                pytest.fail("bekleyen istekler birleştirilmedi")
+            time.sleep(0.01)
+        release.set()
+        for t in [owner] + waiters:
+            t.join(5)
+        assert out == [value] * 4
+        assert snap.stats()["fetched"] == 1
@@ -0,0 +1,43 @@
+import random
+
+import pytest
+
+import main_premium_pro as bot
+
+pytest.importorskip("numpy")
+
+
+def random_series(rng, n, gap_every=0):
+    rows = []
+    px = rng.uniform(0.5, 500)
+    for k in range(n):
+        o = px
+        c = o * (1 + rng.gauss(0, 0.01))
+        if gap_every and k % gap_every == 0:
+            c = o * (1.05 if rng.random() < 0.5 else 0.95)  # FVG / kırılım üreten sıçrama
+        h = max(o, c) * (1 + rng.random() * 0.004)
+        lo = min(o, c) * (1 - rng.random() * 0.004)
+        rows.append((k * 3_600_000, o, h, lo, c, 1.0, c, 1))
+        px = c
+    return bot.CandleSeries.from_rows(rows)
+
+
+@pytest.mark.parametrize("lookback", [bot.STRUCT_LOOKBACK_1H, bot.STRUCT_LOOKBACK_4H, 3])
+def test_batch_structure_matches_compute_structure(lookback):
+    rng = random.Random(lookback)
+    lengths = [0, 1, 2, 3, lookback + 1, lookback + 2, lookback + 3] + [rng.randint(30, 320) for _ in range(40)]
+    candle_map = {
+        f"S{k}-USDT": random_series(rng, n, gap_every=rng.choice([0, 7, 13, 29])) for k, n in enumerate(lengths)
+    }
+    batch = bot.batch_structure(candle_map, lookback)
+    assert set(batch) == set(candle_map)
+    for inst_id, candles in candle_map.items():
+        assert batch[inst_id] == bot.compute_structure(candles, lookback), inst_id
+
+
+def test_batch_structure_matches_on_mock_candles(mock_api):
+    symbols = bot.get_spot_usdt_top_symbols()[:30]
+    candle_map = {s: bot.get_candles(s, bar="4H", limit=bot.CANDLE_LIMIT_4H) for s in symbols}
+    batch = bot.batch_structure(candle_map, bot.STRUCT_LOOKBACK_4H)
+    for inst_id, candles in candle_map.items():
+        assert batch[inst_id] == bot.compute_structure(candles, bot.STRUCT_LOOKBACK_4H), inst_id
@@ -0,0 +1,108 @@
+import time
+
+from conftest import bot
+
+
+def _delivery(mock_api, outbox_path=""):
+    return bot.TelegramDelivery("test", ["42"], api=mock_api.base_url, outbox_path=outbox_path)
+
+
+def test_split_message_respects_limit_and_lines():
+    text = "\n".join(f"satır {i} " + "x" * (i % 40) for i in range(400))
+    chunks = bot.split_message(text, limit=500)
+    assert len(chunks) > 1
+    assert all(len(c) <= 500 for c in chunks)
+    assert "\n".join(chunks) == text
+    long_line = "y" * 1200
+    assert bot.split_message(long_line, limit=500) == [long_line[:500], long_line[500:1000], long_line[1000:]]
+    assert bot.split_message("\n\n  \n") == []
+
+
+def test_split_message_counts_utf16_units():
+    # Emoji 2 UTF-16 birimi: karakter sayısı limitin altında kalsa da Telegram'ın sınırını aşar
+    text = "\n".join("🚀 " + "x" * 10 for _ in range(100))
+    chunks = bot.split_message(text, limit=100)
+    assert all(bot.utf16_len(c) <= 100 for c in chunks)
+    assert "\n".join(chunks) == text
+    assert bot.split_message("🚀" * 5, limit=4) == ["🚀🚀", "🚀🚀", "🚀"]
+
+
+def test_long_message_delivered_in_order(mock_api):
+    delivery = _delivery(mock_api).start()
+    try:
+        text = "\n".join(f"{i:05d} " + "z" * 90 for i in range(200))
+        n = delivery.send(text)
+        assert n > 1
+        assert delivery.flush(10) == 0
+    finally:
+        delivery.stop()
+    texts = [m["text"] for m in mock_api.messages]
+    assert len(texts) == n
+    assert "\n".join(texts) == text
+    assert all(len(t) <= bot.TELEGRAM_MAX_CHARS for t in texts)
+
+
+def test_rate_limit_waits_retry_after(mock_api):
+    mock_api.telegram_script.append(
+        {"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+         "parameters": {"retry_after": 1}}
+    )
+    delivery = _delivery(mock_api).start()
+    try:
+        t0 = time.monotonic()
+        delivery.send("*merhaba*")
+        assert delivery.flush(10) == 0
+        elapsed = time.monotonic() - t0
+        stats = delivery.stats()
+    finally:
+        delivery.stop()
+    assert elapsed >= 0.9
+    assert stats["rate_limited"] == 1
+    assert [m["text"] for m in mock_api.messages] == ["*merhaba*"]
+
+
+def test_markdown_parse_error_falls_back_to_plain_text(mock_api):
+    mock_api.telegram_script.append(
+        {"ok": False, "error_code": 400, "description": "Bad Request: can't parse entities: unclosed tag"}
+    )
+    delivery = _delivery(mock_api).start()
+    try:
+        delivery.send("*kapanmamış")
+        assert delivery.flush(10) == 0
+        stats = delivery.stats()
+    finally:
+        delivery.stop()
+    assert len(mock_api.messages) == 1
+    assert mock_api.messages[0]["text"] == "*kapanmamış"
+    assert "parse_mode" not in mock_api.messages[0]
+    assert stats["dropped"] == 0
+
+
+def test_outbox_replayed_on_next_start_and_stale_rows_expire(mock_api, tmp_path, monkeypatch):
+    path = str(tmp_path / "outbox.sqlite")
+    # Önceki run: teslim edilemeden kalan iki parça; biri eski
+    outbox = bot.TelegramOutbox(path)
+    outbox.enqueue(["42"], ["eski sinyal"])
+    outbox.enqueue(["42"], ["birinci", "ikinci"])
+    with outbox._lock:
+        outbox._conn.execute("UPDATE outbox SET created = ? WHERE text = ?",
+                             (time.time() - bot.TELEGRAM_MAX_AGE_S - 60, "eski sinyal"))
+        outbox._conn.commit()
+    outbox.close()
+
+    delivery = _delivery(mock_api, outbox_path=path).start()
+    try:
+        assert delivery.flush(10) == 0
+        stats = delivery.stats()
+    finally:
+        delivery.stop()
+    assert [m["text"] for m in mock_api.messages] == ["birinci", "ikinci"]
+    assert stats["expired"] == 1
+
+
+def test_default_outbox_path_resolved_at_construction(mock_api, tmp_path, monkeypatch):
+    path = str(tmp_path / "outbox.sqlite")
+    monkeypatch.setattr(bot, "TELEGRAM_OUTBOX_PATH", path)
+    delivery = bot.TelegramDelivery("test", ["42"], api=mock_api.base_url)
+    assert delivery.outbox.path == path
+    delivery.outbox.close()
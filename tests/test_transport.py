@@ -0,0 +1,56 @@
+import json
+
+import pytest
+
+from conftest import bot
+
+
+class Response:
+    def __init__(self, status, body=None, headers=None):
+        self.status_code = status
+        self.content = json.dumps(body).encode() if body is not None else b"<html>"
+        self.headers = headers or {}
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class ScriptedSession:
+    def __init__(self, script):
+        self.script = list(script)
+        self.calls = 0
+
+    def get(self, url, params=None, timeout=None):
+        self.calls += 1
+        item = self.script.pop(0)
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+
+OK = Response(200, {"code": "0", "data": [{"x": 1}]})
+
+
+@pytest.mark.parametrize(
+    "script, calls, waits, ok",
+    [
+        ([Response(200, {"code": "51001", "msg": "Instrument ID does not exist", "data": []})], 1, [], False),
+        ([Response(404)], 1, [], False),
+        ([Response(500)] * 3, 3, [(0, None), (1, None)], False),
+        ([Response(200, {"code": "50011", "data": []}), OK], 2, [(0, None)], True),
+        ([Response(429, headers={"Retry-After": "2"}), OK], 2, [(0, 2.0)], True),
+        ([ConnectionError("reset"), OK], 2, [(0, None)], True),
+    ],
+)
+def test_retry_policy(script, calls, waits, ok, monkeypatch):
+    monkeypatch.setattr(bot, "RATE_LIMITS", {})
+    transport = bot.HttpTransport()
+    transport.session = ScriptedSession(script)
+    slept = []
+    monkeypatch.setattr(transport, "backoff", lambda attempt, retry_after=None: slept.append((attempt, retry_after)))
+    j = transport.get_json("https://www.okx.com/api/v5/market/ticker", {"instId": "X"}, retries=3,
+                           accept=bot._okx_accept)
+    assert (j is not None) == ok
+    assert transport.session.calls == calls
+    # Son denemeden sonra beklenmez
+    assert slept == waits